@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Compare searching a directory with and without the trigram index.
+
+Example:
+
+    python3 benchmark_search.py ~/some/big/project 'def main' 'TODO'
+
+The index is created in a temporary directory, so this doesn't touch
+Porcupine's real cache.
+"""
+
+import argparse
+import concurrent.futures
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from porcupine import _trigramindex, dirs
+from porcupine.plugins import find_in_files
+
+
+def search(paths, pattern, executor):
+    # returns number of matches, like the Find in Files tab would find
+    batch_size = find_in_files._BATCH_SIZE
+    futures = [executor.submit(find_in_files._search_files,
+                               paths[i:i+batch_size], re.escape(pattern), 0,
+                               'utf-8')
+               for i in range(0, len(paths), batch_size)]
+    return sum(len(matches) for future in futures
+               for path, matches in future.result())
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (result, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory')
+    parser.add_argument('queries', nargs='+', metavar='query')
+    args = parser.parse_args()
+
+    dirs.cachedir = tempfile.mkdtemp()
+    stop_event = threading.Event()
+    try:
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            paths, seconds = timed(list, find_in_files._iter_files(
+                args.directory, stop_event))
+            print("found %d files in %.2fs" % (len(paths), seconds))
+
+            index = _trigramindex.TrigramIndex(args.directory)
+            junk, seconds = timed(index.update, paths, executor, stop_event)
+            print("created the index in %.2fs" % seconds)
+            junk, seconds = timed(index.update, paths, executor, stop_event)
+            print("updated the index without changes in %.2fs" % seconds)
+            print()
+
+            print("%-20s  %12s  %12s  %10s  %7s" % (
+                "query", "brute force", "with index", "candidates",
+                "matches"))
+            for query in args.queries:
+                brute_count, brute_seconds = timed(
+                    search, paths, query, executor)
+
+                start = time.perf_counter()
+                candidates = index.find_candidates(
+                    find_in_files._get_index_literals(
+                        query, False, False, 'utf-8'))
+                candidates = [path for path in paths if path in candidates]
+                index_count = search(candidates, query, executor)
+                index_seconds = time.perf_counter() - start
+
+                assert index_count == brute_count
+                print("%-20s  %11.3fs  %11.3fs  %10d  %7d" % (
+                    query, brute_seconds, index_seconds, len(candidates),
+                    brute_count))
+            index.close()
+    finally:
+        shutil.rmtree(dirs.cachedir)
+
+
+if __name__ == '__main__':
+    main()
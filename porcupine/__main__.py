@@ -1,11 +1,16 @@
 """Parse arguments and run Porcupine using ``_run.py``."""
 
 import argparse
+import codecs
+import itertools
 import logging
 import os
 import sys
+import threading
 
-from porcupine import pluginloader, get_tab_manager, tabs, utils
+from porcupine import (_ipc, _startupprofile, get_main_window,
+                       get_tab_manager, pluginloader, tabs, utils)
+from porcupine._run import _iter_queue, _open_paths
 import porcupine.plugins    # .plugins for porcupine.plugins.__path__
 
 log = logging.getLogger(__name__)
@@ -47,13 +52,177 @@ class _ExtendAction(argparse.Action):
 _EPILOG = r"""
 Examples:
   %(prog)s                    # run Porcupine normally
-  %(prog)s file1.py file2.js  # open the given files on startup
+  %(prog)s file1.py file2.js  # open the given files on startup, or in an
+                              # already running Porcupine if there is one
   %(prog)s -nnn               # create 3 new files
   %(prog)s --no-plugins       # understand the power of plugins
   %(prog)s --verbose          # produce lots of nerdy output
+  %(prog)s --profile-startup  # find out why Porcupine starts slowly
 """
 
 
+def _finish_startup_profile():
+    # drawing happens in idle callbacks, so this runs when the window
+    # has been drawn for the first time
+    get_main_window().update_idletasks()
+    _startupprofile.mark("first paint")
+    report_path, trace_path = _startupprofile.finish()
+    print("Wrote the startup profile to '%s' and a Chrome trace to '%s'."
+          % (report_path, trace_path), file=sys.stderr)
+
+
+# a chunk of stdin is shown as soon as it arrives, but reading more at
+# once is faster if there's a lot of input
+_STDIN_CHUNK_SIZE = 64*1024
+
+
+def _get_file_messages(files):
+    # paths are sent to other processes, so they must be absolute
+    messages = []
+    for file in files:
+        if file is None:
+            # -n or --new-file was used
+            messages.append(('new',))
+        elif file != '-':
+            messages.append(('open', os.path.abspath(file)))
+    return messages
+
+
+def _iter_stdin_messages(stdin_count):
+    # this blocks until stdin is closed, so it runs in a thread or while
+    # sending stuff to another porcupine
+    #
+    # - can be given multiple times, each - reads until EOF so this works:
+    #
+    #   $ porcupine - -
+    #   bla bla bla
+    #   ^D
+    #   bla bla
+    #   ^D
+    if sys.stdin is None:
+        # e.g. pythonw on windows
+        return
+
+    decoder = codecs.getincrementaldecoder(
+        sys.stdin.encoding or 'utf-8')(errors='replace')
+    for number in range(stdin_count):
+        stream_id = '%d-%d' % (os.getpid(), number)
+        yield ('stdin_start', stream_id)
+        while True:
+            # read1() returns whatever is available instead of waiting
+            # until it gets _STDIN_CHUNK_SIZE bytes
+            chunk = sys.stdin.buffer.read1(_STDIN_CHUNK_SIZE)
+            text = decoder.decode(chunk, final=(not chunk))
+            if text:
+                yield ('stdin_data', stream_id, text)
+            if not chunk:
+                break
+
+        decoder.reset()
+        yield ('stdin_end', stream_id)
+
+
+def _read_stdin_to_queue(message_queue, stdin_count):
+    for message in _iter_stdin_messages(stdin_count):
+        message_queue.put(message)
+
+
+_stdin_tabs = {}    # {stream_id: tab}
+
+
+def _append_stdin_data(stream_id, text):
+    tab = _stdin_tabs.get(stream_id)
+    if tab is None or not tab.winfo_exists():
+        return      # the tab was closed
+
+    # follow mode: if the end of the text was visible before adding the
+    # text, make sure that it's visible after adding too, but don't
+    # annoy the user if they scrolled up to look at something
+    widget = tab.textwidget
+    following = (widget.yview()[1] == 1.0)
+    widget.insert('end - 1 char', text)
+    if following:
+        widget.see('end - 1 char')
+
+
+def _handle_message(message, paths_to_open):
+    kind, *args = message
+    tabmanager = get_tab_manager()
+
+    if kind == 'open':
+        [path] = args
+        paths_to_open.append(path)
+
+    elif kind == 'new':
+        tabmanager.add_tab(tabs.FileTab(tabmanager))
+
+    elif kind == 'focus':
+        window = get_main_window()
+        window.deiconify()
+        window.lift()
+
+    elif kind == 'stdin_start':
+        [stream_id] = args
+        tab = tabmanager.add_tab(tabs.FileTab(tabmanager))
+        # undoing parts of the input would be confusing
+        tab.textwidget['undo'] = False
+        tab.status = "Reading from stdin..."
+        _stdin_tabs[stream_id] = tab
+
+    elif kind == 'stdin_data':
+        stream_id, text = args
+        _append_stdin_data(stream_id, text)
+
+    elif kind == 'stdin_end':
+        [stream_id] = args
+        tab = _stdin_tabs.pop(stream_id, None)
+        if tab is not None and tab.winfo_exists():
+            tab.textwidget['undo'] = True
+            tab.textwidget.edit_reset()
+            tab.mark_saved()
+            tab.status = ''
+
+    else:
+        log.warning("unknown message: %r", message)
+
+
+# runs in the main thread, the thread started by _ipc.session() puts
+# messages from other porcupine processes to the queue, and so does the
+# thread that reads stdin
+def _handle_messages(message_queue):
+    paths_to_open = []
+    for message in _iter_queue(message_queue):
+        try:
+            _handle_message(message, paths_to_open)
+        except Exception:
+            log.exception("handling message %r failed", message)
+
+    if paths_to_open:
+        _open_paths(paths_to_open)
+
+    get_main_window().after(
+        _MESSAGE_POLL_INTERVAL, _handle_messages, message_queue)
+
+
+_MESSAGE_POLL_INTERVAL = 200    # milliseconds
+
+
+def _send_to_existing_instance(files):
+    # returns True if a porcupine that is already running got the files
+    messages = itertools.chain(
+        [('focus',)], _get_file_messages(files),
+        _iter_stdin_messages(files.count('-')))
+    try:
+        _ipc.send(messages)
+    except ConnectionRefusedError:
+        return False
+    except OSError as e:
+        # the other porcupine was probably closed while sending stdin
+        print("Sending to the running Porcupine failed: %s" % e,
+              file=sys.stderr)
+    return True
+
+
 def main():
     if os.path.basename(sys.argv[0]) == '__main__.py':
         prog = '%s -m porcupine' % utils.short_python_command
@@ -72,12 +241,17 @@ def main():
         help="find out where to install custom plugins")
     parser.add_argument(
         'files', metavar='FILES', action=_ExtendAction,
-        # FIXME: this uses the system-default encoding :/
-        nargs=argparse.ZERO_OR_MORE, type=argparse.FileType("r"),
-        help="open these files when Porcupine starts, - means stdin")
+        nargs=argparse.ZERO_OR_MORE,
+        help=("open these files when Porcupine starts, - means stdin and "
+              "it's shown while it's being read"))
     parser.add_argument(
         '-n', '--new-file', dest='files', action='append_const', const=None,
         help='create a "New File" tab, may be given multiple times')
+    parser.add_argument(
+        '--new-instance', action='store_true',
+        help=("start a new Porcupine even if Porcupine is already running, "
+              "this is implied by --verbose, --profile-startup and the "
+              "plugin loading options"))
 
     plugingroup = parser.add_argument_group("plugin loading options")
     plugingroup.add_argument(
@@ -98,30 +272,37 @@ def main():
         '--verbose', action='store_true',
         help=("print all logging messages to stderr, only warnings and errors "
               "are printed by default"))
+    parser.add_argument(
+        '--profile-startup', action='store_true',
+        help=("measure how long each part of starting Porcupine takes and "
+              "write a report to the cache directory"))
+    parser.add_argument(
+        '--cprofile', action='store_true',
+        help="also use cProfile with --profile-startup")
 
     args = parser.parse_args()
+    if args.cprofile and not args.profile_startup:
+        parser.error("--cprofile can only be used with --profile-startup")
+    if args.profile_startup:
+        # argument parsing and importing porcupine aren't included, they
+        # are fast compared to everything else
+        _startupprofile.enable(use_cprofile=args.cprofile)
 
-    filelist = []
-    for file in args.files:
-        if file is sys.stdin:
-            # don't close stdin so it's possible to do this:
-            #
-            #   $ porcupine - -
-            #   bla bla bla
-            #   ^D
-            #   bla bla
-            #   ^D
-            filelist.append((None, file.read()))
-        elif file is None:
-            # -n or --new-file was used
-            filelist.append((None, ''))
-        else:
-            with file:
-                filelist.append((os.path.abspath(file.name), file.read()))
+    phase = _startupprofile.phase
+
+    # these options change how this process runs, so they don't make
+    # sense with a porcupine that is already running
+    use_existing_instance = not (
+        args.new_instance or args.verbose or args.profile_startup or
+        not args.yes_plugins or args.without_plugin or args.shuffle_plugins)
+    if use_existing_instance and _send_to_existing_instance(args.files):
+        return
 
-    porcupine.init(verbose_logging=args.verbose)
+    with phase("porcupine.init()"):
+        porcupine.init(verbose_logging=args.verbose)
     if args.yes_plugins:
-        plugin_names = pluginloader.find_plugins()
+        with phase("find plugins"):
+            plugin_names = pluginloader.find_plugins()
         log.info("found %d plugins", len(plugin_names))
         for name in args.without_plugin:
             if name in plugin_names:
@@ -129,13 +310,24 @@ def main():
             else:
                 log.warning("no plugin named %r, cannot load without it", name)
 
-        pluginloader.load(plugin_names, shuffle=args.shuffle_plugins)
+        with phase("pluginloader.load()"):
+            pluginloader.load(plugin_names, shuffle=args.shuffle_plugins)
 
-    tabmanager = get_tab_manager()
-    for path, content in filelist:
-        tabmanager.add_tab(tabs.FileTab(tabmanager, content, path))
+    if _startupprofile.is_enabled():
+        get_main_window().after(0, _finish_startup_profile)
+
+    with _ipc.session() as message_queue:
+        with phase("open files"):
+            for message in _get_file_messages(args.files):
+                message_queue.put(message)
+            stdin_count = args.files.count('-')
+            if stdin_count != 0:
+                threading.Thread(target=_read_stdin_to_queue,
+                                 args=[message_queue, stdin_count],
+                                 daemon=True).start()
+            _handle_messages(message_queue)
 
-    porcupine.run()
+        porcupine.run()
     log.info("exiting Porcupine successfully")
 
 
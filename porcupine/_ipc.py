@@ -1,4 +1,6 @@
+import binascii
 import contextlib
+import logging
 from multiprocessing import connection
 import os
 import queue
@@ -6,7 +8,13 @@ import threading
 
 from porcupine import dirs
 
-_ADDRESS_FILE = os.path.join(dirs.cachedir, 'ipc_address.txt')
+log = logging.getLogger(__name__)
+
+
+# this cannot be a global variable because tests load this module and
+# THEN change dirs.cachedir
+def _get_address_file():
+    return os.path.join(dirs.cachedir, 'ipc_address.txt')
 
 
 # the addresses contain random junk so they are very unlikely to
@@ -18,14 +26,18 @@ def send(objects):
 
     Raise ConnectionRefusedError if session() is not running.
     """
-    raise ConnectionRefusedError
     # reading the address file, connecting to a windows named pipe and
     # connecting to an AF_UNIX socket all raise FileNotFoundError :D
+    # connecting to a socket left behind by a porcupine that crashed
+    # raises ConnectionRefusedError, and ValueError means that the
+    # address file is messed up
     try:
-        with open(_ADDRESS_FILE, 'r') as file:
-            address = file.read().strip()
-        client = connection.Client(address)
-    except FileNotFoundError:
+        with open(_get_address_file(), 'r') as file:
+            address, authkey = file.read().split()
+        client = connection.Client(
+            address, authkey=binascii.unhexlify(authkey))
+    except (FileNotFoundError, ConnectionRefusedError, ValueError,
+            connection.AuthenticationError):
         raise ConnectionRefusedError("session() is not running") from None
 
     with client:
@@ -33,6 +45,15 @@ def send(objects):
             client.send(message)
 
 
+def _client2queue(client, object_queue):
+    with client:
+        while True:
+            try:
+                object_queue.put(client.recv())
+            except (EOFError, OSError):
+                break
+
+
 def _listener2queue(listener, object_queue):
     """Accept connections. Receive and queue objects."""
     while True:
@@ -41,13 +62,15 @@ def _listener2queue(listener, object_queue):
         except OSError:
             # it's closed
             break
+        except connection.AuthenticationError:
+            log.warning("someone tried to connect without the correct "
+                        "authkey")
+            continue
 
-        with client:
-            while True:
-                try:
-                    object_queue.put(client.recv())
-                except EOFError:
-                    break
+        # a client that sends its stdin may stay connected for a long
+        # time, and that must not prevent other clients from connecting
+        threading.Thread(target=_client2queue, args=[client, object_queue],
+                         daemon=True).start()
 
 
 @contextlib.contextmanager
@@ -62,13 +85,48 @@ def session():
             # the application
     """
     message_queue = queue.Queue()
-    with connection.Listener() as listener:
-        with open(_ADDRESS_FILE, 'w') as file:
-            print(listener.address, file=file)
+
+    # the authkey makes sure that other users can't send stuff to this
+    # process, the address file is readable only by the current user
+    authkey = os.urandom(32)
+    listener = None
+    try:
+        listener = connection.Listener(authkey=authkey)
+        address_content = '%s\n%s\n' % (
+            listener.address, binascii.hexlify(authkey).decode('ascii'))
+
+        # os.open() doesn't change the permissions of an existing file
+        try:
+            os.remove(_get_address_file())
+        except FileNotFoundError:
+            pass
+        fd = os.open(_get_address_file(),
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as file:
+            file.write(address_content)
+    except OSError:
+        # this shouldn't prevent running the application
+        log.exception("cannot listen for other processes")
+        if listener is not None:
+            listener.close()
+        yield message_queue
+        return
+
+    with listener:
         thread = threading.Thread(target=_listener2queue,
                                   args=[listener, message_queue], daemon=True)
         thread.start()
-        yield message_queue
+        try:
+            yield message_queue
+        finally:
+            # if another process started a session after this one, its
+            # address file must not be removed
+            try:
+                with open(_get_address_file(), 'r') as file:
+                    if file.read() == address_content:
+                        os.remove(_get_address_file())
+            except OSError:
+                pass
 
 
 if __name__ == '__main__':
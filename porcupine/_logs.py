@@ -1,29 +1,59 @@
+import atexit
 import glob
-import itertools
 import logging
+import logging.handlers
 import os
 import platform
+import queue
 import shlex
-import shutil
 import subprocess
 import sys
 import threading
 import time
 
 import porcupine
-from porcupine import dirs
+from porcupine import _startupprofile, dirs
 
 log = logging.getLogger(__name__)
 DAYS = 60*60*24       # seconds in 1 day
 
+# each porcupine process writes to its own file, and when a file gets
+# this big it's renamed to log-blahblah.txt.1 and a new file is started
+_MAX_LOG_SIZE = 1024*1024
+_MAX_AGE = 3*DAYS
+_MAX_TOTAL_SIZE = 20*_MAX_LOG_SIZE
 
-def _remove_old_logs():
-    pattern = os.path.join(glob.escape(dirs.cachedir), 'log*.txt')
-    for filename in glob.glob(pattern):
-        path = os.path.join(dirs.cachedir, filename)
-        if time.time() - os.path.getmtime(path) > 3*DAYS:
-            log.info("'%s' is more than 3 days old, removing it")
-            os.remove(path)
+
+def _remove_old_logs(current_logfile):
+    # this runs in a thread, so it doesn't matter if there are lots of
+    # old log files
+    current_logfile = os.path.abspath(current_logfile)
+    paths = []
+    for path in glob.glob(os.path.join(glob.escape(dirs.cachedir),
+                                       'log*.txt*')):
+        # the current process may rename its file at any time
+        if os.path.abspath(path).startswith(current_logfile):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue        # another porcupine removed it
+        paths.append((stat.st_mtime, stat.st_size, path))
+
+    # remove files that are too old, and then the oldest files until
+    # they don't use too much disk space
+    total_size = sum(size for mtime, size, path in paths)
+    for mtime, size, path in sorted(paths):
+        if (time.time() - mtime > _MAX_AGE or
+                total_size > _MAX_TOTAL_SIZE):
+            log.info("removing old log file '%s'", path)
+            try:
+                os.remove(path)
+            except OSError as e:
+                # e.g. another porcupine is using it on windows
+                log.info("cannot remove '%s': %s", path, e)
+                continue
+            total_size -= size
 
 
 def _run_command(command):
@@ -39,45 +69,63 @@ def _run_command(command):
                     exc_info=True)
 
 
+# the commands are slow, e.g. lsb_release is a python script on ubuntu so
+# running it takes about 0.12 seconds on this system, i really want
+# porcupine to start as fast as possible so this runs in a thread
+def _background_stuff(logfile_path):
+    with _startupprofile.phase("collect system information"):
+        log.debug("platform.system() returned %r", platform.system())
+        log.debug("platform.platform() returned %r", platform.platform())
+        if platform.system() != 'Windows':
+            _run_command('uname -a')
+            _run_command('lsb_release -a')
+
+    # don't fail to run if old logs can't be deleted for some reason
+    try:
+        with _startupprofile.phase("remove old logs"):
+            _remove_old_logs(logfile_path)
+    except OSError:
+        log.exception("unexpected problem with removing old log files")
+
+
 def setup(verbose):
     print_handler = logging.StreamHandler(sys.stderr)
     print_handler.setLevel(logging.DEBUG if verbose else logging.WARNING)
+    print_handler.setFormatter(
+        logging.Formatter("[%(levelname)s] %(name)s: %(message)s"))
 
-    # an iterator 'log.txt', 'log2.txt', 'log3.txt', ...
-    filenames = itertools.chain(
-        ['log.txt'],
-        map('log{}.txt'.format, itertools.count(start=2)),
-    )
-    for filename in filenames:
-        logfile_path = os.path.join(dirs.cachedir, filename)
-        try:
-            # x means create without overwriting
-            file_handler = logging.FileHandler(logfile_path, 'x')
-        except FileExistsError:
-            continue
-        file_handler.setLevel(logging.DEBUG)
-        break
+    # the pid makes the name unique, so there's no need to try different
+    # file names until one of them doesn't exist
+    logfile_path = os.path.join(dirs.cachedir, 'log-%s-%d.txt' % (
+        time.strftime('%Y-%m-%d-%H-%M-%S'), os.getpid()))
+    file_handler = logging.handlers.RotatingFileHandler(
+        logfile_path, maxBytes=_MAX_LOG_SIZE, backupCount=1,
+        encoding='utf-8', delay=True)
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(
+        logging.Formatter("[%(levelname)s] %(name)s: %(message)s"))
+
+    # the file is written in a separate thread, so lots of debug
+    # messages don't slow down the GUI
+    log_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+
+    # atexit runs things in reverse order and logging registers its
+    # atexit stuff when it's imported, so this runs before that
+    atexit.register(file_handler.close)
+    atexit.register(listener.stop)
 
-    logging.basicConfig(level=logging.DEBUG,  # no idea why this is needed
-                        handlers=[print_handler, file_handler],
-                        format="[%(levelname)s] %(name)s: %(message)s")
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG)
+    root_logger.addHandler(print_handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
     log.debug("starting Porcupine %s from '%s'", porcupine.__version__,
               porcupine.__path__[0])
     log.debug("PID %d, log file '%s'", os.getpid(), logfile_path)
     log.debug("running on Python %d.%d.%d from '%s'",
               *(list(sys.version_info[:3]) + [sys.executable]))
-    log.debug("platform.system() returned %r", platform.system())
-    log.debug("platform.platform() returned %r", platform.platform())
-    if platform.system() != 'Windows':
-        # lsb_release is a python script on ubuntu so running it takes
-        # about 0.12 seconds on this system, i really want porcupine to
-        # start as fast as possible
-        _run_command('uname -a')
-        threading.Thread(target=_run_command, args=['lsb_release -a']).start()
 
-    # don't fail to run if old logs can't be deleted for some reason
-    try:
-        _remove_old_logs()
-    except OSError:
-        log.exception("unexpected problem with removing old log files")
+    threading.Thread(target=_background_stuff, args=[logfile_path],
+                     daemon=True).start()
@@ -4,11 +4,10 @@ import functools
 import logging
 from queue import Empty         # queue is a handy variable name
 import tkinter
-import traceback
 import webbrowser
 
-from porcupine import (_dialogs, _logs, actions, filetypes, dirs,
-                       settings, tabs, utils)
+from porcupine import (_dialogs, _logs, _startupprofile, actions, filetypes,
+                       dirs, settings, tabs, utils)
 
 log = logging.getLogger(__name__)
 
@@ -32,18 +31,27 @@ def init(verbose_logging=False):
     if _root is not None or _tab_manager is not None:
         raise RuntimeError("cannot init() twice")
 
-    dirs.makedirs()
-    _logs.setup(verbose_logging)
-    _root = tkinter.Tk()
-    _root.protocol('WM_DELETE_WINDOW', quit)
-    filetypes._init()
-
-    _tab_manager = tabs.TabManager(_root)
-    _tab_manager.pack(fill='both', expand=True)
-    for binding, callback in _tab_manager.bindings:
-        _root.bind(binding, callback, add=True)
-
-    _setup_actions()
+    phase = _startupprofile.phase
+    with phase("dirs.makedirs()"):
+        dirs.makedirs()
+    with phase("_logs.setup()"):
+        _logs.setup(verbose_logging)
+    with phase("create the main window"):
+        _root = tkinter.Tk()
+        _root.protocol('WM_DELETE_WINDOW', quit)
+    with phase("filetypes._init()"):
+        filetypes._init()
+    with phase("settings._init()"):
+        settings._init()    # plugins use settings when they're imported
+
+    with phase("create the tab manager"):
+        _tab_manager = tabs.TabManager(_root)
+        _tab_manager.pack(fill='both', expand=True)
+        for binding, callback in _tab_manager.bindings:
+            _root.bind(binding, callback, add=True)
+
+    with phase("add actions"):
+        _setup_actions()
 
 
 def get_init_kwargs():
@@ -102,16 +110,7 @@ def _setup_actions():
         _tab_manager.add_tab(tabs.FileTab(_tab_manager))
 
     def open_files():
-        for path in _dialogs.open_files():
-            try:
-                tab = tabs.FileTab.open_file(_tab_manager, path)
-            except (UnicodeError, OSError) as e:
-                log.exception("opening '%s' failed", path)
-                utils.errordialog(type(e).__name__, "Opening failed!",
-                                  traceback.format_exc())
-                continue
-
-            _tab_manager.add_tab(tab)
+        _open_paths(_dialogs.open_files())
 
     def close_selected_tab():
         tab = _tab_manager.select()
@@ -180,6 +179,45 @@ def _setup_actions():
              "https://docs.python.org/")
 
 
+def _open_paths(paths):
+    # the files are read in threads, so a big file or a slow network
+    # drive doesn't freeze everything, but the tabs are added in the
+    # same order as the paths
+    paths = list(paths)
+    results = [None] * len(paths)     # [(success, content_or_traceback)]
+    encoding = settings.get_section('General')['encoding']
+    next_index = 0
+
+    def add_tabs():
+        nonlocal next_index
+        while next_index < len(paths) and results[next_index] is not None:
+            path = paths[next_index]
+            success, result = results[next_index]
+            results[next_index] = ()    # free memory, but not None
+            next_index += 1
+
+            if success:
+                _tab_manager.add_tab(
+                    tabs.FileTab(_tab_manager, result, path))
+            else:
+                log.error("opening '%s' failed\n%s", path, result)
+                utils.errordialog("Opening failed",
+                                  "Opening '%s' failed!" % path, result)
+
+    for index, path in enumerate(paths):
+        # the default arguments make each function use its own path and
+        # index, not the values from the last iteration
+        def read_file(path=path):
+            with open(path, 'r', encoding=encoding) as file:
+                return file.read()
+
+        def on_done(success, result, index=index):
+            results[index] = (success, result)
+            add_tabs()
+
+        utils.run_in_thread(read_file, on_done)
+
+
 def _iter_queue(queue):
     while True:
         try:
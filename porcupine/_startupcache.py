@@ -0,0 +1,79 @@
+"""Things that are slow to compute on every startup are cached here.
+
+Each cached value has a key that describes where the value came from,
+e.g. the modification time of a config file or the version of a
+library. If the key doesn't match the key that the value was saved
+with, the value is considered outdated.
+"""
+
+import json
+import logging
+import os
+
+from porcupine import dirs
+
+log = logging.getLogger(__name__)
+
+# {name: [key, value]}, None if not loaded yet
+_cache = None
+
+
+# this cannot be a global variable because tests load this module
+# and THEN change dirs.cachedir
+def _get_path():
+    return os.path.join(dirs.cachedir, 'startup_cache.json')
+
+
+def _load_cache():
+    global _cache
+    if _cache is not None:
+        return
+
+    try:
+        with open(_get_path(), 'r', encoding='utf-8') as file:
+            _cache = json.load(file)
+        if not isinstance(_cache, dict):
+            raise ValueError("the JSON is not an object")
+    except FileNotFoundError:
+        _cache = {}
+    except (OSError, UnicodeError, ValueError):
+        log.warning("cannot read '%s', ignoring it", _get_path(),
+                    exc_info=True)
+        _cache = {}
+
+
+def load(name, key):
+    """Return a cached value or None if it's missing or outdated.
+
+    The *key* must be JSON-serializable, and it's compared to the key
+    that was passed to :func:`save` when the value was saved.
+    """
+    _load_cache()
+    try:
+        saved_key, value = _cache[name]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    # the key went through json, so tuples became lists etc
+    if saved_key != json.loads(json.dumps(key)):
+        log.debug("cached %r is outdated", name)
+        return None
+    return value
+
+
+def save(name, key, value):
+    """Save a JSON-serializable value to the cache file.
+
+    The file is replaced atomically, so a crash in the middle of
+    writing it doesn't leave a broken cache file behind.
+    """
+    _load_cache()
+    _cache[name] = [key, value]
+
+    temp_path = _get_path() + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(_cache, file)
+        os.replace(temp_path, _get_path())
+    except OSError:
+        log.warning("cannot write '%s'", _get_path(), exc_info=True)
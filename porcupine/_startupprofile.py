@@ -0,0 +1,153 @@
+"""Timing for the ``--profile-startup`` option.
+
+Startup code wraps its phases in :func:`phase`, which does nothing
+unless :func:`enable` has been called. When the window has been drawn
+for the first time, :func:`finish` writes a text report and a trace file
+that can be opened in Chrome's ``chrome://tracing`` page (or any other
+program that understands the Trace Event Format) to the cache directory.
+"""
+
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+from porcupine import dirs
+
+log = logging.getLogger(__name__)
+
+_enabled = False
+_start_time = None
+_profile = None         # a cProfile.Profile or None
+_events = []            # [(name, category, thread_id, depth, start, end)]
+_local = threading.local()      # depth of nested phases in each thread
+
+
+def enable(use_cprofile=False):
+    """Start recording phases.
+
+    If *use_cprofile* is True, the main thread is also profiled with
+    :mod:`cProfile` until :func:`finish` is called.
+    """
+    global _enabled
+    global _start_time
+    global _profile
+
+    _enabled = True
+    _start_time = time.perf_counter()
+    if use_cprofile:
+        _profile = cProfile.Profile()
+        _profile.enable()
+
+
+def is_enabled():
+    return _enabled
+
+
+@contextlib.contextmanager
+def phase(name, category='startup'):
+    """A context manager that records how long the with block takes.
+
+    Phases may be nested, and they may run in any thread.
+    """
+    if not _enabled:
+        yield
+        return
+
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        _local.depth = depth
+        _events.append((name, category, threading.get_ident(), depth,
+                        start, end))
+
+
+def mark(name, category='startup'):
+    """Record something that happens at a point in time, e.g. first paint."""
+    if _enabled:
+        now = time.perf_counter()
+        _events.append((name, category, threading.get_ident(),
+                        getattr(_local, 'depth', 0), now, now))
+
+
+def _ms(seconds):
+    return seconds * 1000
+
+
+def _create_report():
+    main_thread = threading.main_thread().ident
+    lines = ["Porcupine startup profile", ""]
+
+    lines.append("%9s  %9s  %s" % ("start", "duration", "phase"))
+    for name, category, thread_id, depth, start, end in sorted(
+            _events, key=(lambda event: (event[4], event[3]))):
+        thread_note = '' if thread_id == main_thread else '  (in a thread)'
+        lines.append("%7.1fms  %7.1fms  %s%s%s" % (
+            _ms(start - _start_time), _ms(end - start), '  '*depth, name,
+            thread_note))
+
+    plugin_events = [event for event in _events if event[1] == 'plugins']
+    if plugin_events:
+        lines.extend(["", "Slowest plugin imports and setups:"])
+        plugin_events.sort(key=(lambda event: event[5] - event[4]),
+                           reverse=True)
+        for name, category, thread_id, depth, start, end in plugin_events:
+            lines.append("%7.1fms  %s" % (_ms(end - start), name))
+
+    if _profile is not None:
+        stream = io.StringIO()
+        stats = pstats.Stats(_profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(40)
+        lines.extend(["", "cProfile output (main thread only):",
+                      stream.getvalue()])
+
+    return '\n'.join(lines) + '\n'
+
+
+def _create_trace():
+    trace_events = []
+    for name, category, thread_id, depth, start, end in _events:
+        event = {
+            'name': name,
+            'cat': category,
+            'pid': os.getpid(),
+            'tid': thread_id,
+            'ts': (start - _start_time) * 1000 * 1000,   # microseconds
+        }
+        if start == end:
+            event.update(ph='i', s='g')
+        else:
+            event.update(ph='X', dur=(end - start) * 1000 * 1000)
+        trace_events.append(event)
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def finish():
+    """Stop profiling and write the results to :data:`porcupine.dirs.cachedir`.
+
+    This returns a ``(report_path, trace_path)`` tuple.
+    """
+    global _enabled
+    if _profile is not None:
+        _profile.disable()
+    _enabled = False
+
+    report_path = os.path.join(dirs.cachedir, 'startup_profile.txt')
+    trace_path = os.path.join(dirs.cachedir, 'startup_trace.json')
+    with open(report_path, 'w', encoding='utf-8') as file:
+        file.write(_create_report())
+    with open(trace_path, 'w', encoding='utf-8') as file:
+        json.dump(_create_trace(), file)
+
+    log.info("wrote startup profile to '%s' and '%s'",
+             report_path, trace_path)
+    return (report_path, trace_path)
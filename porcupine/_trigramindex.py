@@ -0,0 +1,364 @@
+"""Trigram indexes for finding files that may contain some text.
+
+An index remembers which 3-byte sequences (trigrams) each file contains.
+If a file doesn't contain all trigrams of ``foobar``, it can't contain
+``foobar`` either, so most files don't need to be read at all when
+searching. The files that the index finds must still be searched
+normally because a file can contain ``foo``, ``oob``, ``oba`` and
+``bar`` without containing ``foobar``.
+
+Each directory has its own index in :data:`porcupine.dirs.cachedir`.
+The index is an SQLite database, and it's updated by re-reading only
+the files whose modification time or size changed.
+
+This module is imported in worker processes, so it must not use tkinter.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+
+from porcupine import dirs
+
+log = logging.getLogger(__name__)
+
+# increase this when changing the database format
+_VERSION = 1
+
+# there's a row for each (trigram, file) pair, so a typical source file
+# has a few thousand rows and a directory with 100k files can have
+# hundreds of millions of rows, which is a few gigabytes on disk and
+# makes the first update slow, but after that only changed files are
+# read again
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    indexed INTEGER NOT NULL    -- 0 for binary files, 1 for others
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    trigram BLOB NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trigrams_by_file ON trigrams (file_id);
+'''
+
+# files bigger than this are not indexed or searched
+MAX_FILE_SIZE = 10*1024*1024
+
+# reading files and finding their trigrams is done in worker processes
+_BATCH_SIZE = 100
+
+
+def _get_trigrams(content):
+    # the index doesn't care about ascii upper/lowercase, so it can be
+    # used for case-insensitive searches too
+    content = content.lower()
+    return {content[i:i+3] for i in range(len(content) - 2)}
+
+
+def _read_trigrams(paths):
+    # returns [(path, mtime_ns, size, trigrams_or_None)], this runs in a
+    # worker process, and mtime_ns and size are None for files that
+    # can't be read
+    result = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                if stat.st_size > MAX_FILE_SIZE:
+                    content = None
+                else:
+                    content = file.read()
+        except OSError:
+            result.append((path, None, None, None))
+            continue
+
+        if content is None or b'\0' in content[:8192]:
+            trigrams = None
+        else:
+            trigrams = _get_trigrams(content)
+        result.append((path, stat.st_mtime_ns, stat.st_size, trigrams))
+    return result
+
+
+def _escape_end(pattern, index):
+    # returns the index after the backslash escape at pattern[index]
+    kind = pattern[index+1:index+2]
+    if kind == 'x':
+        return index + 4
+    if kind == 'u':
+        return index + 6
+    if kind == 'U':
+        return index + 10
+    if kind == 'N':
+        return pattern.find('}', index) + 1 or len(pattern)
+    end = index + 2
+    if kind.isdigit():
+        # octal escape or backreference
+        while end < len(pattern) and pattern[end].isdigit():
+            end += 1
+    return end
+
+
+def _class_end(pattern, index):
+    # returns the index after the [character class] at pattern[index]
+    # ']' right after '[' or '[^' is a part of the class
+    end = index + 1
+    if pattern[end:end+1] == '^':
+        end += 1
+    if pattern[end:end+1] == ']':
+        end += 1
+    while end < len(pattern) and pattern[end] != ']':
+        end = _escape_end(pattern, end) if pattern[end] == '\\' else end+1
+    return end + 1
+
+
+def _split_top_level(pattern):
+    # returns a list of strings, or None if there's a top-level | or
+    # something else that this doesn't understand
+    result = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            end = _escape_end(pattern, index)
+        elif char == '[':
+            end = _class_end(pattern, index)
+        elif char == '(':
+            depth = 0
+            end = index
+            while end < len(pattern):
+                if pattern[end] == '\\':
+                    end = _escape_end(pattern, end)
+                    continue
+                if pattern[end] == '[':
+                    end = _class_end(pattern, end)
+                    continue
+                if pattern[end] == '(':
+                    depth += 1
+                elif pattern[end] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                end += 1
+            end += 1
+        elif char == '|':
+            return None
+        elif char == '{':
+            end = pattern.find('}', index) + 1
+            if end == 0:
+                return None
+        else:
+            end = index + 1
+        result.append(pattern[index:end])
+        index = end
+    return result
+
+
+def required_literals(pattern):
+    r"""Return a list of strings that every match of a regex contains.
+
+    This is conservative; if the pattern is complicated, the list may
+    be empty or contain less strings than it could.
+
+    >>> required_literals('hello')
+    ['hello']
+    >>> required_literals(r'def \w+\(self, foo')
+    ['def ', '(self, foo']
+    >>> required_literals(r'colou?r')
+    ['colo', 'r']
+    >>> required_literals(r'(foo|bar)baz[xy]+')
+    ['baz']
+    >>> required_literals(r'\x41([)]|b)c')
+    ['c']
+    >>> required_literals('foo|bar')
+    []
+    """
+    # whitespace doesn't matter in verbose regexes
+    if re.search(r'\(\?[a-zA-Z]*x', pattern) is not None:
+        return []
+
+    pieces = _split_top_level(pattern)
+    if pieces is None:
+        return []
+
+    result = []
+    current = ''
+    for index, piece in enumerate(pieces):
+        following = pieces[index+1] if index + 1 < len(pieces) else ''
+        if piece.startswith('\\') and len(piece) == 2:
+            literal = piece[1] if not piece[1].isalnum() else None
+        elif len(piece) == 1 and piece not in '.^$*+?':
+            literal = piece
+        else:
+            literal = None
+
+        if following[:1] in {'*', '?'} or following.startswith('{'):
+            # the piece may be missing from the match
+            literal = None
+
+        if literal is None:
+            if current:
+                result.append(current)
+            current = ''
+        else:
+            current += literal
+            if following == '+':
+                # the piece is there, but there may be more of it
+                result.append(current)
+                current = ''
+    if current:
+        result.append(current)
+    return result
+
+
+def _get_path(root):
+    name = hashlib.sha1(root.encode('utf-8', errors='replace')).hexdigest()
+    return os.path.join(dirs.cachedir, 'trigram-indexes', name + '.sqlite')
+
+
+class TrigramIndex:
+    """The index of a directory.
+
+    Use :meth:`update` before :meth:`find_candidates`, and
+    :meth:`close` when done. The index can be used in any one thread at
+    a time.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        path = _get_path(self.root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # another porcupine may be updating the same index
+        self._connection = sqlite3.connect(path, timeout=30)
+        version = self._connection.execute('PRAGMA user_version').fetchone()
+        if version[0] != _VERSION:
+            log.info("creating a new trigram index for '%s'", self.root)
+            self._connection.executescript('''
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS trigrams;
+            ''')
+            self._connection.execute('PRAGMA user_version = %d' % _VERSION)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def _delete(self, file_id):
+        self._connection.execute(
+            'DELETE FROM trigrams WHERE file_id = ?', [file_id])
+        self._connection.execute('DELETE FROM files WHERE id = ?', [file_id])
+
+    def _save(self, path, mtime_ns, size, trigrams, old_id):
+        if old_id is not None:
+            self._delete(old_id)
+        if mtime_ns is None:
+            # reading failed, and the old trigrams would be wrong, so
+            # the file is read again on the next update
+            return
+
+        cursor = self._connection.execute(
+            'INSERT INTO files (path, mtime_ns, size, indexed) '
+            'VALUES (?, ?, ?, ?)',
+            [path, mtime_ns, size, int(trigrams is not None)])
+        if trigrams is not None:
+            file_id = cursor.lastrowid
+            self._connection.executemany(
+                'INSERT INTO trigrams (trigram, file_id) VALUES (?, ?)',
+                ((trigram, file_id) for trigram in trigrams))
+
+    def update(self, paths, executor, stop_event,
+               progress_callback=(lambda done, total: None)):
+        """Make the index match the files.
+
+        *paths* should be a list of all files in the directory that may
+        be searched. Files that are not in the list are removed from
+        the index. Changed files are read with the
+        :class:`concurrent.futures.Executor`.
+
+        Updating stops early if the :class:`threading.Event` is set, and
+        the index is usable even if that happens. The progress callback
+        is called with numbers of files in the same thread.
+        """
+        old_files = {}      # {path: (id, mtime_ns, size)}
+        for file_id, path, mtime_ns, size in self._connection.execute(
+                'SELECT id, path, mtime_ns, size FROM files'):
+            old_files[path] = (file_id, mtime_ns, size)
+
+        changed = []
+        old_ids = {}        # {path: id or None}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            old = old_files.pop(path, None)
+            if old is None or old[1:] != (stat.st_mtime_ns, stat.st_size):
+                changed.append(path)
+                old_ids[path] = None if old is None else old[0]
+
+        # the remaining files were removed
+        with self._connection:
+            for file_id, mtime_ns, size in old_files.values():
+                self._delete(file_id)
+        if not changed:
+            return
+
+        log.debug("indexing %d changed files in '%s'",
+                  len(changed), self.root)
+
+        futures = [executor.submit(_read_trigrams,
+                                   changed[i:i+_BATCH_SIZE])
+                   for i in range(0, len(changed), _BATCH_SIZE)]
+        done = 0
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                if stop_event.is_set():
+                    break
+                # each batch is committed separately, so everything
+                # indexed so far is saved if this stops early
+                with self._connection:
+                    for path, mtime_ns, size, trigrams in future.result():
+                        self._save(path, mtime_ns, size, trigrams,
+                                   old_ids[path])
+                done += _BATCH_SIZE
+                progress_callback(min(done, len(changed)), len(changed))
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def find_candidates(self, literals):
+        """Return a set of paths that contain all strings in *literals*.
+
+        The *literals* must be bytes, and their ASCII characters must be
+        lowercase. Binary files are never returned, and neither are files
+        that weren't in the list of paths passed to :meth:`update`.
+        """
+        file_ids = None
+        for literal in literals:
+            for trigram in _get_trigrams(literal):
+                ids = {row[0] for row in self._connection.execute(
+                    'SELECT file_id FROM trigrams WHERE trigram = ?',
+                    [trigram])}
+                if file_ids is None:
+                    file_ids = ids
+                else:
+                    file_ids &= ids
+                if not file_ids:
+                    return set()
+
+        rows = self._connection.execute(
+            'SELECT id, path FROM files WHERE indexed = 1')
+        if file_ids is None:
+            # no trigrams, e.g. the literals are too short
+            return {path for file_id, path in rows}
+        return {path for file_id, path in rows if file_id in file_ids}
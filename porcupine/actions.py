@@ -6,6 +6,7 @@ from porcupine import tabs, utils
 
 
 _actions = {}
+_placeholder_paths = set()      # see _add_placeholder()
 
 
 class _Action:
@@ -62,15 +63,32 @@ def _add_any_action(path, kind, callback_or_choices, binding, var, *,
     if filetype_names is not None and tabtypes is not None:
         # python raises TypeError when it comes to invalid arguments
         raise TypeError("only one of filetype_names and tabtypes can be used")
-    if path in _actions:
+    if path in _placeholder_paths:
+        if kind != 'command':
+            raise RuntimeError("the placeholder action %r can only be "
+                               "replaced with a command" % path)
+        _placeholder_paths.remove(path)
+        # the placeholder's keyboard binding runs the new action's callback
+        need_binding = (binding != _actions[path].binding)
+
+        # plugins like the menubar already know about the placeholder,
+        # but they need to update its callback and keyboard binding
+        action = _Action(path, kind, callback_or_choices, binding, var)
+        _actions[path] = action
+        porcupine.get_main_window().event_generate(
+            '<<NewAction>>', data=path)
+    elif path in _actions:
         raise RuntimeError("there's already an action with path %r" % path)
+    else:
+        need_binding = True
 
-    # event_generate must be before setting action.enabled, this way
-    # plugins get a chance to do something to the new action before it's
-    # disabled
-    action = _Action(path, kind, callback_or_choices, binding, var)
-    _actions[path] = action
-    porcupine.get_main_window().event_generate('<<NewAction>>', data=path)
+        # event_generate must be before setting action.enabled, this way
+        # plugins get a chance to do something to the new action before
+        # it's disabled
+        action = _Action(path, kind, callback_or_choices, binding, var)
+        _actions[path] = action
+        porcupine.get_main_window().event_generate(
+            '<<NewAction>>', data=path)
 
     if tabtypes is not None or filetype_names is not None:
         if tabtypes is not None:
@@ -108,15 +126,17 @@ def _add_any_action(path, kind, callback_or_choices, binding, var, *,
             '<<NotebookTabChanged>>', enable_or_disable, add=True)
 
     # TODO: custom keyboard bindings with a config file or something
-    if binding is not None:
+    if binding is not None and need_binding:
         assert kind in {'command', 'yesno'}, repr(kind)
 
         def bind_callback(event):
-            if action.enabled:
+            # this may be a placeholder that was replaced
+            current_action = _actions[path]
+            if current_action.enabled:
                 if kind == 'command':
-                    action.callback()
+                    current_action.callback()
                 if kind == 'yesno':
-                    action.var.set(not action.var.get())
+                    current_action.var.set(not current_action.var.get())
                 # try to allow binding keys that are used for other
                 # things by default
                 return 'break'
@@ -192,6 +212,23 @@ def add_choice(path, choices, default=None, *, var=None, **kwargs):
     return _add_any_action(path, 'choice', choices, None, var, **kwargs)
 
 
+# pluginloader uses this for plugins that are set up when their action is
+# used for the first time, the callback should set up the plugin and then
+# run the callback of the real action that the plugin added
+#
+# the kwargs are like for add_command(), and they should be the same as
+# for the real action so that e.g. its keyboard binding works before the
+# plugin is set up
+def _add_placeholder(path, callback, **kwargs):
+    action = add_command(path, callback, **kwargs)
+    _placeholder_paths.add(path)
+    return action
+
+
+def _is_placeholder(path):
+    return path in _placeholder_paths
+
+
 def get_action(action_path):
     """Look up and return an existing action object by its path."""
     return _actions[action_path.rstrip('/')]
@@ -3,7 +3,10 @@
 import collections
 import configparser
 import fnmatch
+import functools
+import hashlib
 import importlib
+import importlib.util
 import itertools
 import logging
 import mimetypes
@@ -11,6 +14,8 @@ import os
 import platform
 import re
 import shlex
+import threading
+import time
 import traceback
 import urllib.request   # for pathname2url, mimetypes wants urls
 
@@ -19,7 +24,8 @@ import pygments.lexers
 import pygments.token
 import pygments.util     # for ClassNotFound
 
-from porcupine import dirs, utils
+import porcupine
+from porcupine import _startupcache, dirs, utils
 
 
 log = logging.getLogger(__name__)
@@ -221,7 +227,9 @@ class _OptionError(Exception):
 
 class _FileType:
 
-    def __init__(self, name):
+    # validate=False skips checks that are not needed for creating the
+    # filetype, it's used for filetypes that have been validated before
+    def __init__(self, name, *, validate=True):
         assert name not in _filetypes
         section = _config[name]
         self.name = name
@@ -230,7 +238,8 @@ class _FileType:
 
         # this is kind of verbose, but not too bad imo
 
-        if section['shebang_regex']:
+        self.has_shebang_regex = bool(section['shebang_regex'])
+        if self.has_shebang_regex:
             try:
                 self.shebang_regex = re.compile(section['shebang_regex'])
             except re.error as e:
@@ -238,13 +247,20 @@ class _FileType:
         else:
             self.shebang_regex = re.compile(r'this regex matches nothing^')
 
+        # importing all lexer modules on startup is slow, so they are
+        # imported in get_lexer() and this only checks that the module
+        # exists
         try:
-            modulename, classname = section['pygments_lexer'].rsplit('.', 1)
-            module = importlib.import_module(modulename)
-            self._pygments_lexer_class = getattr(module, classname)
-        # this can import arbitrary modules, anything can go wrong
+            self._pygments_lexer_path = section['pygments_lexer']
+            modulename, classname = self._pygments_lexer_path.rsplit('.', 1)
+            if not classname.isidentifier():
+                raise ValueError("invalid class name %r" % classname)
+            if validate and importlib.util.find_spec(modulename) is None:
+                raise ImportError("no module named %r" % modulename)
+        # find_spec() imports parent packages, anything can go wrong
         except Exception as e:
             raise _OptionError('pygments_lexer') from e
+        self._pygments_lexer_class = None
 
         try:
             self.tabs2spaces = section.getboolean('tabs2spaces')
@@ -273,16 +289,30 @@ class _FileType:
 
         for something_command in ['compile_command', 'run_command',
                                   'lint_command']:
-            if self.has_command(something_command):
+            if validate and self.has_command(something_command):
                 try:
                     self.get_command(something_command, 'whatever')
                 # str.format seems to raise ValueError and KeyError
                 except (KeyError, ValueError) as e:
                     raise _OptionError(something_command) from e
 
+    def _get_lexer_class(self):
+        if self._pygments_lexer_class is None:
+            modulename, classname = self._pygments_lexer_path.rsplit('.', 1)
+            try:
+                module = importlib.import_module(modulename)
+                self._pygments_lexer_class = getattr(module, classname)
+            # this can import arbitrary modules, anything can go wrong
+            except Exception:
+                log.exception("cannot load pygments_lexer %r of [%s], "
+                              "falling back to TextLexer",
+                              self._pygments_lexer_path, self.name)
+                self._pygments_lexer_class = pygments.lexers.TextLexer
+        return self._pygments_lexer_class
+
     # TODO: support passing more options in the config file
     def get_lexer(self, **kwargs):
-        return self._pygments_lexer_class(**kwargs)
+        return self._get_lexer_class()(**kwargs)
 
     def has_command(self, something_command):
         return bool(_config[self.name][something_command].strip())
@@ -300,76 +330,316 @@ class _FileType:
         return result
 
 
-def guess_filetype(filename):
-    """Return a filetype object for a file name."""
-    try:
-        if os.path.samefile(filename, _get_ini_path()):
-            return _filetypes['Porcupine filetypes.ini']
-    except OSError:
-        # the file doesn't exist yet
-        pass
+# these are for finding filetypes quickly in guess_filetype() without
+# looping over all filetypes and fnmatching every pattern, see
+# _add_filetype()
+#
+# the positions are indexes of _filetypes, and they are needed because
+# the first matching filetype in _filetypes must win, no matter how it
+# matched (e.g. mimetype, filename pattern or shebang)
+_mimetype_index = {}     # {mimetype: (position, filetype)}
+_suffix_index = {}       # {'.py': (position, filetype)} from '*.py'
+_basename_index = {}     # {'Makefile': (position, filetype)}
+_other_patterns = []     # [(position, compiled_regex, filetype)]
+_shebang_filetypes = []  # [(position, filetype)]
+
+_GLOB_CHARS = set('*?[')
+
+
+def _add_filetype(name, filetype):
+    position = len(_filetypes)
+    _filetypes[name] = filetype
+
+    for mimetype in filetype.mimetypes:
+        _mimetype_index.setdefault(mimetype, (position, filetype))
+
+    for pattern in map(os.path.normcase, filetype.filename_patterns):
+        if not (_GLOB_CHARS & set(pattern)):
+            _basename_index.setdefault(pattern, (position, filetype))
+        elif (pattern.startswith('*.') and
+              not (_GLOB_CHARS & set(pattern[1:]))):
+            # '*.tar.gz' becomes '.tar.gz'
+            _suffix_index.setdefault(pattern[1:], (position, filetype))
+        else:
+            _other_patterns.append(
+                (position, re.compile(fnmatch.translate(pattern)), filetype))
+
+    if filetype.has_shebang_regex:
+        _shebang_filetypes.append((position, filetype))
+
+
+# returns (position, filetype) or None
+def _match_basename(basename):
+    basename = os.path.normcase(basename)
+    result = _basename_index.get(basename)
 
+    # 'a.tar.gz' is looked up as '.tar.gz' and '.gz'
+    dot = basename.find('.')
+    while dot != -1:
+        found = _suffix_index.get(basename[dot:])
+        if found is not None and (result is None or found[0] < result[0]):
+            result = found
+        dot = basename.find('.', dot + 1)
+
+    for position, regex, filetype in _other_patterns:
+        if result is not None and position >= result[0]:
+            # _other_patterns is sorted by position, nothing better left
+            break
+        if regex.match(basename) is not None:
+            result = (position, filetype)
+            break
+
+    return result
+
+
+def _read_shebang(filename):
     try:
         # the shebang is read as utf-8 because the filetype config file
         # is utf-8
         with open(filename, 'r', encoding='utf-8') as file:
-            if file.read(2) == '#!':
-                # it has a shebang: read until \n but at most 1000
-                # bytes, remove trailing whitespace
-                shebang_line = '#!' + file.readline(1000).rstrip()
-            else:
-                shebang_line = None
+            if file.read(2) != '#!':
+                return None
+            # it has a shebang: read until \n but at most 1000 bytes,
+            # remove trailing whitespace
+            shebang_line = '#!' + file.readline(1000).rstrip()
     except (UnicodeError, OSError):
-        shebang_line = None
+        return None
 
-    if shebang_line is not None:
-        # remove arguments: "#!/bla/bla -t --bleh" becomes "#!/bla/bla"
-        shebang_line = re.sub(r'\s-.*$', '', shebang_line)
+    # remove arguments: "#!/bla/bla -t --bleh" becomes "#!/bla/bla"
+    return re.sub(r'\s-.*$', '', shebang_line)
 
-    mimetype = mimetypes.guess_type(urllib.request.pathname2url(filename))[0]
 
-    for filetype in _filetypes.values():
-        if mimetype in filetype.mimetypes:
-            return filetype
-        if any(fnmatch.fnmatch(os.path.basename(filename), pattern)
-               for pattern in filetype.filename_patterns):
-            return filetype
-        if (filetype.shebang_regex is not None and
-                shebang_line is not None and
-                filetype.shebang_regex.search(shebang_line) is not None):
-            return filetype
+# guessing a lexer with pygments loops over all lexers it has, so the
+# results are cached
+@functools.lru_cache(maxsize=512)
+def _get_pygments_lexer_class(mimetype, basename):
+    if mimetype is not None:
+        try:
+            return type(pygments.lexers.get_lexer_for_mimetype(mimetype))
+        except pygments.util.ClassNotFound:
+            pass
 
-    # create a new filetype automagically if nothing else works
     try:
-        if mimetype is None:
-            # this is the easiest way to handle this corner case i came
-            # up with
-            raise pygments.util.ClassNotFound
-        lexer = pygments.lexers.get_lexer_for_mimetype(mimetype)
+        return type(pygments.lexers.get_lexer_for_filename(basename))
     except pygments.util.ClassNotFound:
+        return None
+
+
+@functools.lru_cache(maxsize=64)
+def _get_pygments_lexer_class_from_shebang(shebang_line):
+    lexer = pygments.lexers.guess_lexer(shebang_line)
+    if isinstance(lexer, pygments.lexers.TextLexer):
+        return None
+    return type(lexer)
+
+
+def guess_filetype(filename):
+    """Return a filetype object for a file name."""
+    basename = os.path.basename(filename)
+    if basename == 'filetypes.ini':
         try:
-            lexer = pygments.lexers.get_lexer_for_filename(filename)
-        except pygments.util.ClassNotFound:
-            # can we use the shebang?
-            if shebang_line is None:
-                return _filetypes['DEFAULT']
-            lexer = pygments.lexers.guess_lexer(shebang_line)
-            if isinstance(lexer, pygments.lexers.TextLexer):
-                return _filetypes['DEFAULT']
-
-    name = lexer.name + ' (not from filetypes.ini)'
+            if os.path.samefile(filename, _get_ini_path()):
+                return _filetypes['Porcupine filetypes.ini']
+        except OSError:
+            # the file doesn't exist yet
+            pass
+
+    mimetype = mimetypes.guess_type(urllib.request.pathname2url(filename))[0]
+
+    best = _match_basename(basename)
+    if mimetype in _mimetype_index:
+        found = _mimetype_index[mimetype]
+        if best is None or found[0] < best[0]:
+            best = found
+
+    # reading the shebang is the only part of this that does I/O, so
+    # it's done only if it can make a difference
+    shebang_line = None
+    if _shebang_filetypes and (best is None or
+                               _shebang_filetypes[0][0] < best[0]):
+        shebang_line = _read_shebang(filename)
+    if shebang_line is not None:
+        for position, filetype in _shebang_filetypes:
+            if best is not None and position >= best[0]:
+                break
+            if filetype.shebang_regex.search(shebang_line) is not None:
+                best = (position, filetype)
+                break
+
+    if best is not None:
+        return best[1]
+
+    # create a new filetype automagically if nothing else works
+    lexer_class = _get_pygments_lexer_class(mimetype, basename)
+    if lexer_class is None:
+        # can we use the shebang?
+        if shebang_line is None:
+            # it wasn't read above if no filetype uses shebangs
+            shebang_line = _read_shebang(filename)
+        if shebang_line is None:
+            return _filetypes['DEFAULT']
+        lexer_class = _get_pygments_lexer_class_from_shebang(shebang_line)
+        if lexer_class is None:
+            return _filetypes['DEFAULT']
+
+    return _get_filetype_for_lexer_class(lexer_class)
+
+
+def _get_filetype_for_lexer_class(lexer_class):
+    name = lexer_class.name + ' (not from filetypes.ini)'
     if name in _filetypes:
         return _filetypes[name]
 
     _config[name] = {
-        'filename_patterns': ' '.join(lexer.filenames),
-        'mimetypes': ' '.join(lexer.mimetypes),
-        'pygments_lexer': type(lexer).__module__ + '.' + type(lexer).__name__,
+        'filename_patterns': ' '.join(lexer_class.filenames),
+        'mimetypes': ' '.join(lexer_class.mimetypes),
+        'pygments_lexer': lexer_class.__module__ + '.' + lexer_class.__name__,
     }
-    _filetypes[name] = _FileType(name)       # uses the _config
+    _add_filetype(name, _FileType(name))       # uses the _config
     return _filetypes[name]
 
 
+# guess_filetype_from_content() looks at this many characters from the
+# beginning and end of the content
+CONTENT_SAMPLE_SIZE = 4096
+
+# pygments.lexers.guess_lexer() returns the best lexer even if it's not
+# very sure about it, and this is too unsure to be useful
+_MIN_GUESS_CONFIDENCE = 0.5
+
+# {md5 hexdigest of sample: lexer class or None}, accessed from threads
+_content_guess_cache = collections.OrderedDict()
+_content_guess_lock = threading.Lock()
+
+_MODELINE_REGEXES = [
+    # vim: set ft=python:    vim: syntax=python
+    re.compile(r'(?:^|\s)(?:vi|vim|ex):.*?\b(?:ft|filetype|syntax)=([\w+-]+)'),
+    # -*- mode: python; coding: utf-8 -*-
+    re.compile(r'-\*-.*?\bmode:\s*([\w+-]+).*?-\*-', re.IGNORECASE),
+    # -*- python -*-
+    re.compile(r'-\*-\s*([\w+-]+)\s*-\*-'),
+]
+
+# (regex, pygments alias) pairs for things that are easy to recognize
+# from the beginning of the content
+_CONTENT_SIGNATURES = [
+    (re.compile(r'\A\s*<\?php\b'), 'php'),
+    (re.compile(r'\A\s*<\?xml\b'), 'xml'),
+    (re.compile(r'\A\s*(?:<!doctype\s+html|<html)\b', re.IGNORECASE), 'html'),
+    (re.compile(r'^(?:diff --git |--- .*\n\+\+\+ )', re.MULTILINE), 'diff'),
+    (re.compile(r'^#include\s*[<"]', re.MULTILINE), 'c'),
+    (re.compile(r'^\s*public\s+(?:final\s+|abstract\s+)?class\s+\w+',
+                re.MULTILINE), 'java'),
+    (re.compile(r'^(?:def|class)\s+\w+.*:[^\S\n]*$', re.MULTILINE), 'python'),
+]
+
+
+def _get_lexer_class_by_alias(alias):
+    try:
+        return type(pygments.lexers.get_lexer_by_name(alias.lower()))
+    except pygments.util.ClassNotFound:
+        return None
+
+
+def _guess_lexer_class_with_pygments(sample):
+    # this imports all lexer modules the first time, but it runs in a
+    # thread and only the sample is analysed, so it doesn't matter much
+    try:
+        lexer_class = type(pygments.lexers.guess_lexer(sample))
+        # guess_lexer() doesn't return the score, but analyse_text() is
+        # fast compared to trying all lexers
+        score = lexer_class.analyse_text(sample)
+    except pygments.util.ClassNotFound:
+        return None
+
+    if (lexer_class is pygments.lexers.TextLexer or
+            score < _MIN_GUESS_CONFIDENCE):
+        return None
+    return lexer_class
+
+
+# this runs in a thread so this must not touch _filetypes or _config
+def _guess_lexer_class_from_content(sample):
+    lines = sample.splitlines()
+    for line in lines[:5] + lines[-5:]:
+        for regex in _MODELINE_REGEXES:
+            match = regex.search(line)
+            if match is not None:
+                lexer_class = _get_lexer_class_by_alias(match.group(1))
+                if lexer_class is not None:
+                    return lexer_class
+
+    for regex, alias in _CONTENT_SIGNATURES:
+        if regex.search(sample) is not None:
+            return _get_lexer_class_by_alias(alias)
+
+    return _guess_lexer_class_with_pygments(sample)
+
+
+def _get_cached_lexer_class_from_content(sample):
+    key = hashlib.md5(sample.encode('utf-8', errors='replace')).hexdigest()
+    with _content_guess_lock:
+        if key in _content_guess_cache:
+            _content_guess_cache.move_to_end(key)
+            return _content_guess_cache[key]
+
+    lexer_class = _guess_lexer_class_from_content(sample)
+    with _content_guess_lock:
+        _content_guess_cache[key] = lexer_class
+        if len(_content_guess_cache) > 256:
+            _content_guess_cache.popitem(last=False)
+    return lexer_class
+
+
+# prefer filetypes from filetypes.ini when pygments finds something
+def _find_filetype_by_lexer_class(lexer_class):
+    for filetype in _filetypes.values():
+        if (filetype._pygments_lexer_path.rsplit('.', 1)[1] ==
+                lexer_class.__name__):
+            return filetype
+
+    matches = [_mimetype_index[mimetype] for mimetype in lexer_class.mimetypes
+               if mimetype in _mimetype_index]
+    if matches:
+        return min(matches, key=lambda match: match[0])[1]
+    return _get_filetype_for_lexer_class(lexer_class)
+
+
+def guess_filetype_from_content(sample, callback):
+    """Guess the filetype of a file that has no name.
+
+    The *sample* should contain the first and last
+    :data:`CONTENT_SAMPLE_SIZE` characters of the file. Shebangs,
+    modelines and some common syntax are checked first, and then
+    Pygments tries to guess the language, which is done in another
+    thread because it can be slow. Results are cached, so guessing
+    again for the same sample is fast.
+
+    ``callback(filetype)`` is called from Tk's main loop when the
+    guessing is done. The filetype is None if nothing could be guessed
+    confidently.
+    """
+    if sample.startswith('#!'):
+        shebang_line = re.sub(r'\s-.*$', '', sample.split('\n', 1)[0].rstrip())
+        for position, filetype in _shebang_filetypes:
+            if filetype.shebang_regex.search(shebang_line) is not None:
+                callback(filetype)
+                return
+
+    def done_callback(success, result):
+        if not success:
+            log.error("guessing a filetype from content failed\n%s", result)
+            callback(None)
+        elif result is None:
+            callback(None)
+        else:
+            callback(_find_filetype_by_lexer_class(result))
+
+    utils.run_in_thread(
+        functools.partial(_get_cached_lexer_class_from_content, sample),
+        done_callback)
+
+
 def get_filetype_by_name(name):
     """Find and return a filetype object by its ``name`` attribute."""
     return _filetypes[name]
@@ -415,9 +685,15 @@ def _add_missing_mimetypes():
             mimetypes.add_type(mimetype, extension)
 
 
-def _init():
-    assert (not _filetypes), "cannot _init() twice"
-    _add_missing_mimetypes()
+def _read_and_validate_config():
+    # error messages are returned so that they can be cached and logged
+    # again when the cache is used
+    errors = []
+
+    def error(message, *args):
+        log.error(message, *args)
+        errors.append(message % args)
+
     stupid = configparser.ConfigParser()
     stupid.read_string(_STUPID_DEFAULTS)
 
@@ -434,7 +710,7 @@ def _init():
             file.write(_STUPID_DEFAULTS)
     except (OSError, UnicodeError, configparser.Error) as err:
         # full tracebacks are ugly and this is supposed to be visible to users
-        log.error("%s in filetypes.ini: %s", type(err).__name__, err)
+        error("%s in filetypes.ini: %s", type(err).__name__, err)
         log.debug("default filetypes will be used instead")
         log.debug("here's the full traceback", exc_info=True)
         _config.read_string(_STUPID_DEFAULTS)
@@ -445,9 +721,9 @@ def _init():
         # stupid['DEFAULT'] and _config['DEFAULT'] behave like dicts
         missing_keys = set(stupid['DEFAULT']) - set(_config['DEFAULT'])
         if missing_keys:
-            log.error("the [DEFAULT] section in filetypes.ini does not "
-                      "contain %s", ', '.join(missing_keys))
-            log.error("default settings will be used for missing things")
+            error("the [DEFAULT] section in filetypes.ini does not "
+                  "contain %s", ', '.join(missing_keys))
+            error("default settings will be used for missing things")
 
             # _config is already loaded from filetypes.ini, so must make
             # sure anything that came from there is not overrided: read
@@ -469,7 +745,7 @@ def _init():
             except _OptionError as e:
                 # e.__cause__ is the error that option_error was raised in
                 # _FileType.__init__, str(e) is the option name
-                log.error("invalid %r value in [%s]", str(e), section_name)
+                error("invalid %r value in [%s]", str(e), section_name)
                 log.debug("here's the full traceback\n%s", ''.join(
                     traceback.format_exception(type(e.__cause__), e.__cause__,
                                                e.__cause__.__traceback__)))
@@ -480,15 +756,75 @@ def _init():
                 else:
                     del _config[section_name][str(e)]  # use DEFAULT's value
             else:
-                _filetypes[section_name] = filetype
+                _add_filetype(section_name, filetype)
                 break
 
+    return errors
+
+
+# the cached filetypes are outdated if any of these things change
+def _get_cache_key():
+    try:
+        stat = os.stat(_get_ini_path())
+    except OSError:
+        return None
+
+    # _STUPID_DEFAULTS contains the python command, so it's hashed too
+    defaults_hash = hashlib.md5(_STUPID_DEFAULTS.encode('utf-8')).hexdigest()
+    return [stat.st_mtime_ns, stat.st_size, defaults_hash,
+            pygments.__version__, porcupine.__version__]
+
+
+def _config_to_json():
+    # values that come from the [DEFAULT] section are not repeated
+    defaults = dict(_config['DEFAULT'])
+    result = [['DEFAULT', defaults]]
+    for section_name in _config.sections():
+        result.append([section_name, {
+            key: value for key, value in _config[section_name].items()
+            if defaults.get(key) != value}])
+    return result
+
+
+def _init():
+    assert (not _filetypes), "cannot _init() twice"
+    start = time.time()
+    _add_missing_mimetypes()
+
+    cache_key = _get_cache_key()
+    cached = (None if cache_key is None else
+              _startupcache.load('filetypes', cache_key))
+
+    if cached is None:
+        errors = _read_and_validate_config()
+        cache_key = _get_cache_key()    # creating filetypes.ini changes it
+        if cache_key is not None:
+            _startupcache.save('filetypes', cache_key, {
+                'sections': _config_to_json(),
+                'errors': errors,
+            })
+    else:
+        log.debug("using cached filetypes instead of reading '%s'",
+                  _get_ini_path())
+        for message in cached['errors']:
+            log.error("%s", message)
+        _config.read_dict(collections.OrderedDict(cached['sections']))
+
+        # everything in the cache has been validated already
+        for section_name in (['DEFAULT'] + _config.sections()):
+            _add_filetype(section_name,
+                          _FileType(section_name, validate=False))
+
     if 'Porcupine filetypes.ini' not in _filetypes:
         _config['Porcupine filetypes.ini'] = {
             'pygments_lexer': __name__ + '._FiletypesDotIniLexer',
         }
-        _filetypes['Porcupine filetypes.ini'] = _FileType(   # stupid pep8 >:(
-            'Porcupine filetypes.ini')
+        _add_filetype('Porcupine filetypes.ini',
+                      _FileType('Porcupine filetypes.ini'))
+
+    duration = time.time() - start
+    log.debug("loaded %d filetypes in %.3f milliseconds",
+              len(_filetypes), duration*1000)
 
 
 # unlike pygments.lexers.IniLexer, this highlights correct keys and
@@ -13,14 +13,22 @@ On startup, Porcupine loads plugins roughly like this::
 # plugins using Porcupine, so Porcupine must run if the plugins are
 # broken
 
+import ast
+import collections
+import concurrent.futures
+import functools
 import importlib
+import importlib.util
 import logging
+import os
 import pkgutil
 import random
 import time
 
 import toposort
 
+from porcupine import (_startupcache, _startupprofile, actions,
+                       get_main_window, get_tab_manager, tabs, utils)
 from porcupine.plugins import __path__ as plugin_paths
 
 log = logging.getLogger(__name__)
@@ -39,6 +47,246 @@ def find_plugins():
 
 _loaded_names = []
 
+# importing is mostly waiting for the disk and running module-level code
+# of libraries like pygments and jedi, so a few threads is plenty
+_IMPORT_THREADS = 4
+
+
+def _import_plugin(name):
+    start = time.perf_counter()
+    with _startupprofile.phase("import " + name, 'plugins'):
+        module = importlib.import_module('porcupine.plugins.' + name)
+    return (module, time.perf_counter() - start)
+
+
+def _import_plugins(plugin_names):
+    # returns {name: module} for plugins that could be imported
+    #
+    # the plugins are imported in threads so that a plugin that imports
+    # something slow doesn't block importing other plugins, and setup()
+    # is still called in the main thread later
+    #
+    # tkinter doesn't like threads, but porcupine's plugins don't use
+    # tkinter when they are imported (settings.get_section() is ok
+    # because porcupine.init() initializes the settings), and if a
+    # plugin fails in a thread for any reason it's imported again in
+    # the main thread to get the error message in the same way as
+    # without threads
+    #
+    # importing again runs the module-level code again, at least the
+    # part before the error, which is documented in plugin-intro.rst
+    plugin_names = sorted(plugin_names)
+    modules = {}
+    failed_names = []
+
+    with concurrent.futures.ThreadPoolExecutor(_IMPORT_THREADS) as executor:
+        futures = [executor.submit(_import_plugin, name)
+                   for name in plugin_names]
+        for name, future in zip(plugin_names, futures):
+            try:
+                modules[name], duration = future.result()
+            except Exception:
+                failed_names.append(name)
+                continue
+            log.debug("imported %s in %.3f milliseconds",
+                      name, duration*1000)
+
+    for name in failed_names:
+        log.debug("importing %s again without threads", name)
+        try:
+            modules[name], duration = _import_plugin(name)
+        except Exception:
+            log.exception("problem with importing %s", name)
+            continue
+        log.debug("imported %s in %.3f milliseconds", name, duration*1000)
+
+    return modules
+
+
+_TRIGGER_KINDS = {'filetypes', 'actions', 'events'}
+_PLACEHOLDER_OPTIONS = {'keyboard_binding', 'tabtypes', 'filetype_names'}
+
+# {name: activate_on dict} for plugins that haven't been set up yet
+_waiting = collections.OrderedDict()
+
+
+def _read_triggers(path):
+    # returns the plugin's activate_on dict or None, without importing
+    # the plugin because avoiding that is the whole point
+    with open(path, 'rb') as file:
+        source = file.read()
+    if b'activate_on' not in source:
+        # most plugins don't use this, parsing them would be slow
+        return None
+
+    for node in ast.parse(source).body:
+        if (isinstance(node, ast.Assign) and
+                len(node.targets) == 1 and
+                isinstance(node.targets[0], ast.Name) and
+                node.targets[0].id == 'activate_on'):
+            triggers = ast.literal_eval(node.value)
+            break
+    else:
+        return None
+
+    if not isinstance(triggers, dict):
+        raise TypeError("activate_on should be a dict")
+    if not triggers.keys() <= _TRIGGER_KINDS:
+        raise ValueError("unknown activate_on keys: %s" % ', '.join(
+            map(repr, triggers.keys() - _TRIGGER_KINDS)))
+    for value in triggers.values():
+        if not all(isinstance(item, str) for item in value):
+            raise TypeError("activate_on should contain lists of strings")
+
+    # 'actions' can also be a dict like {path: add_command_kwargs}
+    if isinstance(triggers.get('actions'), dict):
+        for options in triggers['actions'].values():
+            if not (isinstance(options, dict) and
+                    options.keys() <= _PLACEHOLDER_OPTIONS):
+                raise ValueError("the values of activate_on['actions'] "
+                                 "should be dicts with keys %s" % ', '.join(
+                                     map(repr, sorted(_PLACEHOLDER_OPTIONS))))
+    return triggers
+
+
+def _read_all_triggers(plugin_names):
+    # returns {name: activate_on dict or None}
+    paths = {}
+    for name in plugin_names:
+        try:
+            spec = importlib.util.find_spec('porcupine.plugins.' + name)
+        except Exception:
+            spec = None     # importing it will fail and log an error
+        if spec is not None and spec.has_location:
+            paths[name] = spec.origin
+
+    try:
+        cache_key = []
+        for name, path in sorted(paths.items()):
+            stat = os.stat(path)
+            cache_key.append([name, path, stat.st_mtime_ns, stat.st_size])
+    except OSError:
+        cache_key = None
+    else:
+        result = _startupcache.load('plugin_triggers', cache_key)
+        if result is not None:
+            return result
+
+    result = dict.fromkeys(plugin_names)
+    can_cache = (cache_key is not None)
+    for name, path in paths.items():
+        try:
+            result[name] = _read_triggers(path)
+        except Exception:
+            log.exception("cannot read activate_on of %s, it will be set "
+                          "up on startup", name)
+            can_cache = False   # show the error again on next startup
+
+    if can_cache:
+        _startupcache.save('plugin_triggers', cache_key, result)
+    return result
+
+
+def _activate(name):
+    # imports and sets up a waiting plugin, returns True if it was set up
+    try:
+        triggers = _waiting.pop(name)
+    except KeyError:
+        return name in _loaded_names
+
+    start = time.perf_counter()
+    try:
+        module = importlib.import_module('porcupine.plugins.' + name)
+        module.setup()
+    except Exception:
+        log.exception("problem with setting up %s on demand", name)
+        return False
+
+    _loaded_names.append(name)
+    duration = time.perf_counter() - start
+    log.debug("set up %s on demand in %.3f milliseconds",
+              name, duration*1000)
+
+    for path in triggers.get('actions', []):
+        if actions._is_placeholder(path):
+            # e.g. pastebin.py doesn't add some pastebins if requests
+            # isn't installed
+            log.info("%s.setup() didn't add an action with path %r, "
+                     "disabling the placeholder action", name, path)
+            actions.get_action(path).enabled = False
+    return True
+
+
+def _on_placeholder_action(name, path):
+    if not _activate(name):
+        return
+    if actions._is_placeholder(path):
+        # the plugin didn't replace the placeholder, calling its
+        # callback would recurse forever
+        return
+
+    action = actions.get_action(path)
+    if action.enabled:
+        action.callback()
+
+
+def _register_triggers():
+    filetype_triggers = collections.defaultdict(list)  # {filetype: [names]}
+    event_triggers = collections.defaultdict(list)     # {event: [names]}
+
+    for name, triggers in _waiting.items():
+        for filetype_name in triggers.get('filetypes', []):
+            filetype_triggers[filetype_name].append(name)
+        for event in triggers.get('events', []):
+            event_triggers[event].append(name)
+
+        action_triggers = triggers.get('actions', [])
+        if not isinstance(action_triggers, dict):
+            action_triggers = dict.fromkeys(action_triggers, {})
+
+        for path, options in action_triggers.items():
+            try:
+                options = dict(options)
+                if options.get('tabtypes') is not None:
+                    # the class names are strings for ast.literal_eval
+                    options['tabtypes'] = [
+                        None if tabtype is None else getattr(tabs, tabtype)
+                        for tabtype in options['tabtypes']]
+                actions._add_placeholder(path, functools.partial(
+                    _on_placeholder_action, name, path), **options)
+            except Exception:
+                log.exception("cannot add placeholder action %r for %s",
+                              path, name)
+
+    def check_filetype(tab, junk_event=None):
+        for name in filetype_triggers.get(tab.filetype.name, []):
+            _activate(name)
+
+    def on_new_tab(event):
+        tab = event.data_widget
+        if isinstance(tab, tabs.FileTab):
+            tab.bind('<<FiletypeChanged>>',
+                     functools.partial(check_filetype, tab), add=True)
+            check_filetype(tab)
+
+    if filetype_triggers:
+        utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab,
+                             add=True)
+        for tab in get_tab_manager().tabs():
+            if isinstance(tab, tabs.FileTab):
+                tab.bind('<<FiletypeChanged>>',
+                         functools.partial(check_filetype, tab), add=True)
+                check_filetype(tab)
+
+    for event, names in event_triggers.items():
+        def on_event(junk_event, names=names):
+            for name in names:
+                _activate(name)
+
+        # binding to the main window works for events generated on any
+        # widget in it, because the toplevel is in every widget's bindtags
+        get_main_window().bind(event, on_event, add=True)
+
 
 def load(plugin_names, shuffle=False):
     """Load plugins from an iterable of names.
@@ -51,16 +299,31 @@ def load(plugin_names, shuffle=False):
     ``shuffle=True`` means that a random order is used instead; this is
     useful for making sure that the plugins don't rely on the sorting.
 
+    Plugins that have an ``activate_on`` dict are not imported or set
+    up here. See :ref:`on-demand-plugins`.
+
     Any exceptions from the plugins are caught and logged, so there's no
     need to wrap calls to this function in ``try``,``except``.
     """
     assert not _loaded_names, "cannot load() twice"
 
+    start = time.perf_counter()
+    with _startupprofile.phase("read activate_on of plugins"):
+        all_triggers = _read_all_triggers(plugin_names)
+    names_to_load = []
+    for name in sorted(plugin_names):
+        triggers = all_triggers.get(name)
+        if triggers is None:
+            names_to_load.append(name)
+        else:
+            _waiting[name] = triggers
+
+    with _startupprofile.phase("import plugins"):
+        modules = _import_plugins(names_to_load)
+
     plugin_infos = {}    # {name: (setup_before, setup_after, setup_func)}
-    for name in plugin_names:
-        start = time.time()
+    for name, module in modules.items():
         try:
-            module = importlib.import_module('porcupine.plugins.' + name)
             setup_before = set(getattr(module, 'setup_before', []))
             setup_after = set(getattr(module, 'setup_after', []))
             setup = module.setup
@@ -68,9 +331,6 @@ def load(plugin_names, shuffle=False):
             log.exception("problem with importing %s", name)
             continue
 
-        duration = time.time() - start
-        log.debug("imported %s in %.3f milliseconds", name, duration*1000)
-
         # now we know that the plugin is ok, we can add its stuff to
         # dependencies and setup_funcs
         plugin_infos[name] = (setup_before, setup_after, setup)
@@ -105,22 +365,34 @@ def load(plugin_names, shuffle=False):
     for name in loading_order:
         *junk, setup = plugin_infos[name]
 
-        start = time.time()
+        setup_start = time.perf_counter()
         try:
-            setup()
+            with _startupprofile.phase(name + ".setup()", 'plugins'):
+                setup()
             _loaded_names.append(name)
         except Exception:
             log.exception("%s.setup() doesn't work", name)
 
-        duration = time.time() - start
+        duration = time.perf_counter() - setup_start
         log.debug("ran %s.setup() in %.3f milliseconds", name, duration*1000)
 
+    # this is done after setting up other plugins because plugins like
+    # the menubar must be ready when the placeholder actions are added
+    with _startupprofile.phase("register activate_on triggers"):
+        _register_triggers()
+
+    duration = time.perf_counter() - start
+    log.debug("loaded %d plugins in %.3f milliseconds, %d plugins will be "
+              "set up on demand", len(_loaded_names), duration*1000,
+              len(_waiting))
+
 
 def get_loaded_plugins():
     """Return a list of plugin names that have been loaded in their loading or\
 der.
 
-    This is useful for plugins that need to start a new Porcupine
-    process and load plugins in that.
+    Plugins that will be set up on demand but haven't been set up yet
+    are at the end of the list. This is useful for plugins that need to
+    start a new Porcupine process and load plugins in that.
     """
-    return _loaded_names.copy()
+    return _loaded_names + list(_waiting)
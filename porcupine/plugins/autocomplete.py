@@ -1,16 +1,56 @@
 # TODO: document this module's simple register_completer() api
+import bisect
 import collections
+import concurrent.futures
+import functools
+import heapq
+import logging
+import os
 import re
+import threading
+import time
+import weakref
 
-from porcupine import get_tab_manager, tabs, utils
+from porcupine import get_tab_manager, settings, tabs, utils
+
+log = logging.getLogger(__name__)
 
 __all__ = ['register_completer']
 setup_before = ['tabs2spaces']      # see tabs2spaces.py
 
-_completers = {}
+_completers = {}     # {filetype_name: (function, timeout)}
+_word_indexes = weakref.WeakKeyDictionary()     # {tab: _WordIndex}
+
+_WORD_REGEX = re.compile(r'\w+')
+
+# if more lines than this change at once, e.g. when a big file is
+# opened, all words are found again in a thread
+_MAX_INCREMENTAL_LINES = 10000
+
+# this is incremented when words are found in the background, so that
+# completions cached before that aren't used anymore
+_background_finds = 0
+
+# words from other files of the project are found in the background,
+# and the project indexes must not use too much memory
+_PROJECT_MARKERS = ['.git', '.hg', '.svn']
+_MAX_PROJECTS = 3
+_MAX_PROJECT_WORDS = 1000000
+_PROJECT_WORD_REGEX = re.compile(r'\w{2,50}')
+
+# each index gives at most this many words, and if a prefix matches more
+# words than _BIG_PREFIX_SIZE, the best words for it are found when
+# creating the index to keep completing fast
+_MAX_COMPLETIONS = 100
+_BIG_PREFIX_SIZE = 500
+
+_projects = collections.OrderedDict()    # {root: _ProjectWords}, LRU order
 
+# how often to check if a completer has returned its future's result
+_POLL_INTERVAL_MS = 20
 
-def register_completer(filetype_name, function):
+
+def register_completer(filetype_name, function, timeout=1):
     """Add a syntax completer for a specific filetype.
 
     Use like this::
@@ -31,17 +71,371 @@ def register_completer(filetype_name, function):
 
     The ``tab`` argument to *function* is a :class:`porcupine.tabs.Filetab`.
 
+    The *function* is called in Tk's main loop, so it must not take a long
+    time to run. Slow completers can get the text from the tab and return
+    a :class:`concurrent.futures.Future` that finishes with the iterable,
+    e.g. by submitting the actual work to a
+    :class:`concurrent.futures.ThreadPoolExecutor`. The completions are
+    shown when the future is done, but if that takes more than *timeout*
+    seconds, the words of the file are used instead. The result is ignored
+    if the cursor moves before the completions are ready.
+
     The *filetype_name* should be a key of
     :data:`porcupine.filetypes.filetypes`. Registering multiple completers
     for the same *filetype_name* overrides previous registrations.
     """
-    _completers[filetype_name] = function
+    _completers[filetype_name] = (function, timeout)
+
+
+def _get_range(sorted_words, prefix, start=0, end=None):
+    # returns (start, end) so that sorted_words[start:end] are the words
+    # that start with prefix
+    if end is None:
+        end = len(sorted_words)
+    start = bisect.bisect_left(sorted_words, prefix, start, end)
+    end = bisect.bisect_left(sorted_words, prefix + '\U0010ffff',
+                             start, end)
+    return (start, end)
+
+
+def _find_big_prefixes(sorted_words, counts):
+    # returns {prefix: most common words} for prefixes of more than
+    # _BIG_PREFIX_SIZE words
+    result = {}
+    stack = [('', 0, len(sorted_words))]
+    while stack:
+        prefix, start, end = stack.pop()
+        if end - start <= _BIG_PREFIX_SIZE:
+            continue
+        if prefix:
+            # one extra word because the prefix itself is skipped
+            result[prefix] = heapq.nlargest(
+                _MAX_COMPLETIONS + 1, sorted_words[start:end],
+                key=counts.get)
+
+        # one character longer prefixes, they are next to each other
+        index = start
+        while index < end:
+            word = sorted_words[index]
+            if len(word) == len(prefix):
+                index += 1
+                continue
+            longer_prefix = word[:len(prefix)+1]
+            longer_start, longer_end = _get_range(
+                sorted_words, longer_prefix, index, end)
+            stack.append((longer_prefix, longer_start, longer_end))
+            index = longer_end
+    return result
+
+
+def _get_common_words(sorted_words, counts, big_prefixes, prefix):
+    # returns at most _MAX_COMPLETIONS words that start with prefix, most
+    # common first, and this is fast for short prefixes because they are
+    # in big_prefixes
+    try:
+        result = big_prefixes[prefix]
+    except KeyError:
+        start, end = _get_range(sorted_words, prefix)
+        result = heapq.nlargest(_MAX_COMPLETIONS + 1,
+                                sorted_words[start:end], key=counts.get)
+    return [word for word in result if word != prefix][:_MAX_COMPLETIONS]
+
+
+class _WordIndex:
+    """The words of a text widget and how many times each word appears.
+
+    The index is updated when lines change, so completing doesn't need
+    to look at the whole content of the text widget every time. All
+    words are found in a thread when the index is created and after big
+    changes, and there are no words until that's done.
+    """
+
+    def __init__(self, textwidget):
+        self._textwidget = textwidget
+        self._line_words = None     # tuple of words for each line, or None
+        self._counts = {}           # {word: count}
+        self._sorted_words = []     # the keys of _counts in sorted order
+        self._big_prefixes = {}     # see _find_big_prefixes()
+
+        # changes that happen while finding all words are applied after
+        # that, and the number is used for ignoring outdated threads
+        self._changes_while_rebuilding = []
+        self._rebuild_number = 0
+
+        utils.bind_with_data(textwidget, '<<LinesChanged>>',
+                             self._on_lines_changed, add=True)
+        self._start_rebuilding()
+
+    @staticmethod
+    def _find_all_words(content):
+        # this runs in a thread
+        line_words = [tuple(_WORD_REGEX.findall(line))
+                      for line in content.split('\n')]
+        counts = collections.Counter()
+        for words in line_words:
+            counts.update(words)
+        sorted_words = sorted(counts)
+        return (line_words, counts, sorted_words,
+                _find_big_prefixes(sorted_words, counts))
+
+    def _start_rebuilding(self):
+        self._line_words = None
+        self._counts = {}
+        self._sorted_words = []
+        self._big_prefixes = {}
+        self._changes_while_rebuilding.clear()
+        self._rebuild_number += 1
+
+        content = self._textwidget.get('1.0', 'end - 1 char')
+        utils.run_in_thread(
+            functools.partial(self._find_all_words, content),
+            functools.partial(self._rebuild_done, self._rebuild_number))
+
+    def _rebuild_done(self, rebuild_number, success, result):
+        global _background_finds
+        if (rebuild_number != self._rebuild_number or
+                not self._textwidget.winfo_exists()):
+            # the content changed a lot while rebuilding or the tab was
+            # closed
+            return
+        if not success:
+            log.error("finding words failed\n%s", result)
+            self._changes_while_rebuilding.clear()
+            return
+
+        (self._line_words, self._counts, self._sorted_words,
+         self._big_prefixes) = result
+        for change in self._changes_while_rebuilding:
+            self._apply_change(*change)
+        self._changes_while_rebuilding.clear()
+        self._check_line_count()
+        _background_finds += 1
+
+    def _forget_big_prefixes(self, word):
+        # the most common words of these prefixes may have changed, so
+        # they are found again when needed
+        for end in range(1, len(word) + 1):
+            self._big_prefixes.pop(word[:end], None)
+
+    def _add_words(self, words):
+        for word in words:
+            self._forget_big_prefixes(word)
+            count = self._counts.get(word, 0)
+            if count == 0:
+                bisect.insort(self._sorted_words, word)
+            self._counts[word] = count + 1
+
+    def _remove_words(self, words):
+        for word in words:
+            count = self._counts.get(word, 0) - 1
+            if count == -1:
+                continue    # see the end of _on_lines_changed()
+            self._forget_big_prefixes(word)
+            if count == 0:
+                del self._counts[word]
+                del self._sorted_words[
+                    bisect.bisect_left(self._sorted_words, word)]
+            else:
+                self._counts[word] = count
+
+    def _apply_change(self, first, old_last, new_words):
+        for words in self._line_words[first-1:old_last]:
+            self._remove_words(words)
+        self._line_words[first-1:old_last] = new_words
+        for words in new_words:
+            self._add_words(words)
+
+    def _check_line_count(self):
+        # this should never happen, but if it does, it's better to find
+        # everything again than to complete wrong things forever
+        line_count = int(self._textwidget.index('end - 1 char').split('.')[0])
+        if len(self._line_words) != line_count:
+            self._start_rebuilding()
+
+    def _on_lines_changed(self, event):
+        first, old_last, new_last = map(int, event.data.split())
+        if new_last - first > _MAX_INCREMENTAL_LINES:
+            self._start_rebuilding()
+            return
+
+        new_content = self._textwidget.get('%d.0' % first,
+                                           '%d.0 lineend' % new_last)
+        new_words = [tuple(_WORD_REGEX.findall(line))
+                     for line in new_content.split('\n')]
+        if self._line_words is None:
+            self._changes_while_rebuilding.append(
+                (first, old_last, new_words))
+        else:
+            self._apply_change(first, old_last, new_words)
+            self._check_line_count()
+
+    def get_count(self, word):
+        return self._counts.get(word, 0)
+
+    def get_words(self, prefix):
+        """Return words that start with *prefix*, but not *prefix* itself.
+
+        The most common words come first, and there are at most 100
+        words.
+        """
+        if (prefix and prefix not in self._big_prefixes and
+                len(self._sorted_words) > _BIG_PREFIX_SIZE):
+            start, end = _get_range(self._sorted_words, prefix)
+            if end - start > _BIG_PREFIX_SIZE:
+                # changes forgot this, find it again for next time
+                self._big_prefixes[prefix] = heapq.nlargest(
+                    _MAX_COMPLETIONS + 1, self._sorted_words[start:end],
+                    key=self._counts.get)
+        return _get_common_words(self._sorted_words, self._counts,
+                                 self._big_prefixes, prefix)
+
+
+def _count_words(paths, encoding):
+    # this runs in a worker process, and returns a Counter
+    result = collections.Counter()
+    for path in paths:
+        try:
+            with open(path, 'rb') as file:
+                content = file.read(1024*1024)
+            if b'\0' in content[:8192]:
+                continue    # binary file
+            text = content.decode(encoding, errors='ignore')
+        except OSError:
+            continue
+        result.update(_PROJECT_WORD_REGEX.findall(text))
+    return result
+
+
+def _find_project_root(path):
+    # returns None if the file doesn't seem to be in a project, a
+    # random directory full of unrelated files is not useful
+    directory = os.path.dirname(os.path.abspath(path))
+    while True:
+        if any(os.path.exists(os.path.join(directory, marker))
+               for marker in _PROJECT_MARKERS):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+class _ProjectWords:
+    """Words in all files of a project directory.
+
+    The words are found in a background thread, and they're not
+    available before that's done. After that, the words don't change.
+    """
+
+    def __init__(self, root, encoding):
+        self.root = root
+        self._stop_event = threading.Event()
+
+        # these are set when the thread is done, and not changed after
+        # that, so they can be used without locking
+        self._counts = None
+        self._sorted_words = None
+        self._big_prefixes = None   # {prefix: [most common words]}
+
+        threading.Thread(target=self._build, args=[encoding],
+                         daemon=True).start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _build(self, encoding):
+        global _background_finds
+
+        # find_in_files knows which files are worth reading, and it has
+        # a process pool for reading them without blocking the GUI
+        from porcupine.plugins import find_in_files
+
+        counts = collections.Counter()
+        executor = find_in_files._get_executor()
+        futures = collections.deque()
+
+        def add_counts(future):
+            if self._stop_event.is_set():
+                future.cancel()
+                return
+            for word, count in future.result().items():
+                # new words are ignored when there are too many words
+                if word in counts or len(counts) < _MAX_PROJECT_WORDS:
+                    counts[word] += count
+
+        def submit(batch):
+            # find in files uses the same executor, so this must not
+            # fill it with batches that make searching wait
+            if len(futures) >= find_in_files._MAX_PENDING_BATCHES:
+                add_counts(futures.popleft())
+            futures.append(executor.submit(_count_words, batch, encoding))
+
+        try:
+            batch = []
+            for path in find_in_files._iter_files(self.root,
+                                                  self._stop_event):
+                batch.append(path)
+                if len(batch) == find_in_files._BATCH_SIZE:
+                    submit(batch)
+                    batch = []
+            if batch:
+                submit(batch)
+            while futures:
+                add_counts(futures.popleft())
+        except Exception:
+            log.exception("finding words in '%s' failed", self.root)
+            return
+
+        if self._stop_event.is_set():
+            return
+
+        sorted_words = sorted(counts)
+        big_prefixes = _find_big_prefixes(sorted_words, counts)
+        self._counts = counts
+        self._sorted_words = sorted_words
+        self._big_prefixes = big_prefixes
+        _background_finds += 1
+        log.debug("found %d different words in '%s'",
+                  len(sorted_words), self.root)
+
+    def get_words(self, prefix):
+        """Like :meth:`_WordIndex.get_words`.
+
+        Returns an empty list if the words haven't been found yet.
+        """
+        if self._sorted_words is None:
+            return []
+        return _get_common_words(self._sorted_words, self._counts,
+                                 self._big_prefixes, prefix)
+
+
+def _get_project_words(tab):
+    # returns a _ProjectWords or None
+    config = settings.get_section('General')
+    if tab.path is None or not config['autocomplete_project_words']:
+        return None
+
+    root = _find_project_root(tab.path)
+    if root is None:
+        return None
+
+    try:
+        _projects.move_to_end(root)
+    except KeyError:
+        _projects[root] = _ProjectWords(root, config['encoding'])
+        while len(_projects) > _MAX_PROJECTS:
+            oldest_root, oldest = _projects.popitem(last=False)
+            oldest.stop()
+    return _projects[root]
 
 
 def _fallback_completer(tab):
-    """Find all words in file, sorted by frequency."""
+    """Find words from open tabs and the project, sorted by frequency.
+
+    Words from the current tab come first, then words from other tabs
+    and then words from other files in the same project.
+    """
     before_cursor = tab.textwidget.get('insert linestart', 'insert')
-    after_cursor = tab.textwidget.get('insert', 'insert lineend')
 
     match = re.search(r'\w+$', before_cursor)
     if match is None:
@@ -49,23 +443,26 @@ def _fallback_completer(tab):
         return None
     prefix = match.group(0)
 
-    # find unique words starting with the prefix
-    # Tcl's regexes don't support \b or a sane way of grouping so
-    # they are kind of useless for this. I guess I should implement
-    # this with Tcl regexes too and check which is faster :)
-    result = collections.Counter()
-    for chunk in tab.textwidget.iter_chunks():
-        result.update(re.findall(r'\b' + prefix + r'(\w+)', chunk))
+    # _find_suffixes() doesn't call this in the middle of a word, so
+    # there's no need to check what's after the cursor
+    result = _word_indexes[tab].get_words(prefix)
+    seen = set(result)
 
-    # if the cursor is in the middle of a word, that word must not
-    # be completed, e.g. if the user types abcdef and moves the
-    # cursor between c and d, we must not autocomplete to abcdefdef
-    try:
-        del result[re.search(r'^\w*', after_cursor).group(0)]
-    except KeyError:
-        pass
+    other_tabs = collections.Counter()
+    for other_tab, word_index in list(_word_indexes.items()):
+        if other_tab is not tab:
+            for word in word_index.get_words(prefix):
+                if word not in seen:
+                    other_tabs[word] += word_index.get_count(word)
+    result.extend(sorted(other_tabs, key=other_tabs.get, reverse=True))
+    seen.update(other_tabs)
 
-    return sorted(result, key=result.get, reverse=True)
+    project_words = _get_project_words(tab)
+    if project_words is not None:
+        result.extend(word for word in project_words.get_words(prefix)
+                      if word not in seen)
+
+    return [word[len(prefix):] for word in result]
 
 
 class _AutoCompleter:
@@ -74,8 +471,47 @@ class _AutoCompleter:
         self.tab = tab
         self._startpos = None
         self._suffixes = None
+        self._pending_future = None
         self._completing = False    # avoid recursion
 
+        # completing again after typing more characters of the same word
+        # uses the old completions, and changing anything else than the
+        # cursor's line increments the generation to invalidate them
+        self._generation = 0
+        self._cache = None      # (key, prefix, completed words)
+
+    def on_lines_changed(self, event):
+        first, old_last, new_last = map(int, event.data.split())
+        cursor_line = int(self.tab.textwidget.index('insert').split('.')[0])
+        if not (first == old_last == new_last == cursor_line):
+            self._generation += 1
+
+    def _get_cache_key(self):
+        # returns (key, prefix), the key is the same if the prefix is the
+        # only thing that may have changed
+        before_cursor = self.tab.textwidget.get('insert linestart', 'insert')
+        prefix = re.search(r'\w*$', before_cursor).group(0)
+        before_prefix = before_cursor[:len(before_cursor)-len(prefix)]
+        word_start = self.tab.textwidget.index(
+            'insert - %d chars' % len(prefix))
+        return ((word_start, self._generation, _background_finds,
+                 before_prefix), prefix)
+
+    def _save_to_cache(self, key, prefix, suffixes):
+        suffixes = list(suffixes)
+        self._cache = (key, prefix, [prefix + suffix for suffix in suffixes])
+        return suffixes
+
+    def _get_cached_suffixes(self, key, prefix):
+        # returns None if the cache can't be used
+        if self._cache is None:
+            return None
+        cached_key, cached_prefix, words = self._cache
+        if cached_key != key or not prefix.startswith(cached_prefix):
+            return None
+        return [word[len(prefix):] for word in words
+                if word.startswith(prefix) and word != prefix]
+
     def _find_suffixes(self):
         before_cursor = self.tab.textwidget.get('insert linestart', 'insert')
         after_cursor = self.tab.textwidget.get('insert', 'insert lineend')
@@ -87,30 +523,89 @@ class _AutoCompleter:
             # don't complete in the middle of a word
             return []
 
-        completer = _completers.get(self.tab.filetype.name,
-                                    _fallback_completer)
-        return completer(self.tab)
+        key, prefix = self._get_cache_key()
+        suffixes = self._get_cached_suffixes(key, prefix)
+        if suffixes is not None:
+            return suffixes
 
-    def _complete(self, rotation):
+        completer = _completers.get(self.tab.filetype.name,
+                                    (_fallback_completer, None))[0]
+        result = completer(self.tab)
+        if result is None or isinstance(result, concurrent.futures.Future):
+            return result
+        return self._save_to_cache(key, prefix, result)
+
+    def _wait_for_future(self, future, rotation):
+        timeout = _completers[self.tab.filetype.name][1]
+        cursor_pos = self.tab.textwidget.index('insert')
+        key, prefix = self._get_cache_key()
+        deadline = time.monotonic() + timeout
+        self._pending_future = future
+
+        def check():
+            if self._pending_future is not future:
+                # reset() was called, the result would be useless
+                future.cancel()
+                return
+
+            if future.done():
+                try:
+                    suffixes = future.result()
+                    if suffixes is not None:
+                        suffixes = self._save_to_cache(key, prefix, suffixes)
+                except Exception:
+                    log.exception("the %s completer failed",
+                                  self.tab.filetype.name)
+                    suffixes = _fallback_completer(self.tab)
+            elif time.monotonic() > deadline:
+                log.info("the %s completer didn't finish in %s seconds, "
+                         "completing words from the file instead",
+                         self.tab.filetype.name, timeout)
+                future.cancel()
+                suffixes = _fallback_completer(self.tab)
+            else:
+                self.tab.after(_POLL_INTERVAL_MS, check)
+                return
+
+            self._pending_future = None
+            if self.tab.textwidget.index('insert') == cursor_pos:
+                self._show_suffixes(suffixes or [], rotation)
+
+        check()
+
+    def _show_suffixes(self, suffixes, rotation):
+        self._startpos = self.tab.textwidget.index('insert')
+        self._suffixes = collections.deque(suffixes)
+        self._suffixes.appendleft('')  # end of completions
+        self._rotate(rotation)
+
+    def _rotate(self, rotation):
         self._completing = True
-
-        if self._suffixes is None:
-            suffixes = self._find_suffixes()
-            if suffixes is None:
-                # no completable characters before the cursor, just give
-                # up and allow doing something else on this tab press
-                return None
-
-            self._startpos = self.tab.textwidget.index('insert')
-            self._suffixes = collections.deque(suffixes)
-            self._suffixes.appendleft('')  # end of completions
-
         self._suffixes.rotate(rotation)
         self.tab.textwidget.delete(self._startpos, 'insert')
         self.tab.textwidget.mark_set('insert', self._startpos)
         self.tab.textwidget.insert(self._startpos, self._suffixes[0])
-
         self._completing = False
+
+    def _complete(self, rotation):
+        if self._pending_future is not None:
+            # the completions will be shown when they are ready
+            return 'break'
+
+        if self._suffixes is not None:
+            self._rotate(rotation)
+            return 'break'
+
+        result = self._find_suffixes()
+        if result is None:
+            # no completable characters before the cursor, just give
+            # up and allow doing something else on this tab press
+            return None
+
+        if isinstance(result, concurrent.futures.Future):
+            self._wait_for_future(result, rotation)
+        else:
+            self._show_suffixes(result, rotation)
         return 'break'
 
     def on_tab(self, event, shifted):
@@ -125,16 +620,42 @@ class _AutoCompleter:
         # must do nothing if we're currently completing
         if not self._completing:
             self._suffixes = None
+            self._pending_future = None
 
 
 def on_new_tab(event):
     # TODO: autocomplete in other kinds of tabs too?
     tab = event.data_widget
     if isinstance(tab, tabs.FileTab):
+        _word_indexes[tab] = _WordIndex(tab.textwidget)
+        tab.bind('<Destroy>', lambda event: _word_indexes.pop(tab, None),
+                 add=True)
+
+        # start finding the words in the background
+        _get_project_words(tab)
+        tab.bind('<<PathChanged>>', lambda event: _get_project_words(tab),
+                 add=True)
         completer = _AutoCompleter(tab)
         utils.bind_tab_key(tab.textwidget, completer.on_tab, add=True)
         tab.textwidget.bind('<<CursorMoved>>', completer.reset, add=True)
+        tab.textwidget.bind('<Destroy>', completer.reset, add=True)
+        utils.bind_with_data(tab.textwidget, '<<LinesChanged>>',
+                             completer.on_lines_changed, add=True)
+
+
+def _on_project_words_changed(enabled):
+    if not enabled:
+        for project_words in _projects.values():
+            project_words.stop()
+        _projects.clear()
 
 
 def setup():
+    config = settings.get_section('General')
+    config.add_option('autocomplete_project_words', False)
+    config.add_checkbutton(
+        'autocomplete_project_words',
+        "Complete words from other files of the project")
+    config.connect('autocomplete_project_words', _on_project_words_changed)
+
     utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
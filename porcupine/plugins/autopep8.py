@@ -3,6 +3,8 @@ import subprocess
 
 from porcupine import actions, get_tab_manager, utils
 
+activate_on = {'filetypes': ['Python']}
+
 
 def run_autopep8(code):
     try:
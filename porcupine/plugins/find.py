@@ -1,13 +1,95 @@
 """Find/replace widget."""
+import bisect
+import collections
 import re
+import time
 import tkinter
 from tkinter import ttk
 import weakref
 
-from porcupine import actions, get_tab_manager, images, tabs, utils
+from porcupine import (actions, get_tab_manager, images, settings, tabs,
+                       textwidget, utils)
 
 find_widgets = weakref.WeakKeyDictionary()
 
+# the text is searched in chunks of this many lines, and scanning stops
+# for a moment after _SCAN_STEP_TIME seconds so that the GUI can handle
+# key presses etc while huge files are being searched
+_SCAN_CHUNK_LINES = 2000
+_SCAN_STEP_TIME = 0.01
+
+
+def _compile_regex(what, *, regex=False, ignore_case=False,
+                   full_words=False):
+    """Return a compiled regex for searching for *what*.
+
+    This raises :exc:`re.error` if *regex* is True and *what* is not a
+    valid regex.
+    """
+    if not regex:
+        what = re.escape(what)
+    if full_words:
+        what = r'\b(?:%s)\b' % what
+
+    # the text is searched in chunks, so ^ and $ must work at the ends
+    # of lines, not only at the ends of the chunks
+    flags = re.MULTILINE
+    if ignore_case:
+        flags |= re.IGNORECASE
+    return re.compile(what, flags)
+
+
+def _scan(regex, content, first_line=1, pos=0, stop=None):
+    r"""Find all matches of *regex* in *content*.
+
+    Returns a list of ``(start_line, start_column, end_line, end_column)``
+    tuples where line numbers start at *first_line*, so they can be Tk
+    line numbers if *content* is a part of a text widget. Empty matches
+    are ignored.
+
+    >>> _scan(re.compile('b+'), 'abba\nbob')
+    [(1, 1, 1, 3), (2, 0, 2, 1), (2, 2, 2, 3)]
+    >>> _scan(re.compile('b+'), 'abba\nbob', first_line=10)
+    [(10, 1, 10, 3), (11, 0, 11, 1), (11, 2, 11, 3)]
+
+    Searching starts at index *pos* of *content* and only matches that
+    start before *stop* are returned, but the matches may continue after
+    *stop*, and the regex can look at the text before *pos*.
+
+    >>> _scan(re.compile('b+'), 'abba\nbob', pos=2, stop=6)
+    [(1, 2, 1, 3), (2, 0, 2, 1)]
+    >>> _scan(re.compile('(?<=a)b\\nb'), 'ab\nb', pos=1)
+    [(1, 1, 2, 1)]
+    """
+    # this is called with huge strings and there may be lots of matches,
+    # so the match objects are not stored because it's a lot faster to
+    # create tuples of integers
+    result = []
+    line = first_line
+    line_start = 0      # index of the first character of the line
+    for match in regex.finditer(content, pos):
+        start, end = match.span()
+        if stop is not None and start >= stop:
+            break
+        if start == end:
+            continue
+
+        # counting newlines between consecutive matches is O(n) in
+        # total, even though this loops over the matches
+        newlines = content.count('\n', line_start, start)
+        if newlines != 0:
+            line += newlines
+            line_start = content.rindex('\n', 0, start) + 1
+        start_line, start_column = line, start - line_start
+
+        newlines = content.count('\n', start, end)
+        if newlines != 0:
+            line += newlines
+            line_start = content.rindex('\n', 0, end) + 1
+        result.append((start_line, start_column, line, end - line_start))
+
+    return result
+
 
 class Finder(ttk.Frame):
     """A widget for finding and replacing text.
@@ -18,15 +100,38 @@ class Finder(ttk.Frame):
     def __init__(self, parent, textwidget, **kwargs):
         super().__init__(parent, **kwargs)
 
-        self._last_pattern = None
-        self._matches = None
+        # the text is searched while the user is typing, starting at the
+        # cursor and wrapping around at the end of the file
+        #
+        # matches are added to _matches_after and _matches_before in
+        # order, so _matches_before + _matches_after is always sorted,
+        # and _scan_chunks contains (first_line, last_line) pairs that
+        # haven't been scanned yet
+        #
+        # the scanning of a chunk starts at _scan_resume, which is the
+        # end of the previous match if it continued after its chunk, so
+        # the matches are the same as with one big regex.finditer()
+        self._regex = None
+        self._matches_before = []
+        self._matches_after = []
+        self._scan_chunks = collections.deque()
+        self._scan_split_line = 1
+        self._scan_resume = (1, 0)
+        self._scan_end = (1, 0)     # (line, column) of end of file
+        self._scan_after_id = None
+        self._highlight_after_id = None
+        self._keep_status = False
+        self._ignore_change = False
 
         self.grid_columnconfigure(1, weight=1)
         self._textwidget = textwidget
 
         entrygrid = ttk.Frame(self)
         entrygrid.grid(row=0, column=0)
+        self._find_var = tkinter.StringVar()
         self._find_entry = self._add_entry(entrygrid, 0, "Find:", self.find)
+        self._find_entry['textvariable'] = self._find_var
+        self._find_var.trace('w', lambda *junk: self._start_scan())
         self._replace_entry = self._add_entry(entrygrid, 1, "Replace with:")
 
         buttonframe = ttk.Frame(self)
@@ -41,10 +146,17 @@ class Finder(ttk.Frame):
             button = ttk.Button(buttonframe, text=text, command=command)
             button.pack(side='left', fill='x', expand=True)
 
+        checkboxframe = ttk.Frame(self)
+        checkboxframe.grid(row=0, column=1, sticky='nw')
         self._full_words_var = tkinter.BooleanVar()
-        checkbox = ttk.Checkbutton(self, text="Full words only",
-                                   variable=self._full_words_var)
-        checkbox.grid(row=0, column=1, sticky='nw')
+        self._ignore_case_var = tkinter.BooleanVar()
+        self._regex_var = tkinter.BooleanVar()
+        for text, var in [("Full words only", self._full_words_var),
+                          ("Ignore case", self._ignore_case_var),
+                          ("Regular expression", self._regex_var)]:
+            checkbox = ttk.Checkbutton(checkboxframe, text=text,
+                                       variable=var, command=self.reset)
+            checkbox.pack(anchor='w')
 
         self._statuslabel = ttk.Label(self)
         self._statuslabel.grid(row=1, column=1, columnspan=2, sticky='nswe')
@@ -54,6 +166,29 @@ class Finder(ttk.Frame):
         closebutton.grid(row=0, column=2, sticky='ne')
         closebutton.bind('<Button-1>', lambda event: self.pack_forget())
 
+        # the matches are highlighted below the selection, so the
+        # selected match looks different than the others
+        settings.get_section('General').connect(
+            'pygments_style', self._on_style_changed, idle=True)
+        textwidget.tag_lower('find_match', 'sel')
+        self.bind('<Destroy>', self._on_destroy, add=True)
+
+        # only the visible matches are highlighted, so they need to be
+        # highlighted again when scrolling, this is similar to what the
+        # linenumbers plugin does
+        old_command = textwidget['yscrollcommand']  # a tcl command string
+        if old_command:
+            textwidget['yscrollcommand'] = lambda start, end: (
+                textwidget.tk.call(old_command, start, end),
+                self._highlight_later(),
+            )
+        else:
+            textwidget['yscrollcommand'] = (
+                lambda start, end: self._highlight_later())
+
+        textwidget.bind('<<ContentChanged>>', self._on_content_changed,
+                        add=True)
+
     def _add_entry(self, frame, row, text, callback=None):
         ttk.Label(frame, text=text).grid(row=row, column=0)
         entry = ttk.Entry(frame, width=35, font='TkFixedFont')
@@ -63,104 +198,488 @@ class Finder(ttk.Frame):
         entry.grid(row=row, column=1, sticky='we')
         return entry
 
+    def _on_style_changed(self, name):
+        color = textwidget.get_style(name).highlight_color
+        self._textwidget.tag_config('find_match', background=color)
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            settings.get_section('General').disconnect(
+                'pygments_style', self._on_style_changed)
+
     # reset this when showing
     def pack(self, *args, **kwargs):
-        self.reset()
         super().pack(*args, **kwargs)
+        self.reset()
 
-    def _next_match(self):
+    # and stop searching when hiding
+    def pack_forget(self):
+        super().pack_forget()
+        self._cancel_scan()
+        self._regex = None
+        self._textwidget.tag_remove('find_match', '1.0', 'end')
+
+    def _on_content_changed(self, junk_event):
+        # replace() updates the matches by itself, so the event that
+        # comes from replacing doesn't need to throw away the matches
+        if self._ignore_change:
+            self._ignore_change = False
+        elif self._regex is not None:
+            self._start_scan(keep_status=True)
+
+    def _get_regex(self):
+        # returns None if there's nothing to search for
         what = self._find_entry.get()
-        full_words = self._full_words_var.get()
-
         if not what:
             self._statuslabel['text'] = "Cannot find an emptiness!"
             return None
-        if full_words:
-            regexp = r"\b%s\b" % re.escape(what)
-        else:
-            regexp = re.escape(what)
 
-        if self._last_pattern != regexp:
-            matches = []
-            for y, line in enumerate(self._textwidget.iter_lines()):
-                for match in re.finditer(regexp, line):
-                    matches.append((y + 1, match.start(),
-                                    match.end() - match.start()))
+        try:
+            return _compile_regex(
+                what, regex=self._regex_var.get(),
+                ignore_case=self._ignore_case_var.get(),
+                full_words=self._full_words_var.get())
+        except re.error as e:
+            self._statuslabel['text'] = "Invalid regular expression: %s" % e
+            return None
 
-            self._last_pattern = regexp
-            self._matches = iter(matches)
+    def _cancel_scan(self):
+        if self._scan_after_id is not None:
+            self.after_cancel(self._scan_after_id)
+            self._scan_after_id = None
+        self._scan_chunks.clear()
+        self._matches_before.clear()
+        self._matches_after.clear()
+
+    def _start_scan(self, keep_status=False):
+        # this runs on every key press in the find entry, so the
+        # previous scan is thrown away right away
+        self._cancel_scan()
+        self._keep_status = keep_status
+        self._textwidget.tag_remove('find_match', '1.0', 'end')
+        if not self._find_entry.get():
+            self._regex = None
+            if not keep_status:
+                self._statuslabel['text'] = ''
+            return
 
-        return next(self._matches, None)
+        self._regex = self._get_regex()
+        if self._regex is None:
+            return
 
-    def find(self):
-        match = self._next_match()
+        # the cursor's chunk is scanned first, then the rest of the file
+        # and then the beginning of the file
+        self._scan_end = tuple(map(int, self._textwidget.index(
+            'end - 1 char').split('.')))
+        line_count = self._scan_end[0]
+        cursor_line = int(self._textwidget.index('insert').split('.')[0])
+        self._scan_split_line = cursor_line
+        self._scan_resume = (cursor_line, 0)
+        for first_line in range(cursor_line, line_count + 1,
+                                _SCAN_CHUNK_LINES):
+            self._scan_chunks.append((first_line, min(
+                first_line + _SCAN_CHUNK_LINES - 1, line_count)))
+        for first_line in range(1, cursor_line, _SCAN_CHUNK_LINES):
+            self._scan_chunks.append((first_line, min(
+                first_line + _SCAN_CHUNK_LINES - 1, cursor_line - 1)))
+
+        self._scan_step()
+
+    def _scan_range(self, start, stop):
+        # returns matches that start at or after start and before stop,
+        # the text after stop is searched too because the matches may
+        # continue there, but a match that needs more than
+        # _SCAN_CHUNK_LINES lines after stop to match at all is not found
+        if start >= stop:
+            return []
+
+        # the line before start is for things like (?<=\n)
+        context_line = max(start[0] - 1, 1)
+        before = self._textwidget.get('%d.0' % context_line,
+                                      '%d.%d' % start)
+        head = before + self._textwidget.get('%d.%d' % start,
+                                             '%d.%d' % stop)
+
+        extra_lines = _SCAN_CHUNK_LINES
+        while True:
+            last_line = min(stop[0] + extra_lines, self._scan_end[0])
+            content = head + self._textwidget.get(
+                '%d.%d' % stop, '%d.0 lineend' % last_line)
+            matches = _scan(self._regex, content, context_line,
+                            len(before), len(head))
+
+            # if the last match goes all the way to the end of content,
+            # it might be longer with more content
+            content_end = (last_line, len(content) - content.rfind('\n') - 1)
+            if (not matches or last_line == self._scan_end[0] or
+                    matches[-1][2:] != content_end):
+                return matches
+            extra_lines *= 4
+
+    def _scan_chunk(self):
+        first_line, last_line = self._scan_chunks.popleft()
+        if first_line == 1:
+            # beginning of the lines before the cursor
+            self._scan_resume = (1, 0)
+        if last_line == self._scan_end[0]:
+            stop = self._scan_end
+        else:
+            stop = (last_line + 1, 0)
 
-        if match is not None:
-            self._statuslabel['text'] = ''
+        matches = self._scan_range(self._scan_resume, stop)
+        if first_line >= self._scan_split_line:
+            self._matches_after.extend(matches)
+        else:
+            self._matches_before.extend(matches)
+        # a match of a previous chunk may continue after this chunk
+        self._scan_resume = max([self._scan_resume, stop] +
+                                [match[2:] for match in matches])
+
+        if (last_line == self._scan_split_line - 1 and
+                self._scan_resume > (self._scan_split_line, 0)):
+            self._fix_split()
+
+    def _fix_split(self):
+        # the last match before the cursor's line continues on that line,
+        # and the lines after the cursor were scanned without knowing
+        # that, so the first matches after the cursor must be fixed
+        resume = self._scan_resume
+        old_matches = self._matches_after
+        new_matches = []
+        while True:
+            index = bisect.bisect_left(old_matches, resume)
+            if index == 0:
+                break
+
+            # matches before index overlap the long match, and the match
+            # at index was found by searching from the end of the match
+            # before it, so there may be matches before that
+            search_start = old_matches[index-1][2:]
+            del old_matches[:index]
+            if search_start <= resume:
+                break
+            found = self._scan_range(resume, search_start)
+            new_matches.extend(found)
+            if not found or found[-1][2:] <= search_start:
+                break
+            resume = found[-1][2:]
+
+        old_matches[:0] = new_matches
+
+    def _scan_step(self):
+        # the re module doesn't release the GIL while it's matching, so
+        # searching in a thread would freeze the GUI anyway, that's why
+        # this searches a little bit at a time in the event loop
+        self._scan_after_id = None
+        end_time = time.perf_counter() + _SCAN_STEP_TIME
+        while self._scan_chunks and time.perf_counter() < end_time:
+            self._scan_chunk()
+
+        if self._scan_chunks:
+            self._scan_after_id = self.after(1, self._scan_step)
+        self._highlight_visible()
+        self._show_count()
+
+    def _finish_scan(self):
+        # returns False if there's nothing to search for
+        if self._regex is None:
+            self._start_scan()
+            if self._regex is None:
+                return False
+
+        if self._scan_after_id is not None:
+            self.after_cancel(self._scan_after_id)
+            self._scan_after_id = None
+        while self._scan_chunks:
+            self._scan_chunk()
+        self._highlight_visible()
+        return True
+
+    def _get_matches(self):
+        return self._matches_before + self._matches_after
+
+    def _show_count(self):
+        if self._keep_status:
+            # e.g. "Replaced 3 occurences." is more interesting
+            return
+        count = len(self._matches_before) + len(self._matches_after)
+        if self._scan_chunks:
+            self._statuslabel['text'] = "Searching... %d found so far" % count
+        elif count == 0:
+            self._statuslabel['text'] = "I can't find it :("
+        elif count == 1:
+            self._statuslabel['text'] = "1 match"
+        else:
+            self._statuslabel['text'] = "%d matches" % count
+
+    def _highlight_later(self):
+        if self._regex is not None and self._highlight_after_id is None:
+            self._highlight_after_id = self.after_idle(self._highlight_visible)
+
+    def _highlight_visible(self):
+        # there may be millions of matches, but there are never more
+        # than a few hundred of them on the screen
+        if self._highlight_after_id is not None:
+            self.after_cancel(self._highlight_after_id)
+            self._highlight_after_id = None
+
+        self._textwidget.tag_remove('find_match', '1.0', 'end')
+        first_line = int(self._textwidget.index('@0,0').split('.')[0])
+        last_line = int(self._textwidget.index(
+            '@0,%d' % self._textwidget.winfo_height()).split('.')[0])
+        for matches in [self._matches_before, self._matches_after]:
+            index = bisect.bisect_left(matches, (first_line,))
+            while index < len(matches) and matches[index][0] <= last_line:
+                self._textwidget.tag_add(
+                    'find_match', '%d.%d' % matches[index][:2],
+                    '%d.%d' % matches[index][2:])
+                index += 1
+
+    def _get_match_object(self, match):
+        # returns a match object or None if the text has changed
+        #
+        # the regex may contain things like (?<=\n) or (?=\nfoo), so the
+        # match object is created with some text around the match, and
+        # more text is used if that doesn't work
+        start_line, start_column, end_line, end_column = match
+        context_line = max(start_line - 1, 1)
+        before = self._textwidget.get('%d.0' % context_line,
+                                      '%d.0' % start_line)
+        for last_line in [end_line, end_line + _SCAN_CHUNK_LINES]:
+            text = before + self._textwidget.get(
+                '%d.0' % start_line, '%d.0 lineend' % last_line)
+            match_object = self._regex.match(text, len(before) + start_column)
+            if match_object is None:
+                continue
+
+            end = match_object.end()
+            line_start = text.rfind('\n', 0, end) + 1
+            if (context_line + text.count('\n', 0, end) == end_line and
+                    end - line_start == end_column):
+                return match_object
+        return None
+
+    def _get_selected_match_index(self, matches):
+        # returns index of the selected match in matches or None
+        try:
+            start, end = map(self._textwidget.index,
+                             self._textwidget.tag_ranges('sel'))
+        except ValueError:
+            return None     # nothing selected
+
+        line, column = map(int, start.split('.'))
+        index = bisect.bisect_left(matches, (line, column))
+        if index == len(matches):
+            return None
+
+        match = matches[index]
+        if ('%d.%d' % match[:2] == start and '%d.%d' % match[2:] == end):
+            return index
+        return None
 
-            line, col, match_len = match
-            start = "%d.%d" % (line, col)
-            end = "%s + %d chars" % (start, match_len)
+    def _select_match(self, matches, index):
+        start = '%d.%d' % matches[index][:2]
+        end = '%d.%d' % matches[index][2:]
 
-            self._textwidget.tag_remove('sel', '1.0', 'end')
-            self._textwidget.tag_add('sel', start, end)
-            self._textwidget.mark_set('insert', start)
-            self._textwidget.see(start)
-            return True
+        self._textwidget.tag_remove('sel', '1.0', 'end')
+        self._textwidget.tag_add('sel', start, end)
+        self._textwidget.mark_set('insert', end)
+        self._textwidget.see(start)
+        if self._scan_chunks:
+            self._statuslabel['text'] = "Match %d of %d found so far" % (
+                index + 1, len(matches))
         else:
-            self._statuslabel['text'] = "I can't find it :("
-            return False
+            self._statuslabel['text'] = "Match %d of %d" % (
+                index + 1, len(matches))
+
+    def _find_next_index(self, position):
+        # returns index of the first match that starts at or after
+        # position in self._get_matches(), or None
+        #
+        # the lines after the cursor are scanned first in order, and
+        # then the lines before it in order, so the first match found
+        # after the position is the right one unless it's in the wrong
+        # part of the file
+        while True:
+            matches = self._get_matches()
+            index = bisect.bisect_left(matches, position)
+            if index < len(matches) and (
+                    index < len(self._matches_before) or
+                    position >= (self._scan_split_line, 0) or
+                    not self._scan_chunks):
+                return index
+            if not self._scan_chunks:
+                return None
+
+            # the scan is still going and the match hasn't been found
+            # yet, so it's ok to do a bit of it right now
+            self._scan_chunk()
+
+    def find(self):
+        if self._regex is None:
+            self._start_scan()
+            if self._regex is None:
+                return False
+
+        # the match that starts at or after the cursor, the cursor is at
+        # the end of the previous match if find() was just called
+        line, column = map(int, self._textwidget.index('insert').split('.'))
+        while True:
+            index = self._find_next_index((line, column))
+            if index is None:
+                # wrap around to the beginning
+                index = self._find_next_index((1, 0))
+                if index is None:
+                    self._statuslabel['text'] = "I can't find it :("
+                    return False
+
+            matches = self._get_matches()
+            if self._get_match_object(matches[index]) is not None:
+                break
+
+            # something has changed without <<ContentChanged>>, this
+            # shouldn't happen but it's better to be safe than sorry
+            self._pop_match(index)
+
+        self._keep_status = False
+        self._select_match(matches, index)
+        if self._scan_after_id is None and self._scan_chunks:
+            self._scan_after_id = self.after(1, self._scan_step)
+        self._highlight_visible()
+        return True
+
+    def _pop_match(self, index):
+        # the index is in self._get_matches(), but the match is in one
+        # of the lists that it was concatenated from
+        if index < len(self._matches_before):
+            return (self._matches_before, index,
+                    self._matches_before.pop(index))
+        index -= len(self._matches_before)
+        return (self._matches_after, index, self._matches_after.pop(index))
+
+    def _get_replacement(self, match):
+        # returns None if the match is not valid anymore
+        replace_text = self._replace_entry.get()
+        if self._regex_var.get():
+            # support things like \1 in the replacement
+            match_object = self._get_match_object(match)
+            if match_object is None:
+                return None
+            return match_object.expand(replace_text)
+        return replace_text
 
     def replace(self):
         find_text = self._find_entry.get()
         if not find_text:
             self._statuslabel['text'] = "Cannot replace an emptiness!"
             return
-        elif self._last_pattern is None:
+        if self._regex is None:
+            return
+
+        matches = self._get_matches()
+        index = self._get_selected_match_index(matches)
+        if index is None or self._get_match_object(matches[index]) is None:
             self._statuslabel['text'] = "Press find first!"
             return
 
-        start, end = self._textwidget.tag_ranges('sel')
-        if self._textwidget.index(start) == self._textwidget.index(end):
-            # empty area selected
-            self._statuslabel['text'] = "Nothing selected!"
+        try:
+            replacement = self._get_replacement(matches[index])
+        except re.error as e:
+            self._statuslabel['text'] = "Invalid replacement: %s" % e
             return
 
-        if not re.match(self._last_pattern, self._textwidget.get(start, end)):
-            # wrong text selected
-            self._statuslabel['text'] = "Wrong text selected!"
+        match_list, index, match = self._pop_match(index)
+        start_line, start_column, end_line, end_column = match
+        start = '%d.%d' % (start_line, start_column)
+        end = '%d.%d' % (end_line, end_column)
 
-        replace_text = self._replace_entry.get()
         self._textwidget.delete(start, end)
-        self._textwidget.insert(start, replace_text)
-        new_end = '%s + %d chars' % (start, len(replace_text))
+        self._textwidget.insert(start, replacement)
+        new_end = '%s + %d chars' % (start, len(replacement))
         self._textwidget.tag_add('sel', start, new_end)
 
+        if (start_line == end_line and '\n' not in replacement and
+                not self._scan_chunks):
+            # only the matches after this one on the same line moved
+            offset = start_column + len(replacement) - end_column
+            for i in range(index, len(match_list)):
+                line1, column1, line2, column2 = match_list[i]
+                if line1 != start_line:
+                    break
+                if line2 == start_line:
+                    column2 += offset
+                match_list[i] = (line1, column1 + offset, line2, column2)
+            self._highlight_visible()
+            self._statuslabel['text'] = "Replaced 1 occurence, %d left." % (
+                len(self._matches_before) + len(self._matches_after))
+        else:
+            # lines moved, it's easiest to just find everything again
+            self._statuslabel['text'] = "Replaced 1 occurence."
+            self._start_scan(keep_status=True)
+        self._ignore_change = True
+
     def replace_and_find(self):
         self.replace()
         self.find()
 
     def replace_all(self):
+        if not self._finish_scan():
+            return
+
+        try:
+            pairs = [(match, self._get_replacement(match))
+                     for match in self._get_matches()]
+        except re.error as e:
+            self._statuslabel['text'] = "Invalid replacement: %s" % e
+            return
+
+        # replacements are None for matches that are not valid anymore,
+        # see find()
+        pairs = [(match, replacement) for match, replacement in pairs
+                 if replacement is not None]
+        matches = [match for match, replacement in pairs]
+        if not matches:
+            # nothing is edited, so there's no <<ContentChanged>> that
+            # would set _ignore_change back to False
+            self._statuslabel['text'] = "I can't find it :("
+            return
+
         old_cursor_pos = self._textwidget.index("insert")
 
-        count = 0
-        while self.find():
-            self.replace()
-            count += 1
+        # the replacing is done backwards, so the positions of the
+        # matches that haven't been replaced yet don't change, and it's
+        # one undoable edit instead of one edit for each match
+        self._textwidget['autoseparators'] = False
+        self._textwidget.edit_separator()
+        for match, replacement in reversed(pairs):
+            start = '%d.%d' % match[:2]
+            end = '%d.%d' % match[2:]
+            self._textwidget.delete(start, end)
+            self._textwidget.insert(start, replacement)
+        self._textwidget.edit_separator()
+        self._textwidget['autoseparators'] = True
 
         self._textwidget.tag_remove('sel', '1.0', 'end')
         self._textwidget.mark_set("insert", old_cursor_pos)
 
-        if count == 1:
+        if len(matches) == 1:
             self._statuslabel['text'] = "Replaced 1 occurence."
         else:
-            self._statuslabel['text'] = "Replaced %d occurences." % count
+            self._statuslabel['text'] = ("Replaced %d occurences."
+                                         % len(matches))
+
+        # the replacements may contain new matches, and the edit was made
+        # so its <<ContentChanged>> will set this back to False
+        self._start_scan(keep_status=True)
+        self._ignore_change = True
 
     def reset(self):
-        self._statuslabel['text'] = ''
         self._find_entry.focus()
-        self._last_pattern = None
-        self._matches = None
+        if self.winfo_manager():
+            # the finder is packed
+            self._start_scan()
+        else:
+            self._statuslabel['text'] = ''
 
 
 def find():
@@ -171,9 +690,6 @@ def on_new_tab(event):
     tab = event.data_widget
     if isinstance(tab, tabs.FileTab):
         find_widgets[tab] = Finder(tab.bottom_frame, tab.textwidget)
-        tab.textwidget.bind("<<ContentChanged>>",
-                            lambda _: find_widgets[tab].reset(),
-                            add=True)
 
 
 def on_tab_changed(event):
@@ -0,0 +1,904 @@
+"""Search for text in all files of a directory."""
+# the files are searched in other processes because the re module holds
+# the GIL while it's matching, so threads wouldn't help at all
+#
+# this module is imported in the worker processes on windows, so don't
+# do anything that needs tkinter's root window when importing this
+
+import codecs
+import concurrent.futures
+import difflib
+import fnmatch
+import functools
+import hashlib
+import logging
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import tkinter
+from tkinter import filedialog, ttk
+import traceback
+
+from porcupine import (_trigramindex, actions, get_tab_manager, settings,
+                       tabs, textwidget, utils)
+from porcupine.plugins import find
+
+log = logging.getLogger(__name__)
+
+activate_on = {
+    'actions': {'Edit/Find in Files': {'keyboard_binding': '<Control-F>'}},
+}
+
+_IGNORED_DIRS = {'.git', '.hg', '.svn', '.bzr', '__pycache__', '.tox',
+                 'node_modules', '.mypy_cache', '.pytest_cache'}
+_IGNORED_FILES = re.compile('|'.join(map(fnmatch.translate, [
+    '*.pyc', '*.pyo', '*.so', '*.o', '*.a', '*.dll', '*.exe', '*.class',
+    '*.jar', '*.zip', '*.gz', '*.bz2', '*.xz', '*.png', '*.jpg', '*.gif',
+    '*.ico', '*.pdf'])))
+
+# each worker process gets this many paths at a time, and the directory
+# walking thread waits if there are too many batches that haven't been
+# searched yet, so cancelling doesn't need to wait for all of them
+_BATCH_SIZE = 200
+_MAX_PENDING_BATCHES = 2 * (os.cpu_count() or 1)
+
+# showing a million results in a treeview would be way too slow
+_MAX_RESULTS = 10000
+
+# replacements are computed for this many files at a time
+_REPLACE_BATCH_SIZE = 20
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ProcessPoolExecutor()
+    return _executor
+
+
+def _iter_files(root, stop_event):
+    """Yield paths of files in *root* that are worth searching."""
+    # os.scandir is new in python 3.5
+    if not hasattr(os, 'scandir'):
+        for dirpath, dirnames, filenames in os.walk(root):
+            if stop_event.is_set():
+                return
+            dirnames[:] = sorted(name for name in dirnames
+                                 if name not in _IGNORED_DIRS)
+            for name in sorted(filenames):
+                if _IGNORED_FILES.match(name) is None:
+                    yield os.path.join(dirpath, name)
+        return
+
+    # scandir knows whether an entry is a directory without an extra
+    # system call on most systems, that matters with 100k files
+    stack = [root]
+    while stack and not stop_event.is_set():
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory),
+                             key=(lambda entry: entry.name))
+        except OSError as e:
+            log.info("cannot list '%s': %s", directory, e)
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in _IGNORED_DIRS:
+                        subdirs.append(entry.path)
+                elif (entry.is_file() and
+                      _IGNORED_FILES.match(entry.name) is None):
+                    yield entry.path
+            except OSError:
+                continue
+
+        # the stack pops from the end
+        stack.extend(reversed(subdirs))
+
+
+def _split_lines(text):
+    r"""Like ``text.splitlines(keepends=True)``, but only for ``\n``.
+
+    Tk's line numbers count only ``\n`` characters, but
+    :meth:`str.splitlines` also splits at form feeds and other
+    characters like that.
+
+    >>> _split_lines('a\x0cb\r\nc\n')
+    ['a\x0cb\r\n', 'c\n']
+    >>> _split_lines('a\n\nb')
+    ['a\n', '\n', 'b']
+    >>> _split_lines('')
+    []
+    """
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        del lines[-1]
+    return lines
+
+
+def _search_file(path, regex, encoding):
+    # returns [(lineno, start_column, end_column, line)] or None
+    try:
+        with open(path, 'rb') as file:
+            if (os.fstat(file.fileno()).st_size >
+                    _trigramindex.MAX_FILE_SIZE):
+                return None
+            content = file.read()
+    except OSError:
+        return None
+
+    if b'\0' in content[:8192]:
+        return None     # binary file
+    try:
+        text = content.decode(encoding)
+    except UnicodeError:
+        return None
+
+    # most files don't match, and checking that is fast
+    if regex.search(text) is None:
+        return None
+
+    result = []
+    for lineno, line in enumerate(_split_lines(text), start=1):
+        line = line.rstrip('\n')
+        if line.endswith('\r'):
+            line = line[:-1]
+        for match in regex.finditer(line):
+            if match.start() != match.end():
+                result.append((lineno, match.start(), match.end(), line))
+    return result or None
+
+
+def _search_files(paths, pattern, flags, encoding):
+    """Search files in a worker process.
+
+    Returns a list of ``(path, matches)`` pairs for files that contain
+    matches. See ``_search_file`` for the format of *matches*.
+    """
+    regex = re.compile(pattern, flags)
+    result = []
+    for path in paths:
+        matches = _search_file(path, regex, encoding)
+        if matches is not None:
+            result.append((path, matches))
+    return result
+
+
+def _get_index_literals(text, is_regex, ignore_case, encoding):
+    # returns a list of bytes for TrigramIndex.find_candidates(), or None
+    # if the index can't be used
+    #
+    # the index contains bytes of files, so the literals must be encoded
+    # to the same bytes as they are in the files
+    if 'ab'.encode(encoding) != b'ab':
+        return None     # e.g. utf-16
+    utf8 = codecs.lookup(encoding).name in {'utf-8', 'utf-8-sig'}
+    ignore_case = ignore_case or (is_regex and '(?' in text)
+
+    result = []
+    for literal in (_trigramindex.required_literals(text) if is_regex
+                    else [text]):
+        if ignore_case:
+            # the index only knows ascii upper/lowercase, and the re
+            # module thinks that e.g. 'K' and the kelvin sign are the
+            # same letter when ignoring case
+            pieces = re.split('[ks]', literal, flags=re.IGNORECASE)
+        else:
+            pieces = [literal]
+        for piece in pieces:
+            if utf8 and not ignore_case:
+                result.append(piece.encode(encoding).lower())
+            elif all(ord(char) < 128 for char in piece):
+                result.append(piece.encode('ascii').lower())
+    return result
+
+
+def _find_with_index(root, index_literals, executor, result_queue,
+                     stop_event):
+    # returns a list of paths that need to be searched
+    paths = list(_iter_files(root, stop_event))
+    if stop_event.is_set():
+        return []
+
+    def progress_callback(done, total):
+        result_queue.put(('status', "Indexing... %d/%d files" % (
+            done, total)))
+
+    try:
+        index = _trigramindex.TrigramIndex(root)
+        try:
+            index.update(paths, executor, stop_event, progress_callback)
+            candidates = index.find_candidates(index_literals)
+        finally:
+            index.close()
+    except (OSError, sqlite3.Error):
+        log.exception("cannot use the trigram index of '%s'", root)
+        return paths
+    return [path for path in paths if path in candidates]
+
+
+def _walk_and_submit(root, pattern, flags, encoding, index_literals,
+                     result_queue, stop_event):
+    # this runs in a thread and puts these to result_queue:
+    #   ('batch', future)
+    #   ('status', text)
+    #   ('walked', number_of_files, number_of_batches)
+    #   ('error', traceback_string)
+    executor = _get_executor()
+    semaphore = threading.BoundedSemaphore(_MAX_PENDING_BATCHES)
+    futures = set()
+
+    def on_done(future):
+        semaphore.release()
+        futures.discard(future)
+        result_queue.put(('batch', future))
+
+    def submit(batch):
+        while not semaphore.acquire(timeout=0.1):
+            if stop_event.is_set():
+                return False
+        future = executor.submit(_search_files, batch, pattern, flags,
+                                 encoding)
+        futures.add(future)
+        future.add_done_callback(on_done)
+        return True
+
+    file_count = 0
+    batch_count = 0
+    batch = []
+    try:
+        if index_literals is None:
+            paths = _iter_files(root, stop_event)
+        else:
+            paths = _find_with_index(root, index_literals, executor,
+                                     result_queue, stop_event)
+
+        for path in paths:
+            file_count += 1
+            batch.append(path)
+            if len(batch) == _BATCH_SIZE:
+                if not submit(batch):
+                    break
+                batch_count += 1
+                batch = []
+
+        if batch and not stop_event.is_set() and submit(batch):
+            batch_count += 1
+    except Exception:
+        result_queue.put(('error', traceback.format_exc()))
+
+    if stop_event.is_set():
+        # the batches that haven't started yet are useless now
+        for future in list(futures):
+            future.cancel()
+    result_queue.put(('walked', file_count, batch_count))
+
+
+def _get_line_edits(old_lines, new_lines):
+    # returns [(first_line_index, end_line_index, new_text)] for turning
+    # old_lines into new_lines, unchanged lines are not in the result
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    return [(i1, i2, ''.join(new_lines[j1:j2]))
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != 'equal']
+
+
+def _compute_replacements(items, pattern, flags, replacement, is_regex,
+                          encoding):
+    """Replace in a worker process.
+
+    *items* is a list of ``(path, content)`` pairs, where *content* is
+    the text of an open tab or None for files that aren't open. Returns
+    a list of ``(path, digest, count, diff, new_content, line_edits)``
+    tuples for files that contain matches. *digest* is a hash of the
+    old content. Files that aren't open have *new_content* and tabs have
+    *line_edits* (see ``_get_line_edits``), the other one is None.
+    """
+    regex = re.compile(pattern, flags)
+    count = 0
+
+    # empty matches are ignored like in the find plugin
+    def replace(match):
+        nonlocal count
+        if match.start() == match.end():
+            return match.group(0)
+        count += 1
+        return match.expand(replacement) if is_regex else replacement
+
+    result = []
+    for path, content in items:
+        is_tab = (content is not None)
+        if not is_tab:
+            try:
+                with open(path, 'rb') as file:
+                    content_bytes = file.read()
+                content = content_bytes.decode(encoding)
+            except (OSError, UnicodeError):
+                continue
+        else:
+            content_bytes = content.encode('utf-8')
+
+        count = 0
+        new_content = regex.sub(replace, content)
+        if count == 0:
+            continue
+
+        old_lines = _split_lines(content)
+        new_lines = _split_lines(new_content)
+        diff = ''.join(
+            line if line.endswith('\n') else line + '\n'
+            for line in difflib.unified_diff(old_lines, new_lines,
+                                             path, path, n=2))
+
+        digest = hashlib.sha1(content_bytes).hexdigest()
+        if is_tab:
+            result.append((path, digest, count, diff, None,
+                           _get_line_edits(old_lines, new_lines)))
+        else:
+            result.append((path, digest, count, diff, new_content, None))
+    return result
+
+
+def _prepare_write(path, digest, new_content):
+    # returns (path, temporary_path, old_content)
+    with open(path, 'rb') as file:
+        old_content = file.read()
+    if hashlib.sha1(old_content).hexdigest() != digest:
+        raise ValueError("'%s' has changed after the preview" % path)
+
+    # the temporary file must be in the same directory for os.replace()
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path),
+        prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+    try:
+        with open(fd, 'wb') as file:
+            file.write(new_content)
+        shutil.copymode(path, temp_path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+    return (path, temp_path, old_content)
+
+
+def _restore_files(old_contents):
+    # old_contents is a list of (path, old_content) pairs
+    for path, old_content in old_contents:
+        try:
+            with open(path, 'wb') as file:
+                file.write(old_content)
+        except OSError:
+            log.exception("cannot restore '%s'", path)
+
+
+def _write_files(changes, encoding):
+    """Write ``(path, digest, new_content)`` changes atomically.
+
+    All files are changed or none of them are. This raises an exception
+    if something fails, and otherwise returns a list of
+    ``(path, old_content)`` pairs for :func:`_restore_files`.
+    """
+    # writing the temporary files is the slow part, and it's done in
+    # threads because it's waiting for the disk most of the time
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(_prepare_write, path, digest,
+                                   new_content.encode(encoding))
+                   for path, digest, new_content in changes]
+        concurrent.futures.wait(futures)
+
+    prepared = [future.result() for future in futures
+                if future.exception() is None]
+    errors = [future.exception() for future in futures
+              if future.exception() is not None]
+    if errors:
+        for path, temp_path, old_content in prepared:
+            os.remove(temp_path)
+        raise errors[0]
+
+    replaced = []
+    try:
+        for path, temp_path, old_content in prepared:
+            os.replace(temp_path, path)
+            replaced.append((path, old_content))
+    except OSError:
+        log.error("replacing failed, restoring %d files", len(replaced))
+        _restore_files(replaced)
+        for path, temp_path, old_content in prepared[len(replaced):]:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    return replaced
+
+
+def _edit_tab(tab, line_edits):
+    # like Finder.replace_all(), this is one undoable edit
+    text = tab.textwidget
+    text['autoseparators'] = False
+    text.edit_separator()
+    for first_line, end_line, new_text in reversed(line_edits):
+        text.delete('%d.0' % (first_line + 1), '%d.0' % (end_line + 1))
+        text.insert('%d.0' % (first_line + 1), new_text)
+    text.edit_separator()
+    text['autoseparators'] = True
+
+
+class ReplacePreviewTab(tabs.Tab):
+
+    def __init__(self, manager, changes, replace_callback):
+        super().__init__(manager)
+        self.title = "Replace Preview"
+
+        topframe = ttk.Frame(self)
+        topframe.pack(fill='x')
+        count = sum(change[2] for change in changes)
+        ttk.Label(topframe, text="Replacing %d occurences in %d files." % (
+            count, len(changes))).pack(side='left')
+        ttk.Button(topframe, text="Cancel", command=(
+            lambda: manager.close_tab(self))).pack(side='right')
+        self._apply_button = ttk.Button(topframe, text="Replace",
+                                        command=replace_callback)
+        self._apply_button.pack(side='right')
+
+        self._text = textwidget.ThemedText(self, width=1, height=1,
+                                           wrap='none', font='TkFixedFont')
+        self._text.pack(side='left', fill='both', expand=True)
+        scrollbar = ttk.Scrollbar(self, command=self._text.yview)
+        scrollbar.pack(side='left', fill='y')
+        self._text['yscrollcommand'] = scrollbar.set
+
+        self._text.tag_config('added', foreground='#00aa00')
+        self._text.tag_config('removed', foreground='#ff3333')
+        for change in changes:
+            for line in _split_lines(change[3]):
+                if line.startswith(('+++', '---', '@@')):
+                    tag = ()
+                elif line.startswith('+'):
+                    tag = 'added'
+                elif line.startswith('-'):
+                    tag = 'removed'
+                else:
+                    tag = ()
+                # diffs of files with \r\n line endings contain \r
+                self._text.insert('end - 1 char',
+                                  line.rstrip('\r\n') + '\n', tag)
+        self._text['state'] = 'disabled'
+
+    def on_focus(self):
+        self._apply_button.focus()
+
+    def set_busy(self, busy):
+        # the button must not be pressed again while writing files
+        self._apply_button['state'] = 'disabled' if busy else 'normal'
+
+
+class FindInFilesTab(tabs.Tab):
+
+    def __init__(self, manager, directory):
+        super().__init__(manager)
+        self.title = "Find in Files"
+
+        self._result_queue = None
+        self._stop_event = None
+        self._poll_id = None
+        self._file_count = None     # None until all files are found
+        self._batch_count = None
+        self._batches_done = 0
+        self._result_count = 0
+        self._root = None
+        self._status_text = None
+        self._search_args = None    # (pattern, flags, is_regex)
+        self._matched_paths = []
+        self._preview_tab = None
+
+        topframe = ttk.Frame(self)
+        topframe.pack(fill='x')
+        topframe.grid_columnconfigure(1, weight=1)
+
+        ttk.Label(topframe, text="Find:").grid(row=0, column=0, sticky='w')
+        self._find_entry = ttk.Entry(topframe, font='TkFixedFont')
+        self._find_entry.grid(row=0, column=1, columnspan=2, sticky='we')
+        self._find_entry.bind('<Return>', lambda event: self.start_search())
+
+        ttk.Label(topframe, text="Replace with:").grid(
+            row=1, column=0, sticky='w')
+        self._replace_entry = ttk.Entry(topframe, font='TkFixedFont')
+        self._replace_entry.grid(row=1, column=1, columnspan=2, sticky='we')
+
+        ttk.Label(topframe, text="In directory:").grid(
+            row=2, column=0, sticky='w')
+        self._directory_var = tkinter.StringVar(value=directory)
+        entry = ttk.Entry(topframe, textvariable=self._directory_var)
+        entry.grid(row=2, column=1, sticky='we')
+        entry.bind('<Return>', lambda event: self.start_search())
+        ttk.Button(topframe, text="Browse...",
+                   command=self._browse).grid(row=2, column=2)
+
+        optionframe = ttk.Frame(topframe)
+        optionframe.grid(row=3, column=0, columnspan=3, sticky='we')
+        self._ignore_case_var = tkinter.BooleanVar()
+        self._regex_var = tkinter.BooleanVar()
+        self._use_index_var = tkinter.BooleanVar()
+        ttk.Checkbutton(optionframe, text="Ignore case",
+                        variable=self._ignore_case_var).pack(side='left')
+        ttk.Checkbutton(optionframe, text="Regular expression",
+                        variable=self._regex_var).pack(side='left')
+        # the index makes searching the same directory again much faster,
+        # but creating it for the first time is slow
+        ttk.Checkbutton(optionframe, text="Use an index",
+                        variable=self._use_index_var).pack(side='left')
+        self._replace_button = ttk.Button(optionframe, text="Replace...",
+                                          command=self.preview_replace,
+                                          state='disabled')
+        self._replace_button.pack(side='right')
+        self._stop_button = ttk.Button(optionframe, text="Stop",
+                                       command=self.stop_search,
+                                       state='disabled')
+        self._stop_button.pack(side='right')
+        ttk.Button(optionframe, text="Search",
+                   command=self.start_search).pack(side='right')
+
+        self._statuslabel = ttk.Label(self)
+        self._statuslabel.pack(fill='x')
+
+        treeframe = ttk.Frame(self)
+        treeframe.pack(fill='both', expand=True)
+        self._tree = ttk.Treeview(treeframe, columns=['line'],
+                                  selectmode='browse')
+        self._tree.heading('#0', text="Where")
+        self._tree.heading('line', text="Line")
+        self._tree.column('#0', width=300, stretch=False)
+        self._tree.pack(side='left', fill='both', expand=True)
+        scrollbar = ttk.Scrollbar(treeframe, command=self._tree.yview)
+        scrollbar.pack(side='left', fill='y')
+        self._tree['yscrollcommand'] = scrollbar.set
+
+        # {treeview item id: (path, lineno, start_column, end_column)}
+        self._locations = {}
+        self._tree.bind('<ButtonRelease-1>', self._open_selected, add=True)
+        self._tree.bind('<Return>', self._open_selected, add=True)
+
+        self.bind('<Destroy>', self._cancel_search, add=True)
+
+    def on_focus(self):
+        self._find_entry.focus()
+
+    def _browse(self):
+        directory = filedialog.askdirectory(
+            initialdir=self._directory_var.get(), mustexist=True)
+        if directory:
+            self._directory_var.set(directory)
+
+    def _get_search_args(self):
+        # returns (pattern, flags, is_regex) or None
+        what = self._find_entry.get()
+        if not what:
+            self._statuslabel['text'] = "Cannot find an emptiness!"
+            return None
+
+        # the regex is passed to other processes as a pattern and flags
+        try:
+            regex = find._compile_regex(
+                what, regex=self._regex_var.get(),
+                ignore_case=self._ignore_case_var.get())
+        except re.error as e:
+            self._statuslabel['text'] = "Invalid regular expression: %s" % e
+            return None
+        return (regex.pattern, regex.flags, self._regex_var.get())
+
+    def start_search(self):
+        self.stop_search()
+        search_args = self._get_search_args()
+        if search_args is None:
+            return
+
+        root = self._directory_var.get()
+        if not os.path.isdir(root):
+            self._statuslabel['text'] = "'%s' is not a directory." % root
+            return
+
+        self._tree.delete(*self._tree.get_children())
+        self._locations.clear()
+        self._matched_paths.clear()
+        self._search_args = search_args
+        self._replace_button['state'] = 'disabled'
+
+        # the paths are compared with paths of tabs when replacing
+        root = os.path.abspath(root)
+        self._root = root
+        self._file_count = None
+        self._batch_count = None
+        self._batches_done = 0
+        self._result_count = 0
+        self._status_text = None
+        self.title = "Find in Files: %s" % self._find_entry.get()
+
+        encoding = settings.get_section('General')['encoding']
+        if self._use_index_var.get():
+            index_literals = _get_index_literals(
+                self._find_entry.get(), self._regex_var.get(),
+                self._ignore_case_var.get(), encoding)
+        else:
+            index_literals = None
+
+        self._result_queue = queue.Queue()
+        self._stop_event = threading.Event()
+        threading.Thread(target=_walk_and_submit, args=(
+            root, search_args[0], search_args[1], encoding, index_literals,
+            self._result_queue, self._stop_event), daemon=True).start()
+
+        self._stop_button['state'] = 'normal'
+        self._statuslabel['text'] = "Searching..."
+        self._poll_id = self.after(100, self._poll)
+
+    def _cancel_search(self, junk_event=None):
+        # this doesn't touch the child widgets because they're already
+        # destroyed when the tab's <Destroy> runs, returns True if the
+        # search was running
+        if self._stop_event is not None:
+            self._stop_event.set()
+            self._stop_event = None
+        if self._poll_id is None:
+            return False
+        self.after_cancel(self._poll_id)
+        self._poll_id = None
+        return True
+
+    def stop_search(self):
+        if self._cancel_search():
+            self._statuslabel['text'] = "Stopped. Found %d matches." % (
+                self._result_count)
+        self._stop_button['state'] = 'disabled'
+
+    def _add_results(self, results):
+        for path, matches in results:
+            self._matched_paths.append(path)
+            if self._result_count >= _MAX_RESULTS:
+                # the paths are still needed for replacing
+                self._result_count += len(matches)
+                continue
+            file_item = self._tree.insert(
+                '', 'end', text=os.path.relpath(path, self._root), open=True)
+            shown_count = _MAX_RESULTS - self._result_count
+            for lineno, start, end, line in matches[:shown_count]:
+                item = self._tree.insert(
+                    file_item, 'end', text="Line %d" % lineno,
+                    values=[line.strip()[:200]])
+                self._locations[item] = (path, lineno, start, end)
+            self._result_count += len(matches)
+
+    def _poll(self):
+        while True:
+            try:
+                message = self._result_queue.get(block=False)
+            except queue.Empty:
+                break
+
+            if message[0] == 'batch':
+                future = message[1]
+                self._batches_done += 1
+                self._status_text = None
+                if future.cancelled():
+                    continue
+                try:
+                    self._add_results(future.result())
+                except Exception:
+                    log.exception("searching files failed")
+            elif message[0] == 'status':
+                self._status_text = message[1]
+            elif message[0] == 'walked':
+                self._file_count, self._batch_count = message[1:]
+            else:
+                assert message[0] == 'error'
+                log.error("finding files in '%s' failed\n%s",
+                          self._root, message[1])
+
+        if (self._batch_count is not None and
+                self._batches_done >= self._batch_count):
+            self._poll_id = None
+            self.stop_search()
+            self._statuslabel['text'] = (
+                "Searched %d files and found %d matches."
+                % (self._file_count, self._result_count))
+            if self._result_count > _MAX_RESULTS:
+                self._statuslabel['text'] += (
+                    " Only the first %d matches are shown." % _MAX_RESULTS)
+            if self._matched_paths:
+                self._replace_button['state'] = 'normal'
+            return
+
+        if self._status_text is not None:
+            self._statuslabel['text'] = self._status_text
+        else:
+            self._statuslabel['text'] = (
+                "Searching... found %d matches so far."
+                % self._result_count)
+        self._poll_id = self.after(100, self._poll)
+
+    def preview_replace(self):
+        manager = get_tab_manager()
+        open_tabs = {tab.path: tab for tab in manager.tabs()
+                     if isinstance(tab, tabs.FileTab) and
+                     tab.path is not None}
+
+        # open tabs may have changes that aren't saved yet, and those
+        # must be used instead of what is in the files
+        items = []
+        for path in self._matched_paths:
+            if path in open_tabs:
+                items.append((path, open_tabs[path].textwidget.get(
+                    '1.0', 'end - 1 char')))
+            else:
+                items.append((path, None))
+
+        pattern, flags, is_regex = self._search_args
+        replacement = self._replace_entry.get()
+        if is_regex:
+            try:
+                re.compile(pattern, flags).sub(replacement, '')
+            except re.error as e:
+                self._statuslabel['text'] = "Invalid replacement: %s" % e
+                return
+        encoding = settings.get_section('General')['encoding']
+
+        def compute():
+            executor = _get_executor()
+            futures = [executor.submit(
+                _compute_replacements, items[i:i+_REPLACE_BATCH_SIZE],
+                pattern, flags, replacement, is_regex, encoding)
+                for i in range(0, len(items), _REPLACE_BATCH_SIZE)]
+            return [change for future in futures
+                    for change in future.result()]
+
+        self._replace_button['state'] = 'disabled'
+        self._statuslabel['text'] = "Computing replacements..."
+        utils.run_in_thread(compute, self._on_replacements_computed)
+
+    def _on_replacements_computed(self, success, result):
+        if not self.winfo_exists():
+            return      # the tab was closed
+        self._replace_button['state'] = 'normal'
+        if not success:
+            log.error("computing replacements failed\n%s", result)
+            utils.errordialog("Replacing failed",
+                              "Computing the replacements failed.", result)
+            return
+        if not result:
+            self._statuslabel['text'] = "Nothing to replace."
+            return
+
+        self._statuslabel['text'] = ''
+        manager = get_tab_manager()
+        if self._preview_tab is not None and self._preview_tab.winfo_exists():
+            manager.close_tab(self._preview_tab)
+        self._preview_tab = ReplacePreviewTab(
+            manager, result, (lambda: self._apply_replacements(result)))
+        manager.add_tab(self._preview_tab)
+
+    def _apply_replacements(self, changes):
+        manager = get_tab_manager()
+        open_tabs = {tab.path: tab for tab in manager.tabs()
+                     if isinstance(tab, tabs.FileTab) and
+                     tab.path is not None}
+
+        tab_changes = []
+        file_changes = []
+        for path, digest, count, diff, new_content, line_edits in changes:
+            if line_edits is None:
+                if path in open_tabs:
+                    # the file was opened after computing the changes
+                    utils.errordialog(
+                        "Replacing failed", "'%s' was opened after the "
+                        "preview was created. Nothing was changed." % path)
+                    return
+                file_changes.append((path, digest, new_content))
+                continue
+
+            tab = open_tabs.get(path)
+            content = (None if tab is None else
+                       tab.textwidget.get('1.0', 'end - 1 char'))
+            if (content is None or hashlib.sha1(
+                    content.encode('utf-8')).hexdigest() != digest):
+                utils.errordialog(
+                    "Replacing failed", "'%s' has changed or it was closed "
+                    "after the preview was created. Nothing was changed."
+                    % path)
+                return
+            tab_changes.append((tab, digest, line_edits))
+
+        encoding = settings.get_section('General')['encoding']
+        count = sum(change[2] for change in changes)
+        self._preview_tab.set_busy(True)
+
+        def on_restored(success, result):
+            if not success:
+                log.error("restoring files failed\n%s", result)
+
+        # the tabs are changed only if all files were written, so
+        # nothing needs to be undone in the tabs
+        def on_written(success, result):
+            if self._preview_tab is not None:
+                self._preview_tab.set_busy(False)
+            if not success:
+                log.error("replacing in files failed\n%s", result)
+                utils.errordialog(
+                    "Replacing failed", "Writing the files failed. "
+                    "Nothing was changed.", result)
+                return
+
+            # the user may have edited or closed the tabs while writing,
+            # and then the line edits would go to wrong places
+            for tab, digest, line_edits in tab_changes:
+                if not (tab.winfo_exists() and hashlib.sha1(
+                        tab.textwidget.get('1.0', 'end - 1 char').encode(
+                            'utf-8')).hexdigest() == digest):
+                    utils.run_in_thread(
+                        functools.partial(_restore_files, result),
+                        on_restored)
+                    utils.errordialog(
+                        "Replacing failed", "'%s' was changed or closed "
+                        "while writing the files. Nothing was changed."
+                        % tab.path)
+                    return
+
+            for tab, digest, line_edits in tab_changes:
+                _edit_tab(tab, line_edits)
+            if (self._preview_tab is not None and
+                    self._preview_tab.winfo_exists()):
+                manager.close_tab(self._preview_tab)
+            self._preview_tab = None
+            if self.winfo_exists():
+                self._replace_button['state'] = 'disabled'
+                self._statuslabel['text'] = (
+                    "Replaced %d occurences in %d files." % (
+                        count, len(changes)))
+
+        utils.run_in_thread(
+            functools.partial(_write_files, file_changes, encoding),
+            on_written)
+
+    def _open_selected(self, junk_event):
+        try:
+            [item] = self._tree.selection()
+            path, lineno, start, end = self._locations[item]
+        except (ValueError, KeyError):
+            return      # nothing selected, or a file item is selected
+
+        manager = get_tab_manager()
+        try:
+            tab = manager.add_tab(tabs.FileTab.open_file(manager, path))
+        except (OSError, UnicodeError):
+            log.exception("opening '%s' failed", path)
+            utils.errordialog("Opening failed",
+                              "Opening '%s' failed!" % path,
+                              traceback.format_exc())
+            return
+
+        tab.textwidget.tag_remove('sel', '1.0', 'end')
+        tab.textwidget.tag_add('sel', '%d.%d' % (lineno, start),
+                               '%d.%d' % (lineno, end))
+        tab.textwidget.mark_set('insert', '%d.%d' % (lineno, start))
+        tab.textwidget.see('insert')
+        tab.on_focus()
+
+
+def find_in_files():
+    manager = get_tab_manager()
+    selected = manager.select()
+    if isinstance(selected, tabs.FileTab) and selected.path is not None:
+        directory = os.path.dirname(selected.path)
+    else:
+        directory = os.getcwd()
+    manager.add_tab(FindInFilesTab(manager, directory))
+
+
+def setup():
+    actions.add_command("Edit/Find in Files", find_in_files,
+                        '<Control-F>')
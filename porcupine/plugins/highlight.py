@@ -9,13 +9,12 @@
 
 import multiprocessing
 import queue
-import tkinter.font as tkfont
 
-import pygments.styles
 import pygments.token
 import pygments.util   # only for ClassNotFound, the docs say that it's here
 
-from porcupine import filetypes, get_tab_manager, settings, tabs, utils
+from porcupine import (filetypes, get_tab_manager, settings, tabs,
+                       textwidget, utils)
 
 config = settings.get_section('General')
 
@@ -82,68 +81,25 @@ class Highlighter:
         self._get_filetype = filetype_getter
         self.pygmentizer = PygmentizerProcess()
 
-        # the tags use fonts from here
-        self._fonts = {}
-        for bold in (True, False):
-            for italic in (True, False):
-                # the fonts will be updated later, see _on_config_changed()
-                self._fonts[(bold, italic)] = tkfont.Font(
-                    weight=('bold' if bold else 'normal'),
-                    slant=('italic' if italic else 'roman'))
-
-        config.connect('pygments_style', self._on_config_changed,
-                       run_now=False)
-        config.connect('font_family', self._on_config_changed, run_now=False)
-        config.connect('font_size', self._on_config_changed, run_now=False)
-        self._on_config_changed()
+        # the fonts are shared and updated by porcupine.textwidget, so
+        # only the colors are updated here
+        config.connect('pygments_style', self._on_style_changed, idle=True)
         self.textwidget.after(50, self._do_highlights)
 
     def on_destroy(self, junk=None):
-        config.disconnect('pygments_style', self._on_config_changed)
-        config.disconnect('font_family', self._on_config_changed)
-        config.disconnect('font_size', self._on_config_changed)
+        config.disconnect('pygments_style', self._on_style_changed)
 
         #print("terminating", repr(self.pygmentizer.process))
         self.pygmentizer.process.terminate()
         #print("terminated", repr(self.pygmentizer.process))
 
-    def _on_config_changed(self, junk=None):
-        # when the font family or size changes, self.textwidget['font']
-        # also changes because it's a porcupine.textwiddet.ThemedText widget
-        fontobject = tkfont.Font(name=self.textwidget['font'], exists=True)
-        font_updates = fontobject.actual()
-        del font_updates['weight']     # ignore boldness
-        del font_updates['slant']      # ignore italicness
-
-        for (bold, italic), font in self._fonts.items():
-            # fonts don't have an update() method
-            for key, value in font_updates.items():
-                font[key] = value
-
-        # http://pygments.org/docs/formatterdevelopment/#styles
-        # all styles seem to yield all token types when iterated over,
-        # so we should always end up with the same tags configured
-        style = pygments.styles.get_style_by_name(config['pygments_style'])
-        for tokentype, infodict in style:
-            # this doesn't use underline and border
-            # i don't like random underlines in my code and i don't know
-            # how to implement the border with tkinter
-            key = (infodict['bold'], infodict['italic'])   # pep8 line length
-            kwargs = {'font': self._fonts[key]}
-            if infodict['color'] is None:
-                kwargs['foreground'] = ''    # reset it
-            else:
-                kwargs['foreground'] = '#' + infodict['color']
-            if infodict['bgcolor'] is None:
-                kwargs['background'] = ''
-            else:
-                kwargs['background'] = '#' + infodict['bgcolor']
-
-            self.textwidget.tag_config(str(tokentype), **kwargs)
+    def _on_style_changed(self, style_name):
+        for tag, kwargs in textwidget.get_token_tag_options(style_name):
+            self.textwidget.tag_config(tag, **kwargs)
 
             # make sure that the selection tag takes precedence over our
             # token tag
-            self.textwidget.tag_lower(str(tokentype), 'sel')
+            self.textwidget.tag_lower(tag, 'sel')
 
     # handle things from the highlighting process
     def _do_highlights(self):
@@ -1,6 +1,8 @@
 from porcupine import actions, get_main_window, get_tab_manager, tabs
 from . import connectdialog, gui
 
+activate_on = {'actions': ['IRC/Chat in IRC']}
+
 
 class IrcTab(tabs.Tab):
 
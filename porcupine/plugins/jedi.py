@@ -10,34 +10,200 @@ Or like this on other operating systems::
     python3 -m pip install --user jedi
 """
 
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import importlib.util
+import itertools
 import logging
 import os
+import weakref
+
 from porcupine import dirs, utils
 from porcupine.plugins import autocomplete
 
-try:
-    import jedi
-except ImportError:
+log = logging.getLogger(__name__)
+
+# importing jedi is slow, so it's imported only in the worker process
+# and this plugin can start the worker when porcupine starts
+_jedi_installed = (importlib.util.find_spec('jedi') is not None)
+if not _jedi_installed:
     # the space after the last \n is intentional, logging strips off
     # trailing newlines
-    logging.getLogger(__name__).exception(
+    log.error(
         "Jedi is not installed. You can install it like this:\n\n" +
         "    %s -m pip install --user jedi\n ", utils.short_python_command)
-    jedi = None
+
+# jedi runs in a separate process, so it doesn't slow down the gui even
+# though it holds the GIL most of the time, and the process is kept
+# alive so jedi's caches stay warm
+#
+# there's only one worker, so it runs everything in the order it was
+# submitted and it can remember the content of each tab
+_executor = None
+_PRELOADED_MODULES = ['builtins', 'os', 'sys', 're', 'collections',
+                      'functools', 'itertools', 'tkinter']
+
+# if more changes than this pile up, the whole content is sent instead
+_MAX_PENDING_CHANGES = 1000
+
+_tab_states = weakref.WeakKeyDictionary()   # {tab: _TabState}
+_tab_ids = itertools.count()
+
+# {tab_id: (change_number, list of lines)}, only used in the worker
+_worker_sources = {}
+
+
+def _warmup(cache_directory):
+    # this runs in the worker process before anything else
+    import jedi
+    jedi.settings.cache_directory = cache_directory
+    jedi.settings.case_insensitive_completion = False
+    jedi.preload_module(*_PRELOADED_MODULES)
+
+
+def _apply_changes(tab_id, changes):
+    # changes are (number, first_line, old_last_line, new_lines) tuples
+    # and first_line is None for replacing everything, this runs in the
+    # worker process
+    number, lines = _worker_sources.get(tab_id, (0, None))
+    for change_number, first, old_last, new_lines in changes:
+        if change_number <= number:
+            # the worker got this already with an earlier completion
+            continue
+        if first is None:
+            lines = list(new_lines)
+        else:
+            lines[first-1:old_last] = new_lines
+        number = change_number
+    _worker_sources[tab_id] = (number, lines)
+    return (number, lines)
+
+
+def _complete(tab_id, changes, line, column, path):
+    # this runs in the worker process, and returns the number of the
+    # last change it knows about and the completions
+    import jedi     # imported already in _warmup()
+    number, lines = _apply_changes(tab_id, changes)
+
+    # jedi reuses its parser caches for the same path, so parsing again
+    # is fast when only a few lines changed
+    script = jedi.Script('\n'.join(lines), line, column, path=path)
+    return (number, [c.complete for c in script.completions()])
+
+
+def _forget(tab_id):
+    _worker_sources.pop(tab_id, None)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        _executor.submit(_warmup, os.path.join(dirs.cachedir, 'jedi'))
+    return _executor
+
+
+class _TabState:
+
+    def __init__(self, tab):
+        self.tab_id = next(_tab_ids)
+        self.textwidget = tab.textwidget
+        self.change_number = 0
+        self.changes = []
+        self.acknowledged = 0    # set in a thread, but only increases
+        self.send_everything()
+
+        utils.bind_with_data(tab.textwidget, '<<LinesChanged>>',
+                             self._on_lines_changed, add=True)
+        tab.bind('<Destroy>', self._on_destroy, add=True)
+
+    def send_everything(self):
+        content = self.textwidget.get('1.0', 'end - 1 char')
+        self.change_number += 1
+        self.changes = [(self.change_number, None, None,
+                         content.split('\n'))]
+
+    def _on_lines_changed(self, event):
+        if len(self.changes) >= _MAX_PENDING_CHANGES:
+            self.send_everything()
+            return
+
+        first, old_last, new_last = map(int, event.data.split())
+        new_content = self.textwidget.get('%d.0' % first,
+                                          '%d.0 lineend' % new_last)
+        self.change_number += 1
+        self.changes.append((self.change_number, first, old_last,
+                             new_content.split('\n')))
+
+    def _on_destroy(self, event):
+        if _executor is not None:
+            try:
+                _executor.submit(_forget, self.tab_id)
+            except BrokenProcessPool:
+                # a new worker doesn't know about this tab anyway
+                pass
+
+    def pop_unacknowledged_changes(self):
+        # the worker already has the acknowledged changes, but the
+        # changes are kept until then in case a completion gets cancelled
+        self.changes = [change for change in self.changes
+                        if change[0] > self.acknowledged]
+        return self.changes
+
+
+def _restart_worker():
+    global _executor
+    log.warning("the jedi process died, starting a new one")
+    _executor = None
+    for state in list(_tab_states.values()):
+        state.acknowledged = 0
+        state.send_everything()
 
 
 def jedi_completer(tab):
-    source = tab.textwidget.get("1.0", "end - 1 char")
+    try:
+        state = _tab_states[tab]
+    except KeyError:
+        state = _tab_states[tab] = _TabState(tab)
+
     cursor_pos = tab.textwidget.index("insert")
     line, column = map(int, cursor_pos.split("."))
+    args = [_complete, state.tab_id, None, line, column, tab.path]
 
-    # the source is already unicode, so jedi doesn't need an encoding
-    script = jedi.Script(source, line, column, path=tab.path)
-    return (c.complete for c in script.completions())
+    try:
+        args[2] = state.pop_unacknowledged_changes()
+        worker_future = _get_executor().submit(*args)
+    except BrokenProcessPool:
+        _restart_worker()
+        args[2] = state.pop_unacknowledged_changes()
+        worker_future = _get_executor().submit(*args)
+
+    # autocomplete wants a future of completions, not the change number
+    result_future = concurrent.futures.Future()
+
+    def on_done(worker_future):
+        if worker_future.cancelled():
+            # porcupine is shutting down
+            result_future.cancel()
+            return
+        if worker_future.exception() is None:
+            number, completions = worker_future.result()
+            state.acknowledged = max(state.acknowledged, number)
+        if not result_future.set_running_or_notify_cancel():
+            return      # autocomplete gave up waiting
+        if worker_future.exception() is None:
+            result_future.set_result(completions)
+        else:
+            result_future.set_exception(worker_future.exception())
+
+    worker_future.add_done_callback(on_done)
+    return result_future
 
 
 def setup():
-    if jedi is not None:
-        jedi.settings.cache_directory = os.path.join(dirs.cachedir, 'jedi')
-        jedi.settings.case_insensitive_completion = False
+    if _jedi_installed:
         autocomplete.register_completer("Python", jedi_completer)
+
+        # start the worker and let it preload stuff while the user is
+        # doing something else
+        _get_executor()
@@ -1,19 +1,33 @@
 """Line numbers for tkinter's Text widget."""
 
-import functools
+import tkinter
 
-from porcupine import get_tab_manager, tabs, utils
-from porcupine.textwidget import ThemedText
+from porcupine import get_tab_manager, settings, tabs, utils
+from porcupine.textwidget import ThemedText, _get_themed_colors, measure
 
 
-class LineNumbers(ThemedText):
+class LineNumbers(tkinter.Canvas):
+    """A canvas that shows the line numbers of the visible lines.
+
+    Only the visible lines are drawn, so this is fast even with huge
+    files. Call :meth:`do_update` when the visible lines may have
+    changed.
+    """
 
     def __init__(self, parent, textwidget, **kwargs):
-        super().__init__(parent, width=6, height=1, **kwargs)
+        kwargs.setdefault('highlightthickness', 0)
+        kwargs.setdefault('height', 1)     # fill='y' makes it taller
+        super().__init__(parent, **kwargs)
         self.textwidget = textwidget
-        self.insert('1.0', " 1")    # this is always there
-        self['state'] = 'disabled'  # must be after the insert
-        self._linecount = 1
+        self._fg = 'black'
+        self._width = None
+        self._update_id = None
+
+        settings.get_section('General').connect(
+            'pygments_style', self._set_style, run_now=True, idle=True)
+        self.bind('<Destroy>', self._on_destroy, add=True)
+        self.bind('<Configure>', self.update_later, add=True)
+        textwidget.bind('<Configure>', self.update_later, add=True)
 
         self._clicked_place = None
         self.bind('<Button-1>', self._on_click, add=True)
@@ -21,21 +35,52 @@ class LineNumbers(ThemedText):
         self.bind('<Double-Button-1>', self._on_double_click, add=True)
         self.bind('<Button1-Motion>', self._on_drag, add=True)
 
+    def _on_destroy(self, event):
+        settings.get_section('General').disconnect(
+            'pygments_style', self._set_style)
+        if self._update_id is not None:
+            self.after_cancel(self._update_id)
+
+    def _set_style(self, name):
+        self._fg, self['bg'] = _get_themed_colors(name)
+        self.do_update()
+
+    def update_later(self, *junk):
+        """Run :meth:`do_update` when Tk is idle.
+
+        Calling this many times before that does only one update.
+        """
+        if self._update_id is None:
+            self._update_id = self.after_idle(self.do_update)
+
     def do_update(self, *junk):
-        """This should be ran when the line count changes."""
-        linecount = int(self.textwidget.index('end - 1 char').split('.')[0])
-        if linecount > self._linecount:
-            # add more linenumbers
-            self['state'] = 'normal'
-            for i in range(self._linecount + 1, linecount + 1):
-                self.insert('end - 1 char', '\n %d' % i)
-            self['state'] = 'disabled'
-        if linecount < self._linecount:
-            # delete the linenumbers we don't need
-            self['state'] = 'normal'
-            self.delete('%d.0 lineend' % linecount, 'end - 1 char')
-            self['state'] = 'disabled'
-        self._linecount = linecount
+        """This should be ran when the line count or scrolling changes."""
+        if self._update_id is not None:
+            self.after_cancel(self._update_id)
+            self._update_id = None
+
+        font = str(self.textwidget['font'])
+        first_line = int(self.textwidget.index('@0,0').split('.')[0])
+        last_line = int(self.textwidget.index(
+            '@0,%d' % self.textwidget.winfo_height()).split('.')[0])
+
+        # 5 digits are enough for most files, and the width doesn't
+        # change all the time when scrolling in a smaller file
+        digits = max(len(str(last_line)), 5)
+        width = measure('0' * (digits + 2), font)
+        if width != self._width:
+            self['width'] = self._width = width
+
+        self.delete('all')
+        for lineno in range(first_line, last_line + 1):
+            info = self.textwidget.dlineinfo('%d.0' % lineno)
+            if info is None:
+                # not visible, e.g. partially off-screen at the bottom
+                continue
+            x, y, w, h, baseline = info
+            self.create_text(width - measure('0', font), y,
+                             anchor='ne', text=str(lineno), font=font,
+                             fill=self._fg)
 
     def _on_click(self, event):
         # go to clicked line
@@ -71,18 +116,18 @@ class LineNumbers(ThemedText):
         return 'break'
 
 
-def _setup_scrolling(main_text, other_text):
-    # do nothing when mouse is wheeled on other_text
-    other_text['yscrollcommand'] = lambda start, end: (
-        other_text.yview_moveto(main_text.yview()[0]))
-
-    # also scroll other_text when main_text's scrolling position changes
+def _setup_scrolling(main_text, linenumbers):
+    # redraw the linenumbers when main_text's scrolling position changes
     old_command = main_text['yscrollcommand']   # a tcl command string
     assert isinstance(old_command, str)
-    main_text['yscrollcommand'] = lambda start, end: (
-        main_text.tk.call(old_command, start, end),
-        other_text.yview_moveto(start),
-    )
+    if old_command:
+        main_text['yscrollcommand'] = lambda start, end: (
+            main_text.tk.call(old_command, start, end),
+            linenumbers.update_later(),
+        )
+    else:
+        main_text['yscrollcommand'] = (
+            lambda start, end: linenumbers.update_later())
 
 
 def on_new_tab(event):
@@ -93,8 +138,9 @@ def on_new_tab(event):
     linenumbers = LineNumbers(tab.left_frame, tab.textwidget)
     linenumbers.pack(side='left', fill='y')
     _setup_scrolling(tab.textwidget, linenumbers)
-    tab.textwidget.bind('<<ContentChanged>>', linenumbers.do_update, add=True)
-    linenumbers.do_update()
+    tab.textwidget.bind('<<ContentChanged>>', linenumbers.update_later,
+                        add=True)
+    linenumbers.update_later()
 
 
 def setup():
@@ -102,8 +148,6 @@ def setup():
 
 
 if __name__ == '__main__':
-    import tkinter
-
     root = tkinter.Tk()
 
     text = ThemedText(root)
@@ -111,12 +155,7 @@ if __name__ == '__main__':
     linenumbers = LineNumbers(root, text)
     linenumbers.pack(side='left', fill='y')
 
-    def on_lineno_change(event):
-        text.after_idle(linenumbers.do_update)
-
-    # this isn't perfect but this is good enough for this test
-    text.bind('<Return>', on_lineno_change)
-    text.bind('<BackSpace>', on_lineno_change)
-    text.bind('<Delete>', on_lineno_change)
+    _setup_scrolling(text, linenumbers)
+    text.bind('<<ContentChanged>>', linenumbers.update_later, add=True)
 
     root.mainloop()
@@ -1,16 +1,30 @@
 """Maximum line length marker for Tkinter's text widget."""
 
+import functools
 import tkinter
-import tkinter.font as tkfont
 
-import pygments.styles
 import pygments.token
 
-from porcupine import get_tab_manager, settings, tabs, utils
+from porcupine import get_tab_manager, settings, tabs, textwidget, utils
 
 config = settings.get_section('General')
 
 
+# all markers use the same color, so it's computed once per style
+@functools.lru_cache(maxsize=8)
+def _get_marker_color(style_name):
+    # do the same thing as porcupine's color theme menu does
+    infos = dict(iter(textwidget.get_style(style_name)))
+    for tokentype in [pygments.token.Error, pygments.token.Name.Exception]:
+        if tokentype in infos:
+            for key in ['bgcolor', 'color', 'border']:
+                if infos[tokentype][key] is not None:
+                    return '#' + infos[tokentype][key]
+
+    # stupid fallback
+    return 'red'
+
+
 class LongLineMarker:
 
     def __init__(self, filetab):
@@ -22,9 +36,10 @@ class LongLineMarker:
         self._height = 0        # on_configure() will run later
 
     def setup(self):
-        config.connect('font_family', self.do_update, run_now=False)
-        config.connect('font_size', self.do_update, run_now=False)
-        config.connect('pygments_style', self.on_style_changed)
+        config.connect('font_family', self.do_update, run_now=False,
+                       idle=True)
+        config.connect('font_size', self.do_update, run_now=False, idle=True)
+        config.connect('pygments_style', self.on_style_changed, idle=True)
         self.tab.textwidget.bind('<Configure>', self.on_configure, add=True)
         self.tab.bind('<<FiletypeChanged>>', self.do_update, add=True)
         self.tab.bind('<Destroy>', self.on_destroy, add=True)
@@ -41,22 +56,12 @@ class LongLineMarker:
             # maximum line length is disabled, see filetypes.ini docs
             return
 
-        font = tkfont.Font(name=self.tab.textwidget['font'], exists=True)
-        where = font.measure(' ' * self.tab.filetype.max_line_length)
+        where = textwidget.measure(' ' * column,
+                                   str(self.tab.textwidget['font']))
         self.frame.place(x=where, height=self._height)
 
     def on_style_changed(self, name):
-        # do the same thing as porcupine's color theme menu does
-        infos = dict(iter(pygments.styles.get_style_by_name(name)))
-        for tokentype in [pygments.token.Error, pygments.token.Name.Exception]:
-            if tokentype in infos:
-                for key in ['bgcolor', 'color', 'border']:
-                    if infos[tokentype][key] is not None:
-                        self.frame['bg'] = '#' + infos[tokentype][key]
-                        return
-
-        # stupid fallback
-        self.frame['bg'] = 'red'
+        self.frame['bg'] = _get_marker_color(name)
 
     def on_configure(self, event):
         self._height = event.height
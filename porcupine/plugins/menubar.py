@@ -48,6 +48,14 @@ class MenubarHandler:
                 kwargs['accelerator'] = utils.get_keyboard_shortcut(
                     action.binding)
 
+            if action.path in self._items:
+                # a placeholder action was replaced with the real action
+                assert action.kind == 'command'
+                menu, index = self._items[action.path]
+                menu.entryconfig(index, command=action.callback, **kwargs)
+                self.on_enable_disable(action.path)
+                return
+
             if action.kind == 'command':
                 menu.add_command(command=action.callback, **kwargs)
             if action.kind == 'yesno':
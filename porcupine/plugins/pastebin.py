@@ -45,6 +45,21 @@ else:
 
 log = logging.getLogger(__name__)
 
+# importing requests is slow, so this plugin is set up when one of these
+# is used for the first time, keep this in sync with the @pastebin names
+# and the tabtypes in setup(), PromptTab can't be here because it's not
+# in porcupine.tabs
+activate_on = {
+    'actions': {
+        "Share/dpaste.com": {'tabtypes': ['FileTab']},
+        "Share/dpaste.de": {'tabtypes': ['FileTab']},
+        "Share/Ghostbin": {'tabtypes': ['FileTab']},
+        "Share/GitHub Gist": {'tabtypes': ['FileTab']},
+        "Share/Paste ofCode": {'tabtypes': ['FileTab']},
+        "Share/termbin.com": {'tabtypes': ['FileTab']},
+    },
+}
+
 _pastebins = {}
 
 
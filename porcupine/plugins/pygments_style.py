@@ -4,7 +4,7 @@ import threading
 
 import pygments.styles
 
-from porcupine import actions, get_main_window, settings
+from porcupine import _startupcache, actions, get_main_window, settings
 
 # TODO: here's old code that created colored menu items, add it back
 #        style = pygments.styles.get_style_by_name(name)
@@ -42,6 +42,14 @@ def load_styles_to_list(target_list):
 
 def setup():
     config = settings.get_section('General')
+
+    # the list of styles changes only when pygments is updated
+    styles = _startupcache.load('pygments_styles', pygments.__version__)
+    if styles is not None:
+        actions.add_choice(
+            "Color Styles", styles, var=config.get_var('pygments_style'))
+        return
+
     styles = []
     thread = threading.Thread(target=load_styles_to_list, args=[styles])
     thread.daemon = True     # i don't care wtf happens to this
@@ -51,6 +59,8 @@ def setup():
         if thread.is_alive():
             get_main_window().after(200, check_if_it_finished)
         else:
+            _startupcache.save('pygments_styles', pygments.__version__,
+                               styles)
             actions.add_choice(
                 "Color Styles", styles, var=config.get_var('pygments_style'))
 
@@ -5,7 +5,10 @@ import functools
 import json
 import logging
 import os
+import stat
 import sys
+import tempfile
+import threading
 import tkinter
 import tkinter.font as tkfont
 from tkinter import messagebox, ttk
@@ -66,8 +69,12 @@ class InvalidValue(Exception):
 
 
 # globals ftw
-_sections = {}
+_sections = collections.OrderedDict()   # in the same order as the tabs
 _loaded_json = {}
+_loaded = False
+
+# the dialog is created when it's shown for the first time, most of the
+# time it's never shown and creating the widgets would be a waste
 _dialog = None          # the "Porcupine Settings" window
 _notebook = None        # main widget in the dialog
 
@@ -89,16 +96,40 @@ def get_section(section_name):
 class _ConfigSection(collections.abc.MutableMapping):
 
     def __init__(self, name):
-        if _notebook is None:
+        if not _loaded:
             raise RuntimeError("%s.init() wasn't called" % __name__)
 
-        self.content_frame = ttk.Frame(_notebook)
-        _notebook.add(self.content_frame, text=name)
-
         self._name = name
         self._infos = {}        # see add_option()
         self._var_cache = {}
 
+        # functions that create widgets when the dialog is shown, they
+        # are called like creator(self.content_frame)
+        self._widget_creators = []
+        self._content_frame = None
+        if _notebook is not None:
+            self._create_content_frame()
+
+    def _create_content_frame(self):
+        self._content_frame = ttk.Frame(_notebook)
+        _notebook.add(self._content_frame, text=self._name)
+
+    def _create_widgets(self):
+        while self._widget_creators:
+            self._widget_creators.pop(0)(self.content_frame)
+
+    @property
+    def content_frame(self):
+        _create_dialog()
+        return self._content_frame
+
+    def _get_errorvar(self, key):
+        info = self._infos[key]
+        if info.errorvar is None:
+            # true when the triangle is showing
+            info.errorvar = tkinter.BooleanVar()
+        return info.errorvar
+
     def add_option(self, key, default, *, reset=True):
         """Add a new option without adding widgets to the setting dialog.
 
@@ -117,8 +148,10 @@ class _ConfigSection(collections.abc.MutableMapping):
         self._infos[key] = types.SimpleNamespace(
             default=default,        # not validated
             reset=reset,
-            callbacks=[],
-            errorvar=tkinter.BooleanVar(),  # true when the triangle is showing
+            # {callback: idle}, a dict makes disconnecting fast even if
+            # hundreds of tabs have connected something
+            callbacks=collections.OrderedDict(),
+            errorvar=None,      # see _get_errorvar()
         )
 
     def __setitem__(self, key, value):
@@ -133,19 +166,21 @@ class _ConfigSection(collections.abc.MutableMapping):
         if value != old_value:
             log.debug("%s: %r was set to %r, running callbacks",
                       self._name, key, value)
-            for func in info.callbacks:
+            # callbacks may disconnect things, so the dict is copied
+            for func, idle in list(info.callbacks.items()):
+                if idle:
+                    _add_idle_callback(func, self, key)
+                    continue
+
                 try:
                     func(value)
                 except InvalidValue as e:
                     _loaded_json[self._name][key] = old_value
                     raise e
                 except Exception:
-                    try:
-                        func_name = func.__module__ + '.' + func.__qualname__
-                    except AttributeError:
-                        func_name = repr(func)
                     log.exception("%s: %s(%r) didn't work", self._name,
-                                  func_name, value)
+                                  _get_func_name(func), value)
+            _schedule_save()
 
     def __getitem__(self, key):
         try:
@@ -173,7 +208,7 @@ class _ConfigSection(collections.abc.MutableMapping):
         """
         self[key] = self._infos[key].default
 
-    def connect(self, key, callback, run_now=True):
+    def connect(self, key, callback, run_now=True, *, idle=False):
         """
         Schedule ``callback(section[key])`` to be called when the value
         of an option changes.
@@ -187,26 +222,35 @@ class _ConfigSection(collections.abc.MutableMapping):
             the callback right away you need an explicit
             ``run_now=False``.
 
-        More than one callback can be connected to the same key.
+        If *idle* is True, the callback doesn't run right away when the
+        value changes. Instead, it runs when Tk is idle, and if the same
+        callback has been connected to several options with
+        ``idle=True``, it runs only once even if all of them change.
+        For example, setting ``font_family`` and ``font_size`` one after
+        another runs an idle callback connected to both of them once.
+        This is useful for things that are done in every tab, like
+        reconfiguring fonts. Idle callbacks cannot be used for
+        validating, and they get the value that the option has when they
+        run.
+
+        More than one callback can be connected to the same key, but
+        connecting the same callback to the same key twice does nothing.
         """
         if run_now:
             try:
                 callback(self[key])
             except InvalidValue:
-                try:
-                    func_name = (callback.__module__ + '.' +
-                                 callback.__qualname__)
-                except AttributeError:
-                    func_name = repr(callback)
                 log.warning(
                     "%s: %r value %r is invalid according to %s, resetting"
-                    % (self._name, key, self[key], func_name))
+                    % (self._name, key, self[key], _get_func_name(callback)))
                 self.reset(key)
-        self._infos[key].callbacks.append(callback)
+        self._infos[key].callbacks[callback] = idle
 
     def disconnect(self, key, callback):
         """Undo a :meth:`~connect` call."""
-        self._infos[key].callbacks.remove(callback)
+        del self._infos[key].callbacks[callback]
+        if _idle_callbacks.get(callback) == (self, key):
+            del _idle_callbacks[callback]
 
     # returns an image the same size as the triangle image, but empty
     @staticmethod
@@ -243,7 +287,7 @@ class _ConfigSection(collections.abc.MutableMapping):
                                 "times with different var types" % key)
             return self._var_cache[key]
 
-        info = self._infos[key]
+        errorvar = self._get_errorvar(key)
         var = var_type()
 
         def var2config(*junk):
@@ -252,16 +296,16 @@ class _ConfigSection(collections.abc.MutableMapping):
             except (tkinter.TclError, ValueError):
                 # example: var_type is IntVar and the actual value is 'lol'
                 # not-very-latest pythons use int() and raise ValueError
-                info.errorvar.set(True)
+                errorvar.set(True)
                 return
 
             try:
                 self[key] = value
             except InvalidValue:
-                info.errorvar.set(True)
+                errorvar.set(True)
                 return
 
-            info.errorvar.set(False)
+            errorvar.set(False)
 
         self.connect(key, var.set)      # runs var.set
         var.trace('w', var2config)
@@ -276,17 +320,23 @@ class _ConfigSection(collections.abc.MutableMapping):
         the value of the variable from :meth:`get_var` is invalid. The
         triangle label is packed with ``side='right'``.
 
-        For example, :meth:`add_checkbutton` works roughly like this::
+        For example, :meth:`add_checkbutton` works roughly like this
+        when the dialog is shown for the first time::
 
             frame = section.add_frame(key)
             var = section.get_var(key, tkinter.BooleanVar)
             ttk.Checkbutton(frame, text=text, variable=var).pack(side='left')
+
+        .. note::
+            Unlike the ``add_something()`` methods below, this creates
+            the setting dialog right away if it hasn't been created yet.
+            That's slow, so if you can, use the other methods instead.
         """
         frame = ttk.Frame(self.content_frame)
         frame.pack(fill='x')
 
         if triangle_key is not None:
-            errorvar = self._infos[triangle_key].errorvar
+            errorvar = self._get_errorvar(triangle_key)
             triangle_label = ttk.Label(frame)
             triangle_label.pack(side='right')
 
@@ -301,17 +351,31 @@ class _ConfigSection(collections.abc.MutableMapping):
 
         return frame
 
+    def _add_widget_creator(self, creator):
+        if self._content_frame is None:
+            self._widget_creators.append(creator)
+        else:
+            # the dialog exists already
+            creator(self._content_frame)
+
     def add_checkbutton(self, key, text):
         """Add a ``ttk.Checkbutton`` that sets an option to a bool."""
-        var = self.get_var(key, tkinter.BooleanVar)
-        ttk.Checkbutton(self.add_frame(key), text=text,
-                        variable=var).pack(side='left')
+        def create(content_frame):
+            var = self.get_var(key, tkinter.BooleanVar)
+            ttk.Checkbutton(self.add_frame(key), text=text,
+                            variable=var).pack(side='left')
+
+        self._add_widget_creator(create)
 
     def add_entry(self, key, text):
         """Add a ``ttk.Entry`` that sets an option to a string."""
-        frame = self.add_frame(key)
-        ttk.Label(frame, text=text).pack(side='left')
-        ttk.Entry(frame, textvariable=self.get_var(key)).pack(side='right')
+        def create(content_frame):
+            frame = self.add_frame(key)
+            ttk.Label(frame, text=text).pack(side='left')
+            ttk.Entry(frame, textvariable=self.get_var(key)).pack(
+                side='right')
+
+        self._add_widget_creator(create)
 
     def add_combobox(self, key, choices, text, *, case_sensitive=True):
         """Add a ``ttk.Combobox`` that sets an option to a string.
@@ -333,10 +397,13 @@ class _ConfigSection(collections.abc.MutableMapping):
 
         self.connect(key, validator)
 
-        frame = self.add_frame(key)
-        ttk.Label(frame, text=text).pack(side='left')
-        ttk.Combobox(frame, values=choices,
-                     textvariable=self.get_var(key)).pack(side='right')
+        def create(content_frame):
+            frame = self.add_frame(key)
+            ttk.Label(frame, text=text).pack(side='left')
+            ttk.Combobox(frame, values=choices,
+                         textvariable=self.get_var(key)).pack(side='right')
+
+        self._add_widget_creator(create)
 
     def add_spinbox(self, key, minimum, maximum, text):
         """
@@ -358,10 +425,49 @@ class _ConfigSection(collections.abc.MutableMapping):
 
         self.connect(key, validator)
 
-        frame = self.add_frame(key)
-        ttk.Label(frame, text=text).pack(side='left')
-        utils.Spinbox(frame, textvariable=self.get_var(key, tkinter.IntVar),
-                      from_=minimum, to=maximum).pack(side='right')
+        def create(content_frame):
+            frame = self.add_frame(key)
+            ttk.Label(frame, text=text).pack(side='left')
+            utils.Spinbox(frame,
+                          textvariable=self.get_var(key, tkinter.IntVar),
+                          from_=minimum, to=maximum).pack(side='right')
+
+        self._add_widget_creator(create)
+
+
+def _get_func_name(func):
+    try:
+        return func.__module__ + '.' + func.__qualname__
+    except AttributeError:
+        return repr(func)
+
+
+# {callback: (section, key)} for callbacks connected with idle=True
+_idle_callbacks = collections.OrderedDict()
+_idle_callback_id = None
+
+
+def _add_idle_callback(func, section, key):
+    global _idle_callback_id
+    _idle_callbacks[func] = (section, key)
+    if _idle_callback_id is None:
+        _idle_callback_id = porcupine.get_main_window().after_idle(
+            _run_idle_callbacks)
+
+
+def _run_idle_callbacks():
+    global _idle_callback_id
+    _idle_callback_id = None
+
+    # callbacks may add or disconnect other idle callbacks
+    while _idle_callbacks:
+        func, (section, key) = _idle_callbacks.popitem(last=False)
+        value = section[key]
+        try:
+            func(value)
+        except Exception:
+            log.exception("%s: %s(%r) didn't work", section._name,
+                          _get_func_name(func), value)
 
 
 def _needs_reset():
@@ -406,12 +512,11 @@ def _validate_pygments_style_name(name):
         raise InvalidValue(str(e)) from None
 
 
-def _init():
+def _create_dialog():
     global _dialog
     global _notebook
 
     if _dialog is not None:
-        # already initialized
         return
 
     _dialog = tkinter.Toplevel()
@@ -430,10 +535,24 @@ def _init():
     for text, command in [("Reset", _do_reset), ("OK", _dialog.withdraw)]:
         ttk.Button(buttonframe, text=text, command=command).pack(side='right')
 
+    for section in _sections.values():
+        section._create_content_frame()
+
+
+def _init():
+    global _loaded
+    global _written_json
+
+    if _loaded:
+        # already initialized
+        return
+    _loaded = True
+
     assert not _loaded_json
     try:
-        with open(os.path.join(dirs.configdir, 'settings.json'), 'r') as file:
-            _loaded_json.update(json.load(file))
+        with open(_get_json_path(), 'r') as file:
+            _written_json = file.read()
+        _loaded_json.update(json.loads(_written_json))
     except FileNotFoundError:
         pass      # use defaults everywhere
 
@@ -468,18 +587,20 @@ def _init():
     general.add_option('pygments_style', 'default', reset=False)
     general.connect('pygments_style', _validate_pygments_style_name)
 
-    filetypes = get_section('File Types')
-    label = ttk.Label(filetypes.content_frame, text=(
-        "Currently there's no GUI for changing filetype specific "
-        "settings, but they're stored in filetypes.ini and you can "
-        "edit it yourself."))
-    label.pack(fill='x')
-    filetypes.content_frame.bind(      # automatic wrapping
-        '<Configure>',
-        lambda event: label.config(wraplength=event.width),
-        add=True)
-
-    def edit_it():
+    def create_filetypes_widgets(content_frame):
+        label = ttk.Label(content_frame, text=(
+            "Currently there's no GUI for changing filetype specific "
+            "settings, but they're stored in filetypes.ini and you can "
+            "edit it yourself."))
+        label.pack(fill='x')
+        content_frame.bind(      # automatic wrapping
+            '<Configure>',
+            lambda event: label.config(wraplength=event.width),
+            add=True)
+        ttk.Button(content_frame, text="Edit filetypes.ini",
+                   command=edit_filetypes_ini).pack(anchor='center')
+
+    def edit_filetypes_ini():
         # porcupine/tabs.py imports this file
         # these local imports feel so evil xD  MUHAHAHAA!!!
         from porcupine import tabs
@@ -489,8 +610,7 @@ def _init():
         manager.add_tab(tabs.FileTab.open_file(manager, path))
         _dialog.withdraw()
 
-    ttk.Button(filetypes.content_frame, text="Edit filetypes.ini",
-               command=edit_it).pack(anchor='center')
+    get_section('File Types')._add_widget_creator(create_filetypes_widgets)
 
 
 def show_dialog():
@@ -499,10 +619,12 @@ def show_dialog():
     This function is called when the user opens the dialog from the menu.
     """
     _init()
+    _create_dialog()
 
     # hide sections with no widgets in the content_frame
     # add and hide preserve order and title texts
     for name, section in _sections.items():
+        section._create_widgets()
         if section.content_frame.winfo_children():
             _notebook.add(section.content_frame)
         else:
@@ -512,19 +634,120 @@ def show_dialog():
     _dialog.deiconify()
 
 
+# settings are saved this many milliseconds after the latest change, so
+# that e.g. ctrl+wheeling the font size to 20 doesn't write 10 times
+_SAVE_DELAY = 1000
+_save_timeout_id = None
+
+# writing is done in threads, and these are protected by _save_lock, but
+# it's never held while writing so the main thread doesn't need to wait
+# for the disk, and _write_lock makes threads write one at a time
+_save_lock = threading.Lock()
+_write_lock = threading.Lock()
+_latest_json = None       # json string that should be in the file
+_written_json = None      # json string that is in the file
+
+
+def _get_json_path():
+    return os.path.join(dirs.configdir, 'settings.json')
+
+
+def _write_latest_json():
+    global _written_json
+
+    with _write_lock:
+        with _save_lock:
+            json_string = _latest_json
+            if json_string == _written_json:
+                return
+
+        # the file is written to a temporary file first and then moved,
+        # so a crash in the middle of saving doesn't break settings.json
+        json_path = _get_json_path()
+        fd, temp_path = tempfile.mkstemp(
+            prefix='settings-', suffix='.tmp', dir=dirs.configdir)
+        try:
+            with open(fd, 'w') as file:
+                file.write(json_string)
+
+            # mkstemp() creates files that only the user can read
+            try:
+                mode = stat.S_IMODE(os.stat(json_path).st_mode)
+            except FileNotFoundError:
+                pass
+            else:
+                os.chmod(temp_path, mode)
+            os.replace(temp_path, json_path)
+        except BaseException as e:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise e
+
+        with _save_lock:
+            _written_json = json_string
+
+
+def _update_latest_json():
+    global _latest_json
+    global _save_timeout_id
+
+    if _save_timeout_id is not None:
+        porcupine.get_main_window().after_cancel(_save_timeout_id)
+        _save_timeout_id = None
+
+    # this must be done in the main thread because callbacks in the
+    # main thread may change _loaded_json
+    with _save_lock:
+        _latest_json = json.dumps(_loaded_json)
+        return _latest_json != _written_json
+
+
+def _save_in_thread():
+    global _save_timeout_id
+    _save_timeout_id = None
+    if not _update_latest_json():
+        return
+
+    def thread_target():
+        try:
+            _write_latest_json()
+        except Exception:
+            log.exception("saving '%s' failed", _get_json_path())
+
+    threading.Thread(target=thread_target, daemon=True).start()
+
+
+def _schedule_save():
+    global _save_timeout_id
+    if not _loaded:
+        return
+
+    root = porcupine.get_main_window()
+    if _save_timeout_id is not None:
+        root.after_cancel(_save_timeout_id)
+    _save_timeout_id = root.after(_SAVE_DELAY, _save_in_thread)
+
+
 def save():
     """Save the settings to the config file.
 
-    Note that :func:`porcupine.run` always calls this before it returns,
-    so usually you don't need to worry about this yourself.
+    Settings are saved automatically in another thread shortly after
+    they are changed, and :func:`porcupine.run` always calls this before
+    it returns, so usually you don't need to worry about this yourself.
+    Calling this is useful if you want to make sure that the file is
+    up to date right now; this function doesn't return until it is.
+
+    Nothing is written if the file wouldn't change.
     """
     if _loaded_json:
         # there's something to save
         # if two porcupines are running and the user changes settings
-        # differently in them, the settings of the one that's closed
-        # first are discarded
-        with open(os.path.join(dirs.configdir, 'settings.json'), 'w') as file:
-            json.dump(_loaded_json, file)
+        # differently in them, the settings of the one that saves last
+        # are used
+        if _update_latest_json():
+            _write_latest_json()
 
 
 # docs/settings.rst relies on this
@@ -471,9 +471,12 @@ bers.py>` use this attribute.
 
         self._save_hash = None
 
-        # path and filetype are set correctly below
-        # TODO: try to guess the filetype from the content when path is None
+        # path and filetype are set correctly below, and the filetype
+        # of a file without a path is guessed from the content after
+        # adding the content
         self._path = path
+        self._content_guess_id = None
+        self._filetype_is_explicit = False
         self._guess_filetype()          # this sets self._filetype
         self.bind('<<PathChanged>>', self._update_title, add=True)
         self.bind('<<PathChanged>>', self._guess_filetype, add=True)
@@ -493,6 +496,13 @@ bers.py>` use this attribute.
         if content:
             self.textwidget.insert('1.0', content)
             self.textwidget.edit_reset()   # reset undo/redo
+            if path is None:
+                self._guess_filetype_from_content()
+
+        # things like pasting to a new file don't have a path either
+        self.textwidget.bind('<<ContentChanged>>',
+                             self._schedule_content_guess, add=True)
+        self.bind('<Destroy>', self._cancel_content_guess, add=True)
 
         self.bind('<<PathChanged>>', self._update_status, add=True)
         self.bind('<<FiletypeChanged>>', self._update_status, add=True)
@@ -598,15 +608,63 @@ bers.py>` use this attribute.
 
     @filetype.setter
     def filetype(self, filetype):
-        # hopefully it's a real filetype object
+        # plugins set this when the user chooses a filetype
+        self._set_filetype(filetype, True)
+
+    def _set_filetype(self, filetype, explicit):
+        # hopefully it's a real filetype object, and explicit means that
+        # it wasn't guessed from the content so it must not be replaced
+        # with a guess
         self._filetype = filetype
+        self._filetype_is_explicit = explicit
         self.event_generate('<<FiletypeChanged>>')
 
     def _guess_filetype(self, junk=None):
         if self.path is None:
-            self.filetype = filetypes.get_filetype_by_name('DEFAULT')
+            self._set_filetype(filetypes.get_filetype_by_name('DEFAULT'),
+                               False)
+        else:
+            # a filetype from the file name is better than a guess
+            self._set_filetype(filetypes.guess_filetype(self.path), True)
+
+    def _needs_content_guess(self):
+        return (self.path is None and not self._filetype_is_explicit and
+                self.filetype is filetypes.get_filetype_by_name('DEFAULT'))
+
+    def _cancel_content_guess(self, junk=None):
+        if self._content_guess_id is not None:
+            self.after_cancel(self._content_guess_id)
+            self._content_guess_id = None
+
+    def _schedule_content_guess(self, junk=None):
+        # typing runs this on every key press, so wait for a break
+        self._cancel_content_guess()
+        if self._needs_content_guess():
+            self._content_guess_id = self.after(
+                500, self._guess_filetype_from_content)
+
+    def _guess_filetype_from_content(self):
+        self._content_guess_id = None
+        size = filetypes.CONTENT_SAMPLE_SIZE
+        head = self.textwidget.get('1.0', '1.0 + %d chars' % size)
+        if not head.strip():
+            return
+        if self.textwidget.compare(
+                '1.0 + %d chars' % (2*size), '<', 'end - 1 char'):
+            tail = self.textwidget.get('end - %d chars' % (size + 1),
+                                       'end - 1 char')
+            sample = head + '\n' + tail
         else:
-            self.filetype = filetypes.guess_filetype(self.path)
+            sample = self.textwidget.get('1.0', 'end - 1 char')
+
+        def on_guessed(filetype):
+            # the user might have saved the file or closed the tab
+            # while guessing
+            if (filetype is not None and self.winfo_exists() and
+                    self._needs_content_guess()):
+                self._set_filetype(filetype, False)
+
+        filetypes.guess_filetype_from_content(sample, on_guessed)
 
     def _update_title(self, junk=None):
         text = 'New File' if self.path is None else os.path.basename(self.path)
@@ -7,6 +7,168 @@ import pygments.styles
 from porcupine import settings, utils
 
 
+# every text widget's Tcl command is replaced with this, and it generates
+# <<LinesChanged>> when the text is changed in any way, including key
+# bindings that Tk runs without going through python
+#
+# the data is "first_line old_last_line new_last_line"
+_PROXY_TCL = r'''
+proc ::porcupine_text_proxy {widget inner subcommand args} {
+    if {$subcommand ni {insert delete replace} || [llength $args] == 0} {
+        return [uplevel 1 [list $inner $subcommand {*}$args]]
+    }
+
+    if {$subcommand eq "insert"} {
+        set indexes [lrange $args 0 0]
+    } elseif {$subcommand eq "replace"} {
+        set indexes [lrange $args 0 1]
+    } elseif {[llength $args] == 1} {
+        set indexes [list [lindex $args 0] "[lindex $args 0] + 1 char"]
+    } else {
+        set indexes $args
+    }
+
+    # 'end' is after the last line, but nothing can be inserted there
+    set old_end [lindex [split [$inner index end] .] 0]
+    set first $old_end
+    set last 0
+    foreach index $indexes {
+        set line [lindex [split [$inner index $index] .] 0]
+        if {$line >= $old_end} {
+            set line [expr {$old_end - 1}]
+        }
+        if {$line < $first} { set first $line }
+        if {$line > $last} { set last $line }
+    }
+
+    set result [uplevel 1 [list $inner $subcommand {*}$args]]
+    set new_end [lindex [split [$inner index end] .] 0]
+    event generate $widget <<LinesChanged>> \
+        -data [list $first $last [expr {$last + $new_end - $old_end}]]
+    return $result
+}
+'''
+
+# fonts, text widths and style colors are the same in all tabs, so they
+# are computed once here instead of once per tab
+_fonts = {}             # {(bold, italic): tkfont.Font}
+_widths = {}            # {(font_name, text): width in pixels}
+
+
+def _on_font_changed(junk=None):
+    # settings.py updates TkFixedFont before this runs
+    _widths.clear()
+
+    font_updates = tkfont.Font(name='TkFixedFont', exists=True).actual()
+    del font_updates['weight']     # ignore boldness
+    del font_updates['slant']      # ignore italicness
+    for font in _fonts.values():
+        # fonts don't have an update() method
+        for key, value in font_updates.items():
+            font[key] = value
+
+
+def _create_fonts():
+    for bold in (True, False):
+        for italic in (True, False):
+            _fonts[(bold, italic)] = tkfont.Font(
+                weight=('bold' if bold else 'normal'),
+                slant=('italic' if italic else 'roman'))
+
+    # these are not idle callbacks because things that use the fonts
+    # may run before idle callbacks
+    config = settings.get_section('General')
+    config.connect('font_family', _on_font_changed, run_now=False)
+    config.connect('font_size', _on_font_changed, run_now=False)
+    _on_font_changed()
+
+
+def get_font(bold=False, italic=False):
+    """Return a ``tkinter.font.Font`` that is shared by all tabs.
+
+    The font family and size are always the same as in ``TkFixedFont``,
+    and they are updated when the user changes them. Use this instead
+    of creating new font objects for each tab.
+    """
+    if not _fonts:
+        _create_fonts()
+    return _fonts[(bold, italic)]
+
+
+def measure(text, font='TkFixedFont'):
+    """Return the width of *text* in pixels when displayed with *font*.
+
+    The *font* must be the name of an existing font. Things like
+    ``textwidget['font']`` are Tcl objects instead of strings, but they
+    work too. The results are cached until the font family or size
+    changes.
+    """
+    font = str(font)
+    if not _fonts:
+        _create_fonts()     # this also connects _on_font_changed
+    try:
+        return _widths[(font, text)]
+    except KeyError:
+        width = tkfont.Font(name=font, exists=True).measure(text)
+        _widths[(font, text)] = width
+        return width
+
+
+@functools.lru_cache(maxsize=8)
+def get_style(name):
+    """Like ``pygments.styles.get_style_by_name``, but cached."""
+    return pygments.styles.get_style_by_name(name)
+
+
+@functools.lru_cache(maxsize=8)
+def get_token_tag_options(style_name):
+    """Return a list of ``(tag_name, tag_config_kwargs)`` pairs.
+
+    The tag names are strings of Pygments token types, and the fonts in
+    the kwargs come from :func:`get_font`. The lists are cached, so
+    don't modify them.
+    """
+    result = []
+
+    # http://pygments.org/docs/formatterdevelopment/#styles
+    # all styles seem to yield all token types when iterated over,
+    # so we should always end up with the same tags configured
+    for tokentype, infodict in get_style(style_name):
+        # this doesn't use underline and border
+        # i don't like random underlines in my code and i don't know
+        # how to implement the border with tkinter
+        kwargs = {'font': get_font(infodict['bold'], infodict['italic'])}
+        if infodict['color'] is None:
+            kwargs['foreground'] = ''    # reset it
+        else:
+            kwargs['foreground'] = '#' + infodict['color']
+        if infodict['bgcolor'] is None:
+            kwargs['background'] = ''
+        else:
+            kwargs['background'] = '#' + infodict['bgcolor']
+        result.append((str(tokentype), kwargs))
+
+    return result
+
+
+@functools.lru_cache(maxsize=8)
+def _get_themed_colors(style_name):
+    style = get_style(style_name)
+    bg = style.background_color
+
+    # yes, style.default_style can be '#rrggbb', '' or nonexistent
+    # this is undocumented
+    #
+    #   >>> from pygments.styles import *
+    #   >>> [getattr(get_style_by_name(name), 'default_style', '???')
+    #   ...  for name in get_all_styles()]
+    #   ['', '', '', '', '', '', '???', '???', '', '', '', '',
+    #    '???', '???', '', '#cccccc', '', '', '???', '', '', '', '',
+    #    '#222222', '', '', '', '???', '']
+    fg = getattr(style, 'default_style', '') or utils.invert_color(bg)
+    return (fg, bg)
+
+
 class HandyText(tk.Text):
     """Like ``tkinter.Text``, but with some handy features.
 
@@ -32,11 +194,38 @@ class HandyText(tk.Text):
         it's moved with a method of the text widget. Use
         ``textwidget.index('insert')`` to find the current cursor
         position.
+
+    .. virtualevent:: LinesChanged
+
+        Unlike :virtevt:`~ContentChanged`, this event is generated right
+        away for each insert, delete or replace, and it tells which
+        lines changed. Use :func:`porcupine.utils.bind_with_data` to
+        bind this, and ``event.data`` is a string of three integers like
+        ``'12 14 13'``. That means that lines 12 to 14 (inclusive) of the
+        old content became lines 12 to 13 of the new content, and other
+        lines didn't change. The line numbers may cover more lines than
+        actually changed.
+
+        This is useful for keeping something up to date without looking
+        at the whole content every time something changes.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        if not self.tk.call('info', 'procs', '::porcupine_text_proxy'):
+            self.tk.eval(_PROXY_TCL)
+        inner = self._w + '_porcupine_inner'
+        self.tk.call('rename', self._w, inner)
+        self.tk.call('interp', 'alias', '', self._w, '',
+                     '::porcupine_text_proxy', self._w, inner)
+
+        def delete_proxy(event):
+            if event.widget is self:
+                self.tk.call('rename', self._w, '')
+
+        self.bind('<Destroy>', delete_proxy, add=True)
+
         def cursor_move(event):
             self.after_idle(self.cursor_has_moved)
 
@@ -135,7 +324,7 @@ class ThemedText(HandyText):
 
     You can use this class just like :class:`.HandyText`, it takes care
     of switching the colors by itself. This is useful for things like
-    :source:`porcupine/plugins/linenumbers.py`.
+    the replace preview in :source:`porcupine/plugins/find_in_files.py`.
 
     .. seealso::
         Syntax highlighting is implemented with Pygments in
@@ -145,7 +334,7 @@ class ThemedText(HandyText):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         settings.get_section('General').connect(
-            'pygments_style', self._set_style, run_now=True)
+            'pygments_style', self._set_style, run_now=True, idle=True)
 
         def on_destroy(event):
             settings.get_section('General').disconnect(
@@ -154,20 +343,7 @@ class ThemedText(HandyText):
         self.bind('<Destroy>', on_destroy, add=True)
 
     def _set_style(self, name):
-        style = pygments.styles.get_style_by_name(name)
-        bg = style.background_color
-
-        # yes, style.default_style can be '#rrggbb', '' or nonexistent
-        # this is undocumented
-        #
-        #   >>> from pygments.styles import *
-        #   >>> [getattr(get_style_by_name(name), 'default_style', '???')
-        #   ...  for name in get_all_styles()]
-        #   ['', '', '', '', '', '', '???', '???', '', '', '', '',
-        #    '???', '???', '', '#cccccc', '', '', '???', '', '', '', '',
-        #    '#222222', '', '', '', '???', '']
-        fg = getattr(style, 'default_style', '') or utils.invert_color(bg)
-
+        fg, bg = _get_themed_colors(name)
         self['fg'] = fg
         self['bg'] = bg
         self['insertbackground'] = fg  # cursor color
@@ -231,8 +407,8 @@ class MainText(ThemedText):
         #
         # my version is kind of minimal compared to that example, but it
         # seems to work :)
-        font = tkfont.Font(name=self['font'], exists=True)
-        self['tabs'] = str(font.measure(' ' * filetype.indent_size))
+        self['tabs'] = str(measure(' ' * filetype.indent_size,
+                                   str(self['font'])))
 
     def _on_delete(self, control_down, event, shifted=False):
         """This runs when the user presses backspace or delete."""
@@ -5,19 +5,20 @@
 # see also update(3tcl)
 
 import atexit
+import os
 import shutil
 import tempfile
-import tkinter
 
 import pytest
 
-# these must be after the above hack
-from porcupine import _session, dirs, get_main_window, get_tab_manager
+import porcupine
+from porcupine import dirs, get_main_window, get_tab_manager
 from porcupine import filetypes as filetypes_module
 
 # TODO: something else will be needed when testing the filetypes
 tempdir = tempfile.mkdtemp()
-dirs.configdir = tempdir
+dirs.configdir = os.path.join(tempdir, 'config')
+dirs.cachedir = os.path.join(tempdir, 'cache')
 atexit.register(shutil.rmtree, tempdir)
 del tempdir
 
@@ -31,21 +32,20 @@ def porcusession():
     with pytest.raises(RuntimeError):
         get_tab_manager()
 
-    root = tkinter.Tk()
-    root.withdraw()
-    _session.init(root)
+    # init() creates the main window and calls filetypes._init()
+    porcupine.init()
+    get_main_window().withdraw()
     yield
-    _session.quit()
+    porcupine.quit()
 
 
 @pytest.fixture(scope='session')
 def filetypes(porcusession):
-    filetypes_module._init()
     return filetypes_module   # avoid importing as filetypes_module elsewhere
 
 
 @pytest.fixture
 def tabmanager(porcusession):
-    assert not get_tab_manager().tabs, "something hasn't cleaned up its tabs"
+    assert not get_tab_manager().tabs(), "something hasn't cleaned up its tabs"
     yield get_tab_manager()
-    assert not get_tab_manager().tabs, "the test didn't clean up its tabs"
+    assert not get_tab_manager().tabs(), "the test didn't clean up its tabs"
@@ -239,3 +239,38 @@ def test_filetype_names(porcusession, tabmanager, action_path, filetypes):
     tabmanager.close_tab(othertab)
     tabmanager.update()
     assert not action.enabled
+
+
+def test_placeholder(porcusession, action_path):
+    ran = []
+
+    with action_events() as (new_events, enable_events, disable_events):
+        placeholder = actions._add_placeholder(
+            action_path, (lambda: actions.get_action(action_path).callback()))
+        assert new_events.pop().data == action_path
+        assert actions._is_placeholder(action_path)
+
+        # replacing lets plugins like the menubar update their stuff
+        action = actions.add_command(action_path, (lambda: ran.append(1)))
+        assert new_events.pop().data == action_path
+        assert not actions._is_placeholder(action_path)
+        assert actions.get_action(action_path) is action
+
+        placeholder.callback()
+        assert ran == [1]
+
+        with pytest.raises(RuntimeError):
+            actions.add_command(action_path, print)   # exists already
+
+
+def test_placeholder_binding(porcusession, action_path):
+    ran = []
+    binding = '<<PlaceholderTest%s>>' % action_path.replace('/', '')
+    actions._add_placeholder(
+        action_path, (lambda: actions.get_action(action_path).callback()),
+        keyboard_binding=binding)
+    actions.add_command(action_path, (lambda: ran.append(1)), binding)
+
+    # the binding of the placeholder runs the new callback only once
+    get_main_window().event_generate(binding)
+    assert ran == [1]
@@ -0,0 +1,54 @@
+import os
+import uuid
+
+from porcupine import dirs
+
+
+def test_guess_filetype(filetypes, tmpdir):
+    def guess(filename):
+        return filetypes.guess_filetype(os.path.join(str(tmpdir), filename))
+
+    assert guess('hello.py').name == 'Python'
+    assert guess('hello.c').name == 'C'
+    assert guess('Makefile').name == 'Makefile'
+    assert guess('Makefile.am').name == 'Makefile'
+    assert guess('README.markdown').name == 'Markdown'
+    # pygments knows about lots of file extensions, e.g. .wat is WebAssembly
+    unknown = '%s.unknown-extension-%s' % (uuid.uuid4(), uuid.uuid4().hex)
+    assert guess(unknown).name == 'DEFAULT'
+
+    # the pygments fallback creates new filetypes, but only once
+    ruby = guess('hello.rb')
+    assert ruby.name == 'Ruby (not from filetypes.ini)'
+    assert guess('hello2.rb') is ruby
+    assert ruby in filetypes.get_all_filetypes()
+
+    tmpdir.join('script').write('#!/usr/bin/env python3 -u\nprint(1)\n')
+    assert guess('script').name == 'Python'
+
+    ini = os.path.join(dirs.configdir, 'filetypes.ini')
+    assert filetypes.guess_filetype(ini).name == 'Porcupine filetypes.ini'
+
+
+def test_lexers_are_loaded_lazily(filetypes):
+    for filetype in filetypes.get_all_filetypes():
+        # plugins like highlight aren't loaded in the tests, so nothing
+        # has used the lexer yet and it must not be imported yet
+        assert filetype._pygments_lexer_class is None
+
+        lexer = filetype.get_lexer()
+        assert filetype._pygments_lexer_class is not None
+        assert type(lexer) is filetype._pygments_lexer_class
+
+
+def test_guess_from_content(filetypes):
+    def guess(content):
+        lexer_class = filetypes._get_cached_lexer_class_from_content(content)
+        if lexer_class is None:
+            return None
+        return filetypes._find_filetype_by_lexer_class(lexer_class).name
+
+    assert guess('# vim: set ft=python:\nprint(1)\n') == 'Python'
+    assert guess('#include <stdio.h>\nint main(void) {}\n') == 'C'
+    assert guess('import os\n\ndef main():\n    pass\n') == 'Python'
+    assert guess('hello world') is None